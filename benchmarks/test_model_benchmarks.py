@@ -0,0 +1,191 @@
+"""
+Benchmarks for simulation speed: model construction, step throughput,
+data collection, and complete batch runs.
+
+Not run with the unit tests; run with pytest-benchmark, and save results
+as JSON so they can be compared across runs::
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare
+
+Step benchmarks report throughput in agent-steps per second in the
+benchmark ``extra_info``.
+"""
+
+import pytest
+
+from simulatingrisk.hawkdove.model import HawkDoveSingleRiskModel
+from simulatingrisk.hawkdovemulti.array_model import (
+    HawkDoveMultipleRiskArrayModel,
+    ReplicateBatch,
+)
+from simulatingrisk.hawkdovemulti.batch_run import RunArgs, run_hawkdovemulti_model
+from simulatingrisk.hawkdovemulti.model import (
+    DataCollectionSchedule,
+    HawkDoveMultipleRiskModel,
+)
+from simulatingrisk.risky_bet.model import RiskyBetModel
+from simulatingrisk.risky_food.model import RiskyFoodModel
+
+pytest.importorskip("pytest_benchmark")
+
+grid_sizes = [10, 25, 50, 100]
+neighborhood_sizes = [4, 8, 24]
+
+#: number of timed steps for each grid size, so large grids don't take too long
+step_rounds = {10: 100, 25: 30, 50: 10, 100: 5}
+
+
+def hawkdove_single(grid_size, neighborhood=8):
+    return HawkDoveSingleRiskModel(
+        grid_size,
+        agent_risk_level=4,
+        play_neighborhood=neighborhood,
+        observed_neighborhood=neighborhood,
+        seed=1,
+    )
+
+
+def hawkdove_multi(grid_size, neighborhood=8, model_class=HawkDoveMultipleRiskModel):
+    return model_class(
+        grid_size,
+        risk_adjustment="adopt",
+        adjust_every=10,
+        play_neighborhood=neighborhood,
+        observed_neighborhood=neighborhood,
+        adjust_neighborhood=neighborhood,
+        seed=1,
+    )
+
+
+def hawkdove_multi_array(grid_size, neighborhood=8):
+    return hawkdove_multi(grid_size, neighborhood, HawkDoveMultipleRiskArrayModel)
+
+
+#: hawk/dove models, which support neighborhood sizes
+hawkdove_models = {
+    "hawkdove": hawkdove_single,
+    "hawkdovemulti": hawkdove_multi,
+    "hawkdovemulti-array": hawkdove_multi_array,
+}
+
+#: models with grid size only
+grid_models = {
+    "risky_bet": lambda grid_size: RiskyBetModel(grid_size),
+}
+
+
+def record_throughput(benchmark, num_agents):
+    """record number of agents and throughput in agent-steps per second"""
+    benchmark.extra_info["agents"] = num_agents
+    # no timing stats when benchmarks are disabled (--benchmark-disable)
+    if benchmark.stats:
+        benchmark.extra_info["agent_steps_per_second"] = (
+            num_agents / benchmark.stats.stats.mean
+        )
+
+
+def benchmark_steps(benchmark, model, rounds):
+    """time model steps, and record throughput in agent-steps per second"""
+    # first steps may be unrepresentative (e.g., initial random choice)
+    for _ in range(2):
+        model.step()
+    benchmark.pedantic(model.step, rounds=rounds, warmup_rounds=1)
+    record_throughput(benchmark, len(model.schedule.agents) or model.num_agents)
+
+
+@pytest.mark.parametrize("neighborhood", neighborhood_sizes)
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize("model_name", hawkdove_models.keys())
+def test_hawkdove_step(benchmark, model_name, grid_size, neighborhood):
+    benchmark.group = f"step {model_name}"
+    model = hawkdove_models[model_name](grid_size, neighborhood)
+    benchmark_steps(benchmark, model, step_rounds[grid_size])
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize("model_name", grid_models.keys())
+def test_grid_model_step(benchmark, model_name, grid_size):
+    benchmark.group = f"step {model_name}"
+    model = grid_models[model_name](grid_size)
+    benchmark_steps(benchmark, model, step_rounds[grid_size])
+
+
+@pytest.mark.parametrize("grid_size", [10, 25])
+@pytest.mark.parametrize("replicates", [1, 8, 32])
+def test_replicate_batch_step(benchmark, replicates, grid_size):
+    # throughput is for agents in all replicates
+    benchmark.group = f"step replicate batch {grid_size}"
+    batch = ReplicateBatch(
+        [
+            HawkDoveMultipleRiskArrayModel(
+                grid_size, risk_adjustment="adopt", adjust_every=10, seed=seed
+            )
+            for seed in range(replicates)
+        ]
+    )
+    for _ in range(2):
+        batch.step()
+    benchmark.pedantic(batch.step, rounds=step_rounds[grid_size], warmup_rounds=1)
+    record_throughput(benchmark, replicates * grid_size * grid_size)
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+def test_risky_food_step(benchmark, grid_size):
+    # population changes every step, so time the first step of a new
+    # model with the same number of agents as the grid models
+    benchmark.group = "step risky_food"
+    num_agents = grid_size * grid_size
+    benchmark.pedantic(
+        lambda model: model.step(),
+        setup=lambda: ((RiskyFoodModel(num_agents, mode="range"),), {}),
+        rounds=step_rounds[grid_size],
+    )
+    record_throughput(benchmark, num_agents)
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize(
+    "model_name", list(hawkdove_models.keys()) + list(grid_models.keys())
+)
+def test_model_init(benchmark, model_name, grid_size):
+    benchmark.group = f"init {model_name}"
+    init_model = hawkdove_models.get(model_name) or grid_models[model_name]
+    benchmark.pedantic(init_model, args=(grid_size,), rounds=3)
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize(
+    "model_class", [HawkDoveMultipleRiskModel, HawkDoveMultipleRiskArrayModel]
+)
+def test_collect_data(benchmark, model_class, grid_size):
+    # collect all model and agent data for a single step
+    benchmark.group = f"collect_data {model_class.__name__}"
+    model = model_class(
+        grid_size,
+        risk_adjustment="adopt",
+        data_collection_schedule=DataCollectionSchedule.ALL,
+        collect_agent_data=True,
+        seed=1,
+    )
+    model.step()
+    benchmark.pedantic(model.collect_data, rounds=step_rounds[grid_size])
+
+
+@pytest.mark.parametrize("grid_size", [10, 25])
+@pytest.mark.parametrize("engine", ["mesa", "numpy"])
+def test_run_hawkdovemulti_model(benchmark, engine, grid_size):
+    # a complete batch run simulation, including data export
+    benchmark.group = f"run_hawkdovemulti_model {engine}"
+    run = RunArgs(
+        0,
+        0,
+        {"grid_size": grid_size, "risk_adjustment": "adopt", "adjust_every": 10},
+        1000,
+        DataCollectionSchedule.END,
+        False,
+        engine,
+        seed=1,
+    )
+    rows, _ = benchmark.pedantic(run_hawkdovemulti_model, args=(run,), rounds=3)
+    benchmark.extra_info["steps"] = rows[-1]["Step"]
@@ -1,15 +1,26 @@
 import math
-import statistics
-from collections import deque
-from enum import Enum
+import time
+from enum import IntEnum
 
 import mesa
+import numpy as np
+import pandas as pd
 
-from simulatingrisk.utils import coinflip
+from simulatingrisk.utils import RollingWindow, StepProfile, coinflip, fill_grid
 
-Play = Enum("Play", ["HAWK", "DOVE"])
+# integer choice values (0, 1) so plays can be used to index
+# the payoff matrix and stored compactly in arrays
+Play = IntEnum("Play", ["HAWK", "DOVE"], start=0)
 play_choices = [Play.HAWK, Play.DOVE]
 
+#: default hawk/dove payoffs, indexed by [my play][neighbor's play]
+default_payoff_matrix = (
+    # HAWK vs HAWK: 0, HAWK vs DOVE: 3
+    (0, 3),
+    # DOVE vs HAWK: 1, DOVE vs DOVE: 2
+    (1, 2),
+)
+
 
 # divergent color scheme, ten colors
 # from https://colorbrewer2.org/?type=diverging&scheme=RdYlGn&n=10
@@ -43,6 +54,10 @@ class HawkDoveAgent(mesa.Agent):
         self.hawk_count = 0
         self.choice = self.initial_choice(hawk_odds)
         self.last_choice = None
+        # proportional number of dove neighbors and payoff, from the last
+        # round they were calculated; reused when the model skips updates
+        self.dove_neighbors = None
+        self.round_payoff = None
 
         # risk level must be set by base class, since initial
         # conditions are specific to single / variable risk games
@@ -62,7 +77,7 @@ class HawkDoveAgent(mesa.Agent):
         opts = {}
         if hawk_odds is not None:
             opts["weight"] = hawk_odds
-        return coinflip(play_choices, **opts)
+        return coinflip(play_choices, rng=self.random, **opts)
 
     @property
     def choice_label(self):
@@ -71,18 +86,12 @@ class HawkDoveAgent(mesa.Agent):
     def get_neighbors(self, size):
         """get all neighbors for a supported neighborhood size"""
         check_neighborhood_size(size)
-        # 4 and 8 neighborhood use default radius 1
-        # 8 and 24 both use moore neighborhood (includes diagonals)
-        opts = {"moore": True}
-        if size == 4:
-            # use von neumann neighborhood instead of moore (no diagonal)
-            opts["moore"] = False
-
-        # for 24 size neighborhood, use radius 2
-        if size == 24:
-            opts["radius"] = 2
-
-        return self.model.grid.get_neighbors(self.pos, include_center=False, **opts)
+        # agents don't move, so use the model's precomputed neighbor table
+        # instead of searching the grid every time
+        x, y = self.pos
+        cell = x * self.model.grid.width + y
+        neighbor_cells = self.model.neighbor_tables[size][cell]
+        return self.model.agents_by_cell[neighbor_cells].tolist()
 
     @property
     def play_neighbors(self):
@@ -131,51 +140,58 @@ class HawkDoveAgent(mesa.Agent):
         #   (any risk is acceptable).
         # agent with r = max should always take the safe option
         #   (no risk is acceptable)
-        if self.proportional_num_dove_neighbors >= self.risk_level:
+
+        # for sparse updates, only count dove neighbors again
+        # when the model says they may have changed
+        if not self.model.sparse_update or self.model.needs_choice_update(self):
+            self.dove_neighbors = self.proportional_num_dove_neighbors
+        if self.dove_neighbors >= self.risk_level:
             choice = Play.HAWK
         else:
             choice = Play.DOVE
 
         # based on model configuration, should agent play randomly instead?
         if self.model.random_play_odds and coinflip(
-            [True, False], weight=self.model.random_play_odds
+            [True, False], weight=self.model.random_play_odds, rng=self.random
         ):
             # if a random play is selected, flip a coin between hawk and dove
-            choice = coinflip([Play.HAWK, Play.DOVE])
+            choice = coinflip([Play.HAWK, Play.DOVE], rng=self.random)
 
         self.choice = choice
+        if self.model.sparse_update and choice != self.last_choice:
+            self.model.choice_changed(self)
 
     def play(self):
-        # play against each neighbor and calculate cumulative payoff
-        payoff = 0
-        for n in self.play_neighbors:
-            payoff += self.payoff(n)
+        # play against each neighbor and calculate cumulative payoff;
+        # look up payoffs for current choice once for all neighbors.
+        # for sparse updates, payoff is the same as last round unless
+        # the model says this agent or a neighbor changed their play
+        if not self.model.sparse_update or self.model.needs_payoff_update(self):
+            payoffs = self.model.payoff_matrix[self.choice]
+            self.round_payoff = sum(payoffs[n.choice] for n in self.play_neighbors)
         # update total points based on payoff this round
-        self.points += payoff
+        self.points += self.round_payoff
 
         if self.choice == Play.HAWK:
             self.hawk_count += 1
 
+        # update model running totals before replacing previous choice
+        self.model.agent_played(self)
+
         # store this round's choice as previous choice
         self.last_choice = self.choice
 
     def payoff(self, other):
         """
+        Payoff against another agent, from the model payoff matrix.
+        With the default payoffs:
+
         If I play HAWK and neighbor plays DOVE: 3
         If I play DOVE and neighbor plays DOVE: 2
         If I play DOVE and neighbor plays HAWK: 1
         If I play HAWK and neighbor plays HAWK: 0
         """
-        if self.choice == Play.HAWK:
-            if other.choice == Play.DOVE:
-                return 3
-            if other.choice == Play.HAWK:
-                return 0
-        elif self.choice == Play.DOVE:
-            if other.choice == Play.DOVE:
-                return 2
-            if other.choice == Play.HAWK:
-                return 1
+        return self.model.payoff_matrix[self.choice][other.choice]
 
     @property
     def points_rank(self):
@@ -184,6 +200,126 @@ class HawkDoveAgent(mesa.Agent):
         return 0
 
 
+class SnapshotDataCollector(mesa.DataCollector):
+    """
+    Data collector that gets model-level values from a single call to the
+    model's `snapshot` method, instead of calling each model reporter
+    separately. Any model reporters not included in the snapshot are
+    collected as usual.
+    """
+
+    def collect(self, model):
+        row = model.snapshot()
+        model_reporters = self.model_reporters
+        # let the standard collect method handle everything else
+        self.model_reporters = {
+            var: reporter for var, reporter in model_reporters.items() if var not in row
+        }
+        try:
+            super().collect(model)
+        finally:
+            self.model_reporters = model_reporters
+        for var in model_reporters:
+            if var in row:
+                self.model_vars[var].append(row[var])
+
+
+class ColumnarDataCollector(SnapshotDataCollector):
+    """
+    Data collector that stores agent data in columns: for each collected
+    step, an array of agent ids and an array of values for each agent
+    reporter. Uses much less memory than mesa's per-agent records, and
+    data can be written out without building a row for each agent.
+    """
+
+    def __init__(self, *args, **kwargs):
+        #: agent data arrays for each collected step, keyed on step
+        self.agent_columns = {}
+        #: total time spent collecting data, in seconds
+        self.collect_time = 0.0
+        super().__init__(*args, **kwargs)
+
+    def collect(self, model):
+        start = time.perf_counter()
+        # collect model data as usual, but handle agent data here
+        agent_reporters = self.agent_reporters
+        self.agent_reporters = {}
+        try:
+            super().collect(model)
+        finally:
+            self.agent_reporters = agent_reporters
+        if self.agent_reporters:
+            self.agent_columns[model.schedule.steps] = self._record_agent_columns(model)
+        self.collect_time += time.perf_counter() - start
+
+    def _record_agent_columns(self, model) -> dict:
+        agents = model.schedule.agents
+        columns = {"AgentID": np.array([agent.unique_id for agent in agents])}
+        for name, reporter in self.agent_reporters.items():
+            columns[name] = np.array([reporter(agent) for agent in agents])
+        return columns
+
+    def get_agent_columns(self) -> dict:
+        """Agent data for all collected steps, as a dictionary of arrays:
+        Step, AgentID, and one array for each agent reporter."""
+        step_columns = list(self.agent_columns.values())
+        counts = [len(columns["AgentID"]) for columns in step_columns]
+        steps = np.array(list(self.agent_columns), dtype=int)
+        all_columns = {"Step": np.repeat(steps, counts)}
+        for name in ["AgentID", *self.agent_reporters]:
+            if step_columns:
+                all_columns[name] = np.concatenate(
+                    [columns[name] for columns in step_columns]
+                )
+            else:
+                all_columns[name] = np.array([])
+        return all_columns
+
+    @property
+    def _agent_records(self) -> dict:
+        """Agent data in mesa's per-agent record format (step, agent id,
+        and reporter values), keyed on step; built from agent columns
+        when needed, for code that reads records directly (e.g.,
+        :func:`mesa.batch_run`)."""
+        return {
+            step: list(
+                zip(
+                    [step] * len(columns["AgentID"]),
+                    *(
+                        columns[name].tolist()
+                        for name in ["AgentID", *self.agent_reporters]
+                    ),
+                )
+            )
+            for step, columns in self.agent_columns.items()
+        }
+
+    @_agent_records.setter
+    def _agent_records(self, value):
+        # mesa initializes empty agent records; agent data is stored in
+        # agent columns instead
+        pass
+
+    def get_agent_vars_dataframe(self):
+        # same format as mesa data collector: indexed on step and agent id
+        if not self.agent_reporters:
+            raise UserWarning(
+                "No agent reporters have been defined in the DataCollector, "
+                + "returning empty DataFrame."
+            )
+        return pd.DataFrame(self.get_agent_columns()).set_index(["Step", "AgentID"])
+
+
+class TimedStagedActivation(mesa.time.StagedActivation):
+    """Staged activation that times each stage for all agents with the
+    model's :class:`~simulatingrisk.utils.StepProfile`."""
+
+    def do_each(self, method, agent_keys=None, shuffle=False):
+        self.model.profile.start(method)
+        super().do_each(method, agent_keys=agent_keys, shuffle=shuffle)
+        self.model.profile.stop()
+
+
 class HawkDoveModel(mesa.Model):
     """
     Model for hawk/dove game with risk attitudes.
@@ -194,6 +330,14 @@ class HawkDoveModel(mesa.Model):
     :param observed_neighborhood: size of neighborhood each agent looks
         at when choosing what to play; 4, 8, or 24 (default: 8)
     :param hawk_odds: odds for playing hawk on the first round (default: 0.5)
+    :param payoff_matrix: 2x2 payoffs for each pair of plays, indexed by
+        [my play][neighbor's play] (default: :data:`default_payoff_matrix`)
+    :param profile: time each section of every step, in :attr:`profile`
+        (default: False)
+    :param sparse_update: only update choices and payoffs for agents
+        whose neighbors changed their play, instead of all agents every
+        round; results are the same, but faster when few agents change
+        (default: False)
     """
 
     #: whether the simulation is running
@@ -209,8 +353,12 @@ class HawkDoveModel(mesa.Model):
     min_steps_converge = 30
     #: class to use when initializing agents
     agent_class = HawkDoveAgent
+    #: class to use for data collection
+    datacollector_class = ColumnarDataCollector
     #: supported neighborhood sizes
     neighborhood_sizes = {4, 8, 24}
+    #: payoffs for each pair of plays, indexed by [my play][neighbor's play]
+    payoff_matrix = default_payoff_matrix
     #: minimum risk level
     min_risk_level = 0
     #: maximum risk level allowed
@@ -220,6 +368,14 @@ class HawkDoveModel(mesa.Model):
     min_allowed_risk_level = 0
     #: maximum supported risk level (may not match actual max risk level in a given simulation)
     max_allowed_risk_level = 9
+    #: sections of each step that are timed when profiling is enabled
+    profile_sections = (
+        "choose",
+        "play",
+        "update_hawk_stats",
+        "converged",
+        "collect_data",
+    )
 
     def __init__(
         self,
@@ -228,27 +384,22 @@ class HawkDoveModel(mesa.Model):
         observed_neighborhood=8,
         hawk_odds=0.5,
         random_play_odds=0.01,
+        payoff_matrix=None,
+        seed=None,
+        profile=False,
+        sparse_update=False,
     ):
+        # seed is handled by mesa when the model object is created;
+        # all model and agent randomness uses the seeded model random
         super().__init__()
-        # check parameters for combinations that aren't allowed together
-        if grid_size < 5:
-            if play_neighborhood > 8:
-                raise ValueError(
-                    "Play neighborhood %d is too large for grid size %d",
-                    play_neighborhood,
-                    grid_size,
-                )
-            if observed_neighborhood > 8:
-                raise ValueError(
-                    "Observed neighborhood %d is too large for grid size %d",
-                    observed_neighborhood,
-                    grid_size,
-                )
+        HawkDoveModel.check_parameters(
+            grid_size,
+            play_neighborhood=play_neighborhood,
+            observed_neighborhood=observed_neighborhood,
+        )
 
         # assume a fully-populated square grid
         self.num_agents = grid_size * grid_size
-        for nsize in [play_neighborhood, observed_neighborhood]:
-            check_neighborhood_size(nsize)
 
         self.play_neighborhood = play_neighborhood
         self.observed_neighborhood = observed_neighborhood
@@ -258,24 +409,97 @@ class HawkDoveModel(mesa.Model):
         # how often should agents make a random play
         self.random_play_odds = random_play_odds
 
+        # use a custom payoff matrix if specified
+        if payoff_matrix is not None:
+            if len(payoff_matrix) != 2 or any(len(row) != 2 for row in payoff_matrix):
+                raise ValueError(
+                    f"Payoff matrix {payoff_matrix} is not supported; must be 2x2"
+                )
+            self.payoff_matrix = tuple(tuple(row) for row in payoff_matrix)
+        # points can only decrease when some payoffs are negative
+        self.points_increase = min(min(row) for row in self.payoff_matrix) >= 0
+
         # create fifos to track recent behavior to detect convergence
-        self.recent_percent_hawk = deque([], maxlen=self.rolling_window)
-        self.recent_rolling_percent_hawk = deque([], maxlen=self.rolling_window)
+        self.recent_percent_hawk = RollingWindow(self.rolling_window)
+        self.recent_rolling_percent_hawk = RollingWindow(self.rolling_window)
+
+        #: time spent in each section of model steps; only recorded
+        #: when profiling is enabled
+        self.profile = StepProfile(enabled=profile)
+
+        self.sparse_update = sparse_update
+        #: for sparse updates, agents that need to update their choice or
+        #: payoff in the current round; None updates all agents
+        self.choice_updates = None
+        self.payoff_updates = None
+        # agents that need to update their choice next round
+        self._next_choice_updates = set()
+
+        self.setup_agents(grid_size)
+        # precompute neighbors for all supported neighborhood sizes
+        self.neighbor_tables = {
+            size: neighbor_table(grid_size, size) for size in self.neighborhood_sizes
+        }
+
+        self.datacollector = self.datacollector_class(
+            **self.get_data_collector_options()
+        )
 
+    def setup_agents(self, grid_size):
+        """Initialize grid, scheduler, and agents. Extend this method
+        to customize how agents are represented."""
         # initialize a single grid (each square inhabited by a single agent);
         # configure the grid to wrap around so everyone has neighbors
         self.grid = mesa.space.SingleGrid(grid_size, grid_size, True)
-        self.schedule = mesa.time.StagedActivation(self, ["choose", "play"])
+        self.schedule = TimedStagedActivation(self, ["choose", "play"])
 
-        # initialize all agents
+        # initialize all agents and add to scheduler
         agent_opts = self.new_agent_options()
         for i in range(self.num_agents):
-            # add to scheduler and place randomly in an empty spot
-            agent = self.agent_class(i, self, **agent_opts)
-            self.schedule.add(agent)
-            self.grid.move_to_empty(agent)
+            self.schedule.add(self.agent_class(i, self, **agent_opts))
+        # place agents randomly, filling the grid
+        fill_grid(self.grid, self.schedule.agents, self.random)
+
+        # index agents by flattened grid position, for neighbor lookup
+        self.agents_by_cell = np.empty(self.num_agents, dtype=object)
+        for agent in self.schedule.agents:
+            x, y = agent.pos
+            self.agents_by_cell[x * grid_size + y] = agent
+
+        # running totals, updated as agents play, so model statistics
+        # don't require checking every agent
+        self.num_hawks = sum(a.choice == Play.HAWK for a in self.schedule.agents)
+        self._max_agent_points = 0
+
+    @classmethod
+    def check_parameters(
+        cls, grid_size, play_neighborhood=8, observed_neighborhood=8, **kwargs
+    ):
+        """Check model parameters, including combinations that aren't
+        allowed together, without initializing a model; raises
+        ValueError for invalid parameters. Parameters not checked by this
+        model class are ignored."""
+        for nsize in [play_neighborhood, observed_neighborhood]:
+            check_neighborhood_size(nsize)
+        if grid_size < 5:
+            if play_neighborhood > 8:
+                raise ValueError(
+                    f"Play neighborhood {play_neighborhood} is too large "
+                    + f"for grid size {grid_size}"
+                )
+            if observed_neighborhood > 8:
+                raise ValueError(
+                    f"Observed neighborhood {observed_neighborhood} is too large "
+                    + f"for grid size {grid_size}"
+                )
 
-        self.datacollector = mesa.DataCollector(**self.get_data_collector_options())
+    @classmethod
+    def canonical_parameters(cls, params: dict) -> dict:
+        """Parameters in a form that can be compared to identify parameter
+        sets that result in equivalent simulations; parameter sets with
+        the same canonical parameters differ only in options that have no
+        effect. Does not include defaults for unspecified parameters."""
+        return dict(params)
 
     def get_data_collector_options(self):
         # method to return options for data collection,
@@ -306,26 +530,98 @@ class HawkDoveModel(mesa.Model):
         """
         A model step. Used for collecting data and advancing the schedule
         """
+        if self.sparse_update:
+            self.start_sparse_update()
+        # choose and play stages are timed by the scheduler
         self.schedule.step()
+        self.end_step()
+
+    def start_sparse_update(self):
+        """Start tracking which agents need to update choice and payoff
+        in this round. All agents calculate payoffs on the first round and
+        choices on the second; after that, only agents whose neighbors
+        changed their play (see :meth:`choice_changed`)."""
+        if self.schedule.steps == 0:
+            return
+        self.payoff_updates = set()
+        if self.schedule.steps > 1:
+            self.choice_updates = self._next_choice_updates
+            self._next_choice_updates = set()
+
+    def needs_choice_update(self, agent) -> bool:
+        """whether an agent needs to count dove neighbors again to choose
+        what to play this round"""
+        return self.choice_updates is None or agent in self.choice_updates
+
+    def needs_payoff_update(self, agent) -> bool:
+        """whether an agent needs to calculate payoff against neighbors
+        again this round"""
+        return self.payoff_updates is None or agent in self.payoff_updates
+
+    def choice_changed(self, agent):
+        """Called when an agent chooses a different play than last round.
+        For sparse updates, the agent and its play neighbors need to
+        calculate payoffs this round, and agents that observe it need to
+        choose again next round. (Neighborhoods are symmetric, so an
+        agent's neighbors are the agents that have it as a neighbor.)"""
+        if self.payoff_updates is not None:
+            self.payoff_updates.add(agent)
+            self.payoff_updates.update(agent.play_neighbors)
+        self._next_choice_updates.update(agent.observed_neighbors)
+
+    def end_step(self):
+        """Update hawk statistics, check convergence, and collect data,
+        after all agents have played; called at the end of each step."""
         # always update rolling stats needed for convergence detection,
         # independent of data collection schedule
+        self.profile.start("update_hawk_stats")
         self._update_hawk_stats()
+        self.profile.stop()
         # check if simulation has converged and should stop running
-        if self.converged:
+        self.profile.start("converged")
+        converged = self.converged
+        self.profile.stop()
+        if converged:
             self.status = "converged"
             self.running = False
 
         # collect data after status is updated, so data collected
         # for last round will reflect converged status
+        self.profile.start("collect_data")
         self.collect_data()
+        self.profile.stop()
 
     def collect_data(self):
         # extend this method to customize when or how data collection happens
         self.datacollector.collect(self)
 
+    def snapshot(self) -> dict:
+        """Current values for all model-level data collection fields,
+        keyed by model reporter name. Extend this method along with
+        :meth:`get_data_collector_options` to add fields."""
+        return {
+            "max_agent_points": self.max_agent_points,
+            "percent_hawk": self.percent_hawk,
+            "rolling_percent_hawk": self.rolling_percent_hawk,
+            "status": self.status,
+            "total_agents": self.num_agents,
+        }
+
+    def agent_played(self, agent):
+        """Update running totals after an agent plays a round; must be
+        called before the agent's previous choice is updated."""
+        # adjust hawk count when an agent's choice is different from
+        # the last round; first round choices are counted on init
+        if agent.last_choice is not None and agent.choice != agent.last_choice:
+            self.num_hawks += 1 if agent.choice == Play.HAWK else -1
+        self._max_agent_points = max(self._max_agent_points, agent.points)
+
     @property
     def max_agent_points(self):
         # what is the current largest point total of any agent?
+        # running maximum is only accurate when points never decrease
+        if self.points_increase:
+            return self._max_agent_points
         return max([a.points for a in self.schedule.agents])
 
     def _update_hawk_stats(self):
@@ -333,15 +629,12 @@ class HawkDoveModel(mesa.Model):
         # regardless of data collection schedule
         self.recent_percent_hawk.append(self.percent_hawk)
         if len(self.recent_percent_hawk) > self.min_window:
-            self.recent_rolling_percent_hawk.append(
-                statistics.mean(self.recent_percent_hawk)
-            )
+            self.recent_rolling_percent_hawk.append(self.recent_percent_hawk.mean())
 
     @property
     def percent_hawk(self):
         # what percent of agents chose hawk?
-        hawks = [a for a in self.schedule.agents if a.choice == Play.HAWK]
-        return len(hawks) / self.num_agents
+        return self.num_hawks / self.num_agents
 
     @property
     def rolling_percent_hawk(self):
@@ -363,11 +656,9 @@ class HawkDoveModel(mesa.Model):
 
         # in variable risk with risk adjustment, numbers are not strictly equal
         # but do get close and fairly stable; round to two digits before comparing
-        rounded_set = set([round(x, 2) for x in self.recent_rolling_percent_hawk])
-        return (
-            len(self.recent_rolling_percent_hawk) > self.min_window
-            and len(rounded_set) == 1
-        )
+        return len(
+            self.recent_rolling_percent_hawk
+        ) > self.min_window and self.recent_rolling_percent_hawk.is_stable(digits=2)
 
 
 def check_neighborhood_size(size):
@@ -379,6 +670,49 @@ def check_neighborhood_size(size):
         )
 
 
+def neighborhood_offsets(size):
+    """Relative (x, y) offsets for all cells in a supported neighborhood
+    size; matches the cells used by :meth:`HawkDoveAgent.get_neighbors`
+    on a grid large enough that no neighbors are repeated."""
+    check_neighborhood_size(size)
+    # 4 and 8 neighborhood use radius 1; 24 uses radius 2
+    radius = 2 if size == 24 else 1
+    offsets = []
+    for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+            # skip the center cell
+            if dx == 0 and dy == 0:
+                continue
+            # von neumann neighborhood for size 4 (no diagonals)
+            if size == 4 and abs(dx) + abs(dy) > radius:
+                continue
+            offsets.append((dx, dy))
+    return offsets
+
+
+def neighbor_table(grid_size, size):
+    """Neighbor index table for a square toroidal grid and a supported
+    neighborhood size. Returns an array with one row for each grid cell
+    (flattened index `x * grid_size + y`) containing the flattened
+    indices of all neighboring cells, in the same order as mesa
+    :meth:`~mesa.space.SingleGrid.get_neighborhood`."""
+    # on grids smaller than the neighborhood, offsets wrap around to the
+    # same cell; like mesa, only include unique cells other than the center.
+    # (grid is a torus, so the same offsets are repeated for every cell)
+    offsets = dict.fromkeys(
+        (dx % grid_size, dy % grid_size) for dx, dy in neighborhood_offsets(size)
+    )
+    offsets.pop((0, 0), None)
+
+    x, y = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    columns = [
+        (x + dx) % grid_size * grid_size + (y + dy) % grid_size for dx, dy in offsets
+    ]
+    num_cells = grid_size * grid_size
+    table = np.array(columns, dtype=np.intp).reshape(len(offsets), num_cells)
+    return np.ascontiguousarray(table.T)
+
+
 class HawkDoveSingleRiskAgent(HawkDoveAgent):
     """
     An agent with a risk attitude playing Hawk or Dove; must be initialized
@@ -0,0 +1,453 @@
+import mesa
+import numpy as np
+
+from simulatingrisk.hawkdove.model import ColumnarDataCollector, Play
+from simulatingrisk.hawkdovemulti.model import HawkDoveMultipleRiskModel
+
+
+class ArrayStagedActivation(mesa.time.BaseScheduler):
+    """Scheduler for array-backed models, where there are no agent
+    objects to activate. Calls each stage as a method on the model
+    (all agents at once), timed with the model's step profile, and then
+    advances the step count."""
+
+    def __init__(self, model, stage_list):
+        super().__init__(model)
+        self.stage_list = stage_list
+
+    def step(self):
+        for stage in self.stage_list:
+            self.model.profile.start(stage)
+            getattr(self.model, stage)()
+            self.model.profile.stop()
+        self.advance()
+
+    def advance(self):
+        "advance the step count, after all stages have run"
+        self.steps += 1
+        self.time += 1
+
+
+class ArrayDataCollector(ColumnarDataCollector):
+    """Data collector for array-backed models. Agent data is copied
+    from the model arrays, in the same column format as the
+    columnar data collector used by the agent-based model."""
+
+    def _record_agent_columns(self, model) -> dict:
+        columns = {"AgentID": np.arange(model.num_agents)}
+        for name in self.agent_reporters:
+            columns[name] = model.agent_values(name)
+        return columns
+
+
+def adjust_risk_in_order(
+    model, risk_level, points, recent_points, round_payoff, activation_order, random
+):
+    """Adjust risk levels for all agents after playing an adjustment round,
+    with the same result as the agent-based model, where each agent plays
+    and then adjusts in activation order. Each agent compares with its
+    neighbors as they are when it adjusts: neighbors that come earlier in
+    the activation order have already played (and, with recent payoff
+    comparison, have reset their recent points to zero) and may have
+    adjusted their risk levels; later neighbors have not played yet.
+
+    Arrays are grids for a single model or stacked grids for replicates
+    (shape: [replicates x] grid_size x grid_size). ``random`` returns
+    random values for tied neighbors, for each replicate (shape:
+    replicates x agents x neighbors). Returns new risk levels and a
+    boolean array of agents whose risk level changed."""
+    shape = risk_level.shape
+    num_agents = shape[-1] * shape[-2]
+
+    def flat(values):
+        # one row of agents per replicate
+        return values.reshape(-1, num_agents)
+
+    risk_level = flat(risk_level)
+    activation_order = flat(activation_order)
+    # neighbor cells for each agent (shape: agents x neighbors)
+    table = model.neighbor_tables[model.adjust_neighborhood]
+    # neighbors that played and adjusted before each agent
+    earlier = activation_order[:, table] < activation_order[..., np.newaxis]
+
+    # payoff each agent compares, and what it looks like to neighbors
+    # before and after the agent plays and adjusts
+    if model.adjust_payoff == "recent":
+        own_payoff = flat(recent_points)
+        after = np.zeros_like(own_payoff)
+    else:
+        own_payoff = flat(points)
+        after = own_payoff
+    before = own_payoff - flat(round_payoff)
+    neighbor_payoff = np.where(earlier, after[:, table], before[:, table])
+
+    # find the most successful neighbor; when there is a tie,
+    # choose randomly by giving each tied neighbor a random weight
+    best_payoff = neighbor_payoff.max(axis=-1)
+    tiebreak = np.where(
+        neighbor_payoff == best_payoff[..., np.newaxis],
+        random(neighbor_payoff.shape[1:]),
+        -1,
+    )
+    best = tiebreak.argmax(axis=-1)
+    best_cell = table[np.arange(num_agents), best]
+    best_earlier = np.take_along_axis(earlier, best[..., np.newaxis], axis=-1)[..., 0]
+    improved = best_payoff > own_payoff
+
+    # agents whose most successful neighbor comes earlier see that
+    # neighbor's adjusted risk level, which may in turn depend on an
+    # earlier neighbor; since each agent only depends on earlier agents,
+    # updating all agents until nothing changes gives the same result as
+    # adjusting one at a time (one update per link in the longest chain)
+    prev_best_risk = np.take_along_axis(risk_level, best_cell, axis=-1)
+    new_risk_level = risk_level
+    while True:
+        best_risk = np.where(
+            best_earlier,
+            np.take_along_axis(new_risk_level, best_cell, axis=-1),
+            prev_best_risk,
+        )
+        # adjust if most successful neighbor has more points and a
+        # different risk attitude
+        changed = improved & (best_risk != risk_level)
+        if model.risk_adjustment == "adopt":
+            adjusted = best_risk
+        elif model.risk_adjustment == "average":
+            # average and round to a whole number (rounds half to even,
+            # like python round)
+            adjusted = np.round((risk_level + best_risk) / 2).astype(risk_level.dtype)
+        updated = np.where(changed, adjusted, risk_level)
+        if np.array_equal(updated, new_risk_level):
+            break
+        new_risk_level = updated
+
+    return new_risk_level.reshape(shape), changed.reshape(shape)
+
+
+class HawkDoveMultipleRiskArrayModel(HawkDoveMultipleRiskModel):
+    """
+    Array-backed version of
+    :class:`~simulatingrisk.hawkdovemulti.model.HawkDoveMultipleRiskModel`,
+    for efficient batch running. Supports all the same parameters,
+    convergence logic, and data collection output, but instead of
+    creating agent objects, agent risk levels, choices, and points are
+    stored as NumPy arrays on the toroidal grid, and each stage is
+    calculated for all agents at once from arrays of neighbor values.
+    Choices are stored as integer :class:`~simulatingrisk.hawkdove.model.Play`
+    values.
+
+    Agent ids correspond to the flattened grid position of each agent.
+    Agents are activated in a random order, stored as the activation rank
+    of each cell; as in the agent-based model, agents adjust their risk
+    attitude one after another in that order (see
+    :func:`adjust_risk_in_order`). Sparse updates are not supported,
+    since all agents are updated at once.
+    """
+
+    datacollector_class = ArrayDataCollector
+
+    def setup_agents(self, grid_size):
+        if self.sparse_update:
+            raise ValueError("Sparse updates are not supported by the array model")
+        self.grid_size = grid_size
+        self.schedule = ArrayStagedActivation(self, ["choose", "play"])
+        # uses the numpy random generator initialized by the parent model,
+        # seeded from the model random
+
+        shape = (grid_size, grid_size)
+        # first choice is random, weighted by initial hawk odds
+        self.choice = self.choice_array(self.rng.random(shape) < self.hawk_odds)
+        # previous choice is set on every play; not used before the first round
+        self.last_choice = self.choice.copy()
+        # get risk attitudes based on configured distribution; shuffle
+        # to place randomly on the grid, since some distributions
+        # alternate between values
+        risk_levels = self.sample_risk_attitudes(self.num_agents)
+        self.risk_level = self.rng.permutation(risk_levels).reshape(shape)
+        # order agents play and adjust risk each round, like the order
+        # of randomly placed agents in the agent-based model schedule
+        self.activation_order = self.rng.permutation(self.num_agents).reshape(shape)
+
+        # points use the same numeric type as the payoff matrix
+        points_dtype = np.asarray(self.payoff_matrix).dtype
+        self.points = np.zeros(shape, dtype=points_dtype)
+        self.recent_points = np.zeros(shape, dtype=points_dtype)
+        self.round_payoff = np.zeros(shape, dtype=points_dtype)
+        self.hawk_count = np.zeros(shape, dtype=np.int64)
+        self.risk_level_changed = np.zeros(shape, dtype=bool)
+
+    def choice_array(self, hawk):
+        "convert a boolean array of hawk plays to an array of integer choices"
+        return np.where(hawk, Play.HAWK, Play.DOVE).astype(np.int8)
+
+    def neighbor_values(self, values, size):
+        """Stack of neighbor values for every cell, with one layer for
+        each neighbor in the specified neighborhood size
+        (shape: neighbors x grid_size x grid_size); uses the model's
+        precomputed neighbor table."""
+        table = self.neighbor_tables[size]
+        return values.ravel()[table.T].reshape(-1, *values.shape)
+
+    def choose(self):
+        "decide what all agents play this round"
+        # first choice is random (set on init)
+        if self.schedule.steps == 0:
+            return
+
+        # count how many observed neighbors played dove last round, and
+        # scale to the range of risk levels (see
+        # HawkDoveAgent.proportional_num_dove_neighbors)
+        num_dove_neighbors = (
+            self.neighbor_values(self.last_choice, self.observed_neighborhood)
+            == Play.DOVE
+        ).sum(axis=0)
+        ratio = 8 / self.observed_neighborhood
+        proportional_num_dove_neighbors = np.round(ratio * num_dove_neighbors)
+        choice = self.choice_array(proportional_num_dove_neighbors >= self.risk_level)
+
+        # based on model configuration, some agents play randomly instead
+        if self.random_play_odds:
+            shape = choice.shape
+            random_play = self.rng.random(shape) < self.random_play_odds
+            random_choice = self.choice_array(self.rng.random(shape) < 0.5)
+            choice = np.where(random_play, random_choice, choice)
+
+        self.choice = choice
+
+    def play(self):
+        "all agents play against their neighbors and update points"
+        hawk = self.choice == Play.HAWK
+        play_neighbors = self.neighbor_values(hawk, self.play_neighborhood)
+        hawk_neighbors = play_neighbors.sum(axis=0)
+        dove_neighbors = len(play_neighbors) - hawk_neighbors
+        # look up payoffs against hawk and dove for each agent's choice,
+        # and multiply by the number of neighbors who made that choice
+        payoffs = np.asarray(self.payoff_matrix)[self.choice]
+        payoff = (
+            payoffs[..., Play.HAWK] * hawk_neighbors
+            + payoffs[..., Play.DOVE] * dove_neighbors
+        )
+        self.round_payoff = payoff
+        self.points += payoff
+        self.recent_points += payoff
+        self.hawk_count += hawk
+        # store this round's choice as previous choice
+        self.last_choice = self.choice
+
+        if self.adjustment_round:
+            self.profile.start("adjust_risk")
+            self.adjust_risk()
+            self.profile.stop()
+            # reset to zero to track points until next adjustment round
+            self.recent_points[:] = 0
+
+    def adjust_risk(self):
+        """all agents compare with most successful neighbor and adjust risk,
+        in activation order"""
+        risk_level, changed = adjust_risk_in_order(
+            self,
+            self.risk_level,
+            self.points,
+            self.recent_points,
+            self.round_payoff,
+            self.activation_order,
+            lambda shape: self.rng.random(shape)[np.newaxis],
+        )
+
+        # update risk level counts for agents that changed
+        minlength = len(self.risk_level_counts)
+        counts = np.asarray(self.risk_level_counts)
+        counts = counts - np.bincount(self.risk_level[changed], minlength=minlength)
+        counts = counts + np.bincount(risk_level[changed], minlength=minlength)
+        self.risk_level_counts = counts.tolist()
+
+        self.risk_level = risk_level
+        self.risk_level_changed = changed
+
+    def agent_values(self, name):
+        """flat array of values for all agents, for agent data collection;
+        always returns a copy, since model arrays are updated in place"""
+        if name == "choice":
+            return np.where(self.choice == Play.HAWK, "hawk", "dove").ravel()
+        return getattr(self, name).flatten()
+
+    @property
+    def max_agent_points(self):
+        return self.points.max().item()
+
+    @property
+    def percent_hawk(self):
+        return np.count_nonzero(self.choice == Play.HAWK) / self.num_agents
+
+    @property
+    def num_agents_risk_changed(self):
+        return int(np.count_nonzero(self.risk_level_changed))
+
+    def count_risk_levels(self) -> list[int]:
+        counts = np.bincount(
+            self.risk_level.ravel(), minlength=self.max_allowed_risk_level + 1
+        )
+        return counts.tolist()
+
+
+class ReplicateBatch:
+    """
+    Runs independent replicates of
+    :class:`HawkDoveMultipleRiskArrayModel` with the same parameters
+    together, as stacked arrays (replicates x grid_size x grid_size),
+    so that each stage is calculated for all replicates at once. For small
+    grids, this is much faster than running each model on its own, since
+    the time for each array operation is mostly fixed overhead.
+
+    Each replicate is a separate model, with its own random generator,
+    convergence checks, and data collection; results for each replicate
+    are identical to running that model on its own. Replicates are
+    dropped from the batch when they stop running (e.g., converge).
+
+    :param models: models to run; must all have the same parameters,
+        and must not have been run yet
+    """
+
+    #: agent arrays, stacked across replicates
+    array_names = (
+        "choice",
+        "last_choice",
+        "risk_level",
+        "activation_order",
+        "points",
+        "recent_points",
+        "round_payoff",
+        "hawk_count",
+        "risk_level_changed",
+    )
+
+    def __init__(self, models: list[HawkDoveMultipleRiskArrayModel]):
+        if not models:
+            raise ValueError("Replicate batch requires at least one model")
+        #: models still running, in the same order as the stacked arrays
+        self.models = list(models)
+        for name in self.array_names:
+            setattr(self, name, np.stack([getattr(m, name) for m in self.models]))
+        self.risk_level_counts = np.array([m.risk_level_counts for m in self.models])
+
+    @property
+    def running(self) -> bool:
+        return bool(self.models)
+
+    @property
+    def template(self) -> HawkDoveMultipleRiskArrayModel:
+        """first model still running, for parameters and step count shared
+        by all replicates in the batch"""
+        return self.models[0]
+
+    @property
+    def steps(self) -> int:
+        "number of steps run by replicates still in the batch"
+        return self.template.schedule.steps
+
+    def neighbor_values(self, values, size):
+        """Stack of neighbor values for every cell in every replicate
+        (shape: replicates x neighbors x grid_size x grid_size); see
+        :meth:`HawkDoveMultipleRiskArrayModel.neighbor_values`."""
+        table = self.template.neighbor_tables[size]
+        num_replicates = len(values)
+        return values.reshape(num_replicates, -1)[:, table.T].reshape(
+            num_replicates, -1, *values.shape[1:]
+        )
+
+    def random(self, shape):
+        """random values from each replicate's random generator, stacked;
+        values are drawn in the same order as running the model alone"""
+        return np.stack([model.rng.random(shape) for model in self.models])
+
+    def step(self):
+        "run a single step for all replicates still in the batch"
+        for model in self.models:
+            model.start_step()
+        self.choose()
+        self.play()
+        # update models with the new state, then finish each model step
+        # (statistics, convergence check, and data collection)
+        for i, model in enumerate(self.models):
+            for name in self.array_names:
+                setattr(model, name, getattr(self, name)[i])
+            model.risk_level_counts = self.risk_level_counts[i].tolist()
+            model.schedule.advance()
+            model.end_step()
+        # drop replicates that are no longer running
+        running = np.array([model.running for model in self.models])
+        if not running.all():
+            self.models = [m for m, keep in zip(self.models, running) if keep]
+            for name in (*self.array_names, "risk_level_counts"):
+                setattr(self, name, getattr(self, name)[running])
+
+    def choose(self):
+        "decide what all agents play this round; see model choose method"
+        model = self.template
+        if model.schedule.steps == 0:
+            return
+
+        num_dove_neighbors = (
+            self.neighbor_values(self.last_choice, model.observed_neighborhood)
+            == Play.DOVE
+        ).sum(axis=1)
+        ratio = 8 / model.observed_neighborhood
+        proportional_num_dove_neighbors = np.round(ratio * num_dove_neighbors)
+        choice = model.choice_array(proportional_num_dove_neighbors >= self.risk_level)
+
+        if model.random_play_odds:
+            # same values as drawing random play, then random choice
+            values = self.random((2, *choice.shape[1:]))
+            random_play = values[:, 0] < model.random_play_odds
+            random_choice = model.choice_array(values[:, 1] < 0.5)
+            choice = np.where(random_play, random_choice, choice)
+
+        self.choice = choice
+
+    def play(self):
+        "all agents play against their neighbors; see model play method"
+        model = self.template
+        hawk = self.choice == Play.HAWK
+        play_neighbors = self.neighbor_values(hawk, model.play_neighborhood)
+        hawk_neighbors = play_neighbors.sum(axis=1)
+        dove_neighbors = play_neighbors.shape[1] - hawk_neighbors
+        payoffs = np.asarray(model.payoff_matrix)[self.choice]
+        payoff = (
+            payoffs[..., Play.HAWK] * hawk_neighbors
+            + payoffs[..., Play.DOVE] * dove_neighbors
+        )
+        self.round_payoff = payoff
+        self.points += payoff
+        self.recent_points += payoff
+        self.hawk_count += hawk
+        self.last_choice = self.choice
+
+        if model.adjustment_round:
+            self.adjust_risk()
+            self.recent_points[:] = 0
+
+    def adjust_risk(self):
+        "all agents adjust risk in activation order; see model adjust_risk method"
+        adjusted, changed = adjust_risk_in_order(
+            self.template,
+            self.risk_level,
+            self.points,
+            self.recent_points,
+            self.round_payoff,
+            self.activation_order,
+            self.random,
+        )
+
+        # update risk level counts for each replicate, by counting
+        # risk levels offset by replicate
+        num_replicates, num_levels = self.risk_level_counts.shape
+        offset = (np.arange(num_replicates) * num_levels).reshape(-1, 1, 1)
+        size = num_replicates * num_levels
+        removed = np.bincount((self.risk_level + offset)[changed], minlength=size)
+        added = np.bincount((adjusted + offset)[changed], minlength=size)
+        self.risk_level_counts = self.risk_level_counts + (added - removed).reshape(
+            num_replicates, -1
+        )
+
+        self.risk_level = np.where(changed, adjusted, self.risk_level)
+        self.risk_level_changed = changed
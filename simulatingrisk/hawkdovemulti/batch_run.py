@@ -2,14 +2,39 @@
 
 import argparse
 import csv
+import gc
+import json
+import math
 import multiprocessing
 import os
+import re
+import resource
+import secrets
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
 from datetime import datetime
 from pathlib import Path
+from typing import NamedTuple
 
+import numpy as np
 from mesa.batchrunner import _make_model_kwargs
 from tqdm.auto import tqdm
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is optional; only required for parquet output
+    pa = None
+    pq = None
+
+from simulatingrisk.hawkdovemulti.array_model import (
+    HawkDoveMultipleRiskArrayModel,
+    ReplicateBatch,
+)
 from simulatingrisk.hawkdovemulti.model import (
     DataCollectionSchedule,
     HawkDoveMultipleRiskModel,
@@ -76,27 +101,207 @@ params = {
 }
 
 
-# method for multiproc running model with a set of params
-def run_hawkdovemulti_model(args) -> tuple[list[dict], list[dict] | None]:
-    (
-        run_id,
-        iteration,
-        params,
-        max_steps,
-        data_collection_schedule,
-        collect_agent_data,
-    ) = args
-    # simplified model runner adapted from mesa batch run code
-    # returns a tuple of model data, agent data (or None if not collecting agent data)
-    # data for each is returned as a list of dicts
+#: model implementations that can be used for batch runs
+engines = {
+    # agent-based mesa model
+    "mesa": HawkDoveMultipleRiskModel,
+    # array-backed model; same parameters, rules, and output, faster
+    "numpy": HawkDoveMultipleRiskArrayModel,
+    # array-backed model, running iterations of the same parameters
+    # together in each worker; same results as numpy, faster for small grids
+    "numpy-batched": HawkDoveMultipleRiskArrayModel,
+}
+
+#: engines that run iterations with the same parameters as a replicate batch
+replicate_engines = {"numpy-batched"}
+
 
-    # initialize model with run parameters and data collection options
-    model = HawkDoveMultipleRiskModel(
-        **params,
-        data_collection_schedule=data_collection_schedule,
-        collect_agent_data=collect_agent_data,
+class RunArgs(NamedTuple):
+    """Arguments for a single simulation run, passed to worker processes."""
+
+    run_id: int
+    iteration: int
+    params: dict
+    max_steps: int
+    data_collection_schedule: DataCollectionSchedule
+    collect_agent_data: bool
+    engine: str = "mesa"
+    seed: int | None = None
+    #: memory limit for the worker process, in bytes (no limit if None)
+    memory_limit: int | None = None
+    #: time each section of model steps
+    profile: bool = False
+    #: only update agents whose neighbors changed play (agent-based model only)
+    sparse_update: bool = False
+
+
+def run_seed(base_seed: int, run_id: int) -> int:
+    """Random seed for a single run, derived from the batch run seed and
+    the run id, so that any run can be reproduced on its own. Seeds for
+    different runs are generated as independent streams."""
+    return int(np.random.SeedSequence([base_seed, run_id]).generate_state(1)[0])
+
+
+class RunResult(NamedTuple):
+    """Compact results for a single simulation run, returned from worker
+    processes. Model data is stored as a list of values for each reporter,
+    and agent data as arrays for each column, without run parameters;
+    use :meth:`model_rows` and :meth:`agent_data` to combine with the
+    run arguments."""
+
+    run_id: int
+    #: collected steps (0-based)
+    steps: list[int]
+    #: model data values by reporter name, one value per collected step
+    model_vars: dict[str, list]
+    #: agent data arrays by column, or None if not collecting agent data
+    agent_columns: dict[str, np.ndarray] | None
+    #: time spent running the simulation, in seconds
+    elapsed: float
+    #: number of steps run
+    total_steps: int = 0
+    #: peak resident memory of the worker process during the run, in bytes
+    peak_memory: int = 0
+    #: True if the run was stopped for going over the memory limit;
+    #: failed runs have no model or agent data
+    failed: bool = False
+    #: True if the simulation converged before reaching maximum steps
+    converged: bool = False
+    #: True if the run was stopped by a keyboard interrupt before it
+    #: converged or reached maximum steps; data is partial, and the
+    #: run should be run again rather than recorded as completed
+    interrupted: bool = False
+    #: time spent initializing the model, in seconds
+    setup_time: float = 0.0
+    #: time spent running steps, not including data collection, in seconds
+    step_time: float = 0.0
+    #: time spent collecting and combining data, in seconds
+    collect_time: float = 0.0
+    #: process id of the worker that ran the simulation
+    pid: int = 0
+    #: time spent in each section of model steps, in seconds,
+    #: if profiling was enabled
+    step_profile: dict[str, float] | None = None
+
+    def model_rows(self, run: RunArgs) -> list[dict]:
+        """model data as a list of dicts (one per collected step), tagging
+        each row with run id, iteration, seed, step number (tracked by the
+        model), and the model parameter values that produced it, so rows
+        are self-describing in the exported data."""
+        return [
+            {
+                "RunId": run.run_id,
+                "iteration": run.iteration,
+                "seed": run.seed,
+                "Step": step,
+                **run.params,
+                **{name: values[i] for name, values in self.model_vars.items()},
+            }
+            for i, step in enumerate(self.steps)
+        ]
+
+    def agent_data(self, run: RunArgs) -> dict[str, np.ndarray] | None:
+        """agent data as a dict of arrays, with run id and iteration"""
+        if self.agent_columns is None:
+            return None
+        total_rows = len(self.agent_columns["Step"])
+        return {
+            "RunId": np.full(total_rows, run.run_id),
+            "iteration": np.full(total_rows, run.iteration),
+            **self.agent_columns,
+        }
+
+
+def current_memory() -> int:
+    """resident memory of the current process, in bytes"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # no /proc filesystem (e.g., macOS); use peak resident memory
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # reported in bytes on macOS, kilobytes on linux
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class MemoryWatchdog:
+    """Monitor resident memory of the current process in a background
+    thread, to track peak memory for each simulation run and flag runs
+    that go over a memory limit, so they can be stopped before they use
+    all available memory and crash the batch run. Memory is sampled every
+    :attr:`interval` seconds, and when a run starts and ends. The limit
+    applies to memory used since the start of the run, so memory the
+    worker process still holds from earlier runs does not count against
+    later runs.
+
+    The watchdog is cooperative: runs check it between steps, so it
+    cannot interrupt a step in progress. A single step that uses too
+    much memory can still crash the worker; the batch run timeout
+    (``--run-timeout``) stops the batch run in that case."""
+
+    #: seconds between memory samples
+    interval = 0.05
+
+    def __init__(self):
+        self.limit = None
+        self.peak = 0
+        #: process memory at the start of the current run
+        self.baseline = 0
+        self.exceeded = False
+        # process the monitor thread was started in; worker processes
+        # forked from a process with a running watchdog need their own
+        self.pid = None
+
+    def start_run(self, limit: int | None = None):
+        """reset peak memory and set the memory limit for a new run"""
+        self.limit = limit
+        self.baseline = current_memory()
+        self.peak = self.baseline
+        self.exceeded = False
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            threading.Thread(target=self.monitor, daemon=True).start()
+
+    def sample(self):
+        memory = current_memory()
+        self.peak = max(self.peak, memory)
+        if self.limit is not None and memory - self.baseline > self.limit:
+            self.exceeded = True
+
+    def monitor(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+
+#: memory watchdog for simulation runs in the current process
+memory_watchdog = MemoryWatchdog()
+
+
+def simulate(run: RunArgs) -> RunResult:
+    """run a single simulation and return compact results; if the run
+    goes over its memory limit, it is stopped and returned as failed,
+    without model or agent data"""
+    # simplified model runner adapted from mesa batch run code
+    start = time.perf_counter()
+    memory_watchdog.start_run(run.memory_limit)
+    # initialize model with run parameters, seed, and data collection options
+    model = engines[run.engine](
+        **run.params,
+        seed=run.seed,
+        data_collection_schedule=run.data_collection_schedule,
+        collect_agent_data=run.collect_agent_data,
+        profile=run.profile,
+        sparse_update=run.sparse_update,
     )
-    while model.running and model.schedule.steps <= max_steps:
+    # a large model can go over the limit before the first step
+    memory_watchdog.sample()
+    setup_time = time.perf_counter() - start
+    interrupted = False
+    while model.running and model.schedule.steps <= run.max_steps:
+        # stop runaway runs before they use all available memory
+        if memory_watchdog.exceeded:
+            break
         try:
             model.step()
         # by default, signals propagate to all processes
@@ -104,7 +309,33 @@ def run_hawkdovemulti_model(args) -> tuple[list[dict], list[dict] | None]:
         except KeyboardInterrupt:
             # if we get a ctrl-c / keyboard interrupt, stop looping
             # and finish data collection to report on whatever was completed
+            interrupted = True
             break
+    # time spent running steps, not including data collection
+    step_time = (
+        time.perf_counter() - start - setup_time - model.datacollector.collect_time
+    )
+    result = run_result(run, model, setup_time, step_time, interrupted)
+    if result.failed:
+        # release memory used by the failed run before the next run
+        del model
+        gc.collect()
+    return result
+
+
+def run_result(
+    run: RunArgs,
+    model: HawkDoveMultipleRiskModel,
+    setup_time: float,
+    step_time: float,
+    interrupted: bool = False,
+) -> RunResult:
+    """finish data collection for a simulation that has stopped running,
+    and return compact results; the run is failed if the worker process
+    went over its memory limit"""
+    start = time.perf_counter()
+    # data collection during steps, not including final data collection
+    collect_time = model.datacollector.collect_time
 
     # data collection schedule is now handled in the model, so we don't
     # collect model/agent data we don't need.
@@ -113,173 +344,1408 @@ def run_hawkdovemulti_model(args) -> tuple[list[dict], list[dict] | None]:
     # if we stopped without converging, force a final collect for last round data.
     # (ADJUST mode should also include last round, whether or not it was an adjustment
     # round.)
-    if data_collection_schedule is not DataCollectionSchedule.ALL and model.running:
+    if run.data_collection_schedule is not DataCollectionSchedule.ALL and model.running:
         model.running = False
         model.collect_data()
 
-    # convert all collected model data into a list of dicts (one per collected
-    # step), tagging each row with run id, iteration, step number (tracked
-    # by the model), and the model parameter values that produced it, so
-    # rows are self-describing in the exported CSV.
-    model_vars = model.datacollector.model_vars
-    collected_steps = list(model.collected_steps)
-    reporter_names = list(model_vars)
-    model_data = [
-        {
-            "RunId": run_id,
-            "iteration": iteration,
-            "Step": collected_steps[i],
-            **params,
-            **{name: model_vars[name][i] for name in reporter_names},
+    # optionally get all agent data
+    agent_columns = None
+    if run.collect_agent_data:
+        # agent data is collected as arrays for each step, combined into
+        # a single array per column.
+        # Step from mesa is 1-based (schedule.steps at collect time);
+        # shift to 0-based to match the model data output.
+        agent_columns = model.datacollector.get_agent_columns()
+        agent_columns["Step"] = agent_columns["Step"] - 1
+
+    collect_time += time.perf_counter() - start
+    step_profile = None
+    if run.profile:
+        # include sections that were never run (e.g., no adjustment rounds)
+        section_times = model.profile.seconds()
+        step_profile = {
+            section: section_times.get(section, 0.0)
+            for section in model.profile_sections
         }
-        for i in range(len(collected_steps))
+    memory_watchdog.sample()
+    failed = memory_watchdog.exceeded
+    return RunResult(
+        run.run_id,
+        [] if failed else list(model.collected_steps),
+        {} if failed else dict(model.datacollector.model_vars),
+        None if failed else agent_columns,
+        setup_time + step_time + collect_time,
+        total_steps=model.schedule.steps,
+        peak_memory=memory_watchdog.peak,
+        failed=failed,
+        converged=model.status == "converged",
+        interrupted=interrupted,
+        setup_time=setup_time,
+        step_time=step_time,
+        collect_time=collect_time,
+        pid=os.getpid(),
+        step_profile=step_profile,
+    )
+
+
+def simulate_replicates(runs: list[RunArgs]) -> list[RunResult]:
+    """Run simulations that differ only in iteration and seed together, as a
+    :class:`~simulatingrisk.hawkdovemulti.array_model.ReplicateBatch`,
+    and return compact results for each run; results are the same as
+    running each with :meth:`simulate` and the numpy engine. Time for
+    each batch step is divided evenly between the runs in the batch. If
+    the worker goes over its memory limit, all runs are stopped and
+    returned as failed. Step profiling is not supported."""
+    memory_watchdog.start_run(runs[0].memory_limit)
+    models = []
+    setup_times = []
+    for run in runs:
+        start = time.perf_counter()
+        models.append(
+            HawkDoveMultipleRiskArrayModel(
+                **run.params,
+                seed=run.seed,
+                data_collection_schedule=run.data_collection_schedule,
+                collect_agent_data=run.collect_agent_data,
+            )
+        )
+        setup_times.append(time.perf_counter() - start)
+    memory_watchdog.sample()
+    batch = ReplicateBatch(models)
+    step_times = dict.fromkeys(models, 0.0)
+    # models that were still running when interrupted
+    interrupted = set()
+    while batch.running and batch.steps <= runs[0].max_steps:
+        if memory_watchdog.exceeded:
+            break
+        start = time.perf_counter()
+        batch_models = batch.models
+        try:
+            batch.step()
+        except KeyboardInterrupt:
+            interrupted = {model for model in batch_models if model.running}
+            break
+        step_time = (time.perf_counter() - start) / len(batch_models)
+        for model in batch_models:
+            step_times[model] += step_time
+
+    results = [
+        run_result(
+            run,
+            model,
+            setup_time,
+            step_times[model] - model.datacollector.collect_time,
+            model in interrupted,
+        )
+        for run, model, setup_time in zip(runs, models, setup_times)
     ]
+    if memory_watchdog.exceeded:
+        del batch, models, step_times
+        gc.collect()
+    return results
 
-    # optionally get all agent data
-    agent_data = None
-    if collect_agent_data:
-        # _agent_records is a dict keyed by schedule.steps at collect time;
-        # each value is a list of (step, agent_id, *reporter_values) tuples.
-        # convert to a flat list of dicts. Step from mesa is 1-based
-        # (schedule.steps at collect time); shift to 0-based to match
-        # the model data output.
-        agent_reporters = list(model.datacollector.agent_reporters)
-        agent_data = [
+
+# method for multiproc running model with a set of params
+def run_hawkdovemulti_model(
+    args,
+) -> tuple[list[dict], dict[str, np.ndarray] | None]:
+    # returns a tuple of model data, agent data (or None if not collecting agent data)
+    # model data is returned as a list of dicts; agent data as a dict of arrays
+    run = RunArgs(*args)
+    result = simulate(run)
+    return result.model_rows(run), result.agent_data(run)
+
+
+def run_hawkdovemulti_chunk(runs: list[RunArgs]) -> list[RunResult]:
+    """run a chunk of simulations in a worker process; returns compact
+    results, to minimize the cost of sending results between processes.
+    Runs with a replicate engine are grouped by parameters and run
+    together with :meth:`simulate_replicates`."""
+    results = []
+    replicates = defaultdict(list)
+    for run in runs:
+        if run.engine in replicate_engines:
+            key = (
+                json.dumps(run.params, sort_keys=True),
+                run.max_steps,
+                run.data_collection_schedule,
+                run.collect_agent_data,
+                run.memory_limit,
+            )
+            replicates[key].append(run)
+        else:
+            results.append(simulate(run))
+    for replicate_runs in replicates.values():
+        results.extend(simulate_replicates(replicate_runs))
+    return results
+
+
+#: maximum number of runs to send to a worker process at once
+max_chunk_size = 50
+
+
+def make_chunks(
+    runs: list[RunArgs],
+    costs: dict[int, float],
+    number_processes: int,
+    chunk_size: int | None = None,
+) -> list[list[RunArgs]]:
+    """Order runs by expected cost (by run id), most expensive first, so
+    the longest runs don't start at the end of a batch run, and group them
+    into chunks to send to worker processes as a single task. Grouping
+    runs reduces per-task communication overhead, which can be larger than
+    the simulation time for small grids. Unless a chunk size is specified,
+    chunks are sized by expected cost, so there are about four chunks
+    per process, up to :data:`max_chunk_size` runs; expensive runs are
+    sent one at a time. Since workers take the next chunk as soon as they
+    finish one, work is balanced across processes as the batch runs."""
+    runs = sorted(runs, key=lambda run: costs[run.run_id], reverse=True)
+    if chunk_size is not None:
+        return [runs[i : i + chunk_size] for i in range(0, len(runs), chunk_size)]
+
+    target_cost = sum(costs[run.run_id] for run in runs) / (number_processes * 4)
+    chunks = []
+    chunk = []
+    chunk_cost = 0
+    for run in runs:
+        cost = costs[run.run_id]
+        if chunk and (chunk_cost + cost > target_cost or len(chunk) >= max_chunk_size):
+            chunks.append(chunk)
+            chunk = []
+            chunk_cost = 0
+        chunk.append(run)
+        chunk_cost += cost
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class CSVResultWriter:
+    """Write batch run results to CSV files: one for model data, and
+    optionally one for agent data. Results are written and flushed as
+    they arrive, so partial results survive an abrupt exit."""
+
+    def __init__(
+        self,
+        data_dir: Path,
+        base_name: str,
+        collect_agent_data: bool,
+        param_combinations: list[dict],
+    ):
+        self.model_path = data_dir / f"{base_name}_model.csv"
+        self.agent_path = None
+        if collect_agent_data:
+            self.agent_path = data_dir / f"{base_name}_agent.csv"
+        self.model_file = None
+        self.agent_file = None
+        self.model_dict_writer = None
+        self.agent_csv_writer = None
+
+    def __enter__(self):
+        # open output files so data can be written as it is generated
+        self.model_file = open(self.model_path, "w", newline="")
+        if self.agent_path:
+            self.agent_file = open(self.agent_path, "w", newline="")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def paths(self) -> list[Path]:
+        return [path for path in [self.model_path, self.agent_path] if path]
+
+    def write(self, model_data: list[dict], agent_data: dict | None) -> list[int]:
+        """write results for a single run; returns a list of run ids
+        for results that have been saved"""
+        # initialize dictwriter and start csv after the first batch
+        if self.model_dict_writer is None:
+            # get field names from first entry (assumes rows are consistent;
+            # must be enforced in model data collection)
+            self.model_dict_writer = csv.DictWriter(
+                self.model_file, model_data[0].keys()
+            )
+            self.model_dict_writer.writeheader()
+
+        self.model_dict_writer.writerows(model_data)
+        # flush after every batch so partial results survive
+        # an abrupt exit
+        self.model_file.flush()
+
+        if self.agent_file:
+            if self.agent_csv_writer is None:
+                # get field names from first result
+                self.agent_csv_writer = csv.writer(self.agent_file)
+                self.agent_csv_writer.writerow(agent_data.keys())
+
+            # write rows directly from the columns
+            self.agent_csv_writer.writerows(
+                zip(*(column.tolist() for column in agent_data.values()))
+            )
+            self.agent_file.flush()
+
+        return [model_data[0]["RunId"]]
+
+    def close(self) -> list[int]:
+        for output_file in [self.model_file, self.agent_file]:
+            if output_file:
+                output_file.close()
+        # all results are saved as they are written
+        return []
+
+
+#: parquet data types for model data fields that can't be inferred
+#: from a single value (e.g., reporters that are sometimes unset)
+model_data_types = {
+    "RunId": "int64",
+    "iteration": "int64",
+    "seed": "int64",
+    "Step": "int64",
+    "max_agent_points": "double",
+    "percent_hawk": "double",
+    "rolling_percent_hawk": "double",
+    "status": "string",
+    "total_agents": "int64",
+    "population_risk_category": "int64",
+    "num_agents_risk_changed": "int64",
+    "sum_risk_level_changes": "int64",
+    **{f"total_r{risk_level}": "int64" for risk_level in range(10)},
+}
+
+
+class ParquetPartWriter:
+    """Write a parquet dataset directory as numbered part files. Rows are
+    buffered and written to the current part file as a compressed row
+    group whenever :attr:`rows_per_group` rows have accumulated, so only
+    a single row group is held in memory. The current part file has a
+    temporary name (ignored when reading the dataset) until it is
+    finished, since a parquet file can't be read until it is closed.
+
+    Requires pyarrow."""
+
+    def __init__(self, path: Path, rows_per_group: int, compression: str):
+        self.path = path
+        self.path.mkdir()
+        self.rows_per_group = rows_per_group
+        self.compression = compression
+        self.schema = None
+        self.tables = []
+        #: rows buffered for the next row group
+        self.buffered_rows = 0
+        #: rows in the current part file, including buffered rows
+        self.part_rows = 0
+        self.parts = 0
+        self.writer = None
+
+    def part_path(self, temporary: bool = False) -> Path:
+        if temporary:
+            # files starting with an underscore are ignored by pyarrow
+            return self.path / f"_part-{self.parts:05d}.inprogress"
+        return self.path / f"part-{self.parts:05d}.parquet"
+
+    def write(self, table):
+        """buffer a table of rows, and write a row group to the current
+        part file once enough rows have accumulated"""
+        if self.schema is None:
+            self.schema = table.schema
+        self.tables.append(table.cast(self.schema))
+        self.buffered_rows += table.num_rows
+        self.part_rows += table.num_rows
+        if self.buffered_rows >= self.rows_per_group:
+            self.write_row_group()
+
+    def write_row_group(self):
+        if not self.tables:
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(
+                self.part_path(temporary=True),
+                self.schema,
+                compression=self.compression,
+            )
+        self.writer.write_table(
+            pa.concat_tables(self.tables), row_group_size=self.buffered_rows
+        )
+        self.tables = []
+        self.buffered_rows = 0
+
+    def finish_part(self):
+        """write any buffered rows and close the current part file, so
+        that it can be read"""
+        self.write_row_group()
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        self.part_path(temporary=True).rename(self.part_path())
+        self.parts += 1
+        self.part_rows = 0
+
+
+class ParquetResultWriter:
+    """Write batch run results in parquet format: a dataset directory for
+    model data, and optionally one for agent data, each containing
+    numbered part files (see :class:`ParquetPartWriter`). Results are
+    written to the current part files as compressed row groups as they
+    arrive, and part files are finished whenever enough rows have
+    accumulated, so finished parts can be read even if the batch run
+    exits abruptly. Parameters are stored as typed columns, based on all
+    values in the parameter set.
+
+    Requires pyarrow."""
+
+    #: number of model data rows to buffer before writing a row group
+    model_rows_per_group = 1_000
+    #: number of model data rows in each part file
+    model_rows_per_part = 10_000
+    #: number of agent data rows to buffer before writing a row group
+    agent_rows_per_group = 500_000
+    #: number of agent data rows in each part file
+    agent_rows_per_part = 5_000_000
+    #: parquet compression codec
+    compression = "zstd"
+
+    def __init__(
+        self,
+        data_dir: Path,
+        base_name: str,
+        collect_agent_data: bool,
+        param_combinations: list[dict],
+    ):
+        self.model_path = data_dir / f"{base_name}_model"
+        self.model_writer = ParquetPartWriter(
+            self.model_path, self.model_rows_per_group, self.compression
+        )
+        self.agent_path = None
+        self.agent_writer = None
+        if collect_agent_data:
+            self.agent_path = data_dir / f"{base_name}_agent"
+            self.agent_writer = ParquetPartWriter(
+                self.agent_path, self.agent_rows_per_group, self.compression
+            )
+
+        # determine column type for each parameter from all of its values
+        self.param_types = {}
+        for key in param_combinations[0]:
+            param_type = pa.array([p[key] for p in param_combinations]).type
+            # a parameter that is always unset is stored as a string
+            self.param_types[key] = (
+                pa.string() if pa.types.is_null(param_type) else param_type
+            )
+
+        # run ids for results in part files that are not yet finished
+        self.pending_run_ids = []
+        self.model_schema = None
+
+    @property
+    def paths(self) -> list[Path]:
+        return [path for path in [self.model_path, self.agent_path] if path]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, model_data: list[dict], agent_data: dict | None) -> list[int]:
+        """write results for a single run, and finish part files when
+        enough rows have accumulated; returns a list of run ids for
+        results that have been saved"""
+        self.pending_run_ids.append(model_data[0]["RunId"])
+        if self.model_schema is None:
+            self.model_schema = self.get_model_schema(model_data)
+        self.model_writer.write(
+            pa.Table.from_pylist(model_data, schema=self.model_schema)
+        )
+        if self.agent_writer:
+            self.agent_writer.write(pa.table(agent_data))
+
+        if self.model_writer.part_rows >= self.model_rows_per_part or (
+            self.agent_writer
+            and self.agent_writer.part_rows >= self.agent_rows_per_part
+        ):
+            return self.finish_parts()
+        return []
+
+    def finish_parts(self) -> list[int]:
+        # finish model and agent parts together, so that all data
+        # for pending runs is saved at the same time
+        self.model_writer.finish_part()
+        if self.agent_writer:
+            self.agent_writer.finish_part()
+        saved_run_ids = self.pending_run_ids
+        self.pending_run_ids = []
+        return saved_run_ids
+
+    def get_model_schema(self, rows: list[dict]):
+        fields = []
+        for key in rows[0]:
+            if key in self.param_types:
+                field_type = self.param_types[key]
+            elif key in model_data_types:
+                field_type = pa.type_for_alias(model_data_types[key])
+            else:
+                field_type = pa.array([row[key] for row in rows]).type
+                if pa.types.is_null(field_type):
+                    field_type = pa.string()
+            fields.append((key, field_type))
+        return pa.schema(fields)
+
+    def close(self) -> list[int]:
+        # write any remaining results
+        return self.finish_parts()
+
+
+#: output formats supported by the batch run script
+output_formats = {"csv": CSVResultWriter, "parquet": ParquetResultWriter}
+
+
+class RunStatsWriter:
+    """Write telemetry for each run to a CSV file alongside batch run
+    results: worker process id, whether the run converged or reached the
+    maximum number of steps, number of steps, time spent on model setup,
+    steps, and data collection, and peak worker memory. Includes runs
+    that failed by going over the memory limit (which have no other
+    output). When runs are profiled, also includes time spent in each
+    section of model steps. Also keeps totals for an end of batch run
+    :meth:`summary`, to identify which parameters are most expensive
+    to run."""
+
+    fieldnames = (
+        "RunId",
+        "iteration",
+        "seed",
+        "pid",
+        "failed",
+        "converged",
+        "total_steps",
+        "elapsed",
+        "setup_time",
+        "step_time",
+        "collect_time",
+        "peak_memory_mb",
+    )
+
+    def __init__(
+        self,
+        data_dir: Path,
+        base_name: str,
+        param_combinations: list[dict],
+        profile_sections: tuple[str, ...] | None = None,
+    ):
+        self.path = data_dir / f"{base_name}_runs.csv"
+        self.profile_sections = profile_sections or ()
+        self.columns = [
+            *self.fieldnames,
+            *(f"profile_{section}" for section in self.profile_sections),
+            *param_combinations[0].keys(),
+        ]
+        self.file = None
+        self.writer = None
+        # values for parameters with more than one value, in order,
+        # to summarize time per value
+        self.varied_params = {}
+        for key in param_combinations[0]:
+            values = list(dict.fromkeys(str(p[key]) for p in param_combinations))
+            if len(values) > 1:
+                self.varied_params[key] = values
+        self.failed = 0
+        self.converged = 0
+        self.run_times = []
+        self.phase_times = {"setup": 0.0, "steps": 0.0, "data collection": 0.0}
+        self.peak_memory = 0
+        # total time and number of runs for each parameter value
+        self.param_times = defaultdict(lambda: [0.0, 0])
+        self.profile_times = Counter()
+
+    def write(self, result: RunResult, run: RunArgs):
+        self.writer.writerow(
             {
-                "RunId": run_id,
-                "iteration": iteration,
-                "Step": step_key - 1,
-                "AgentID": record[1],
-                **dict(zip(agent_reporters, record[2:])),
+                "RunId": run.run_id,
+                "iteration": run.iteration,
+                "seed": run.seed,
+                "pid": result.pid,
+                "failed": result.failed,
+                "converged": result.converged,
+                "total_steps": result.total_steps,
+                "elapsed": round(result.elapsed, 4),
+                "setup_time": round(result.setup_time, 4),
+                "step_time": round(result.step_time, 4),
+                "collect_time": round(result.collect_time, 4),
+                "peak_memory_mb": round(result.peak_memory / 1024**2, 1),
+                **{
+                    f"profile_{section}": round(section_time, 4)
+                    for section, section_time in (result.step_profile or {}).items()
+                },
+                **run.params,
             }
-            for step_key, records in model.datacollector._agent_records.items()
-            for record in records
+        )
+        # flush so stats for failed runs survive an abrupt exit
+        self.file.flush()
+
+        self.failed += result.failed
+        self.converged += result.converged
+        self.run_times.append(result.elapsed)
+        self.phase_times["setup"] += result.setup_time
+        self.phase_times["steps"] += result.step_time
+        self.phase_times["data collection"] += result.collect_time
+        self.peak_memory = max(self.peak_memory, result.peak_memory)
+        self.profile_times.update(result.step_profile or {})
+        for key in self.varied_params:
+            param_time = self.param_times[(key, str(run.params[key]))]
+            param_time[0] += result.elapsed
+            param_time[1] += 1
+
+    def __enter__(self):
+        self.file = open(self.path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, self.columns)
+        self.writer.writeheader()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+    def summary(self) -> str:
+        """summary of run outcomes, time, and memory use, with mean
+        time per run for each value of parameters that vary"""
+        total_runs = len(self.run_times)
+        if not total_runs:
+            return "No runs completed"
+        max_steps = total_runs - self.converged - self.failed
+        total_time = sum(self.run_times)
+        phases = ", ".join(
+            f"{phase_time / total_time:.0%} {phase}"
+            for phase, phase_time in self.phase_times.items()
+        )
+        lines = [
+            f"Run statistics for {total_runs} runs: {self.converged} converged, "
+            + f"{max_steps} reached max steps, {self.failed} failed",
+            f"Simulation time {total_time:.1f}s ({phases}); per run: median "
+            + f"{statistics.median(self.run_times):.3f}s, "
+            + f"max {max(self.run_times):.3f}s; "
+            + f"peak worker memory {self.peak_memory / 1024**2:.0f} MB",
         ]
+        if self.profile_times:
+            total_profile_time = sum(self.profile_times.values())
+            sections = ", ".join(
+                f"{self.profile_times[section] / total_profile_time:.0%} {section}"
+                for section in self.profile_sections
+            )
+            lines.append(f"Step profile: {sections}")
+        if self.varied_params:
+            lines.append("Mean time per run by parameter value:")
+        for key, values in self.varied_params.items():
+            value_times = []
+            for value in values:
+                if (key, value) in self.param_times:
+                    param_time, runs = self.param_times[(key, value)]
+                    value_times.append(f"{value}={param_time / runs:.3f}s")
+            lines.append(f"  {key}: {', '.join(value_times)}")
+        return "\n".join(lines)
 
-    return model_data, agent_data
 
+class RunCostModel:
+    """Estimate the relative cost of simulation runs, so the longest runs
+    can be scheduled first. Cost per step is based on the number of agents
+    and the number of neighbors each agent plays, observes, and compares
+    with when adjusting risk attitude. Expected steps are the model's
+    minimum steps before the simulation can converge, or the average
+    number of steps for runs with the same parameters in previous batch
+    run outputs (see :meth:`calibrate`)."""
 
-def batch_run(
-    params: dict,
+    def __init__(self, max_steps: int, model_class=HawkDoveMultipleRiskModel):
+        self.max_steps = max_steps
+        self.model_class = model_class
+        #: average steps from previous outputs, by parameter key
+        self.calibrated_steps = {}
+
+    @staticmethod
+    def param_key(params: dict) -> str:
+        """key to match parameters with previous output; parameter values
+        are compared as strings, since CSV output is not typed"""
+        return json.dumps(
+            {
+                name: "" if value is None else str(value)
+                for name, value in params.items()
+            },
+            sort_keys=True,
+        )
+
+    def adjusting(self, params: dict) -> bool:
+        return params.get("risk_adjustment", "adopt") not in [None, "none", ""]
+
+    def expected_steps(self, params: dict) -> float:
+        key = self.param_key(params)
+        if key in self.calibrated_steps:
+            return self.calibrated_steps[key]
+        if self.adjusting(params):
+            # converges after the minimum, if risk levels are stable
+            # across two adjustment rounds
+            steps = self.model_class.min_steps_adjusting + 2 * params.get(
+                "adjust_every", 10
+            )
+        else:
+            steps = self.model_class.min_steps_converge
+        return min(steps, self.max_steps + 1)
+
+    def cost(self, params: dict) -> float:
+        """relative expected cost of a run with the specified parameters"""
+        play_neighborhood = params.get("play_neighborhood", 8)
+        neighbors = play_neighborhood + params.get("observed_neighborhood", 8)
+        if self.adjusting(params):
+            adjust_neighborhood = params.get("adjust_neighborhood") or play_neighborhood
+            neighbors += adjust_neighborhood / params.get("adjust_every", 10)
+        agents = params["grid_size"] ** 2
+        return agents * neighbors * self.expected_steps(params)
+
+    def calibrate(self, paths: list[Path]) -> int:
+        """Calibrate expected steps from model data in previous batch run
+        outputs (CSV files or parquet datasets); returns the number of
+        runs found."""
+        # final step for each run, by output path and run id
+        final_steps = {}
+        for path in paths:
+            for row in read_model_data(path):
+                params = {
+                    name: value
+                    for name, value in row.items()
+                    if name not in model_data_types
+                }
+                run = (path, row["RunId"])
+                step = int(row["Step"])
+                if run not in final_steps or step > final_steps[run][1]:
+                    final_steps[run] = (self.param_key(params), step)
+
+        steps_by_key = defaultdict(list)
+        for key, step in final_steps.values():
+            steps_by_key[key].append(step)
+        self.calibrated_steps = {
+            key: statistics.mean(steps) for key, steps in steps_by_key.items()
+        }
+        return len(final_steps)
+
+
+def read_model_data(path: Path):
+    """generator of model data rows from a CSV file or parquet dataset"""
+    if path.suffix == ".csv":
+        with open(path, newline="") as model_file:
+            yield from csv.DictReader(model_file)
+    else:
+        if pq is None:
+            raise ValueError(f"Reading parquet data from {path} requires pyarrow")
+        yield from pq.read_table(path).to_pylist()
+
+
+def run_key(params: dict, iteration: int) -> tuple[str, int]:
+    """key to identify a run by parameters and iteration, independent
+    of run id"""
+    return (json.dumps(params, sort_keys=True), iteration)
+
+
+class RunManifest:
+    """
+    Record of a batch run, so that an interrupted batch run can be resumed.
+    Batch run configuration and output files are stored in a JSON manifest
+    file; completed runs are appended to a JSON lines file as soon as
+    their results are saved.
+    """
+
+    #: configuration options that must match to resume a batch run
+    resume_options = (
+        "param_choice",
+        "data_collection_schedule",
+        "collect_agent_data",
+        "max_steps",
+        "engine",
+        "output_format",
+        "seed",
+        "dedupe",
+        "adaptive",
+    )
+
+    def __init__(self, path: Path, config: dict, outputs: list[str] | None = None):
+        self.path = path
+        self.config = config
+        self.outputs = outputs or []
+        self.completed_path = path.with_name(
+            path.name.replace("_manifest.json", "_completed.jsonl")
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "RunManifest":
+        with open(path) as manifest_file:
+            data = json.load(manifest_file)
+        return cls(path, data["config"], data["outputs"])
+
+    @classmethod
+    def find_latest(cls, data_dir: Path, file_prefix: str) -> "RunManifest | None":
+        """find the most recent manifest in a data directory for batch runs
+        with the specified file prefix"""
+        # manifest filenames are prefix, start date and time, then _manifest
+        filename_re = re.compile(
+            re.escape(file_prefix) + r"\d{4}-\d{2}-\d{2}T.*_manifest\.json"
+        )
+        manifests = sorted(
+            path
+            for path in data_dir.glob(f"{file_prefix}*_manifest.json")
+            if filename_re.fullmatch(path.name)
+        )
+        if manifests:
+            return cls.load(manifests[-1])
+
+    def save(self):
+        # write to a temporary file and then replace, so that the manifest
+        # is never left incomplete
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(
+                {"config": self.config, "outputs": self.outputs},
+                manifest_file,
+                indent=2,
+            )
+        tmp_path.replace(self.path)
+
+    def add_outputs(self, paths: list[Path]):
+        """record output files for the current batch run"""
+        self.outputs.extend(str(path) for path in paths)
+        self.save()
+
+    def check_config(self, config: dict):
+        """check that a new batch run configuration is compatible with this
+        batch run; raises ValueError if it is not"""
+        mismatched = [
+            option
+            for option in self.resume_options
+            if self.config.get(option) != config.get(option)
+        ]
+        if mismatched:
+            raise ValueError(
+                f"Can't resume batch run from {self.path}; "
+                + f"options do not match: {', '.join(mismatched)}"
+            )
+
+    def log_completed(self, runs: list[RunArgs], outcomes: dict | None = None):
+        """record runs with saved results as completed; optionally
+        include run outcomes, by run id"""
+        if not runs:
+            return
+        with open(self.completed_path, "a") as completed_file:
+            for run in runs:
+                entry = {
+                    "RunId": run.run_id,
+                    "iteration": run.iteration,
+                    "seed": run.seed,
+                    "params": run.params,
+                }
+                if outcomes and run.run_id in outcomes:
+                    entry["outcome"] = outcomes[run.run_id]
+                completed_file.write(json.dumps(entry) + "\n")
+
+    def read_completed(self):
+        """generator of entries for all completed runs"""
+        if not self.completed_path.exists():
+            return
+        with open(self.completed_path) as completed_file:
+            for line in completed_file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # ignore an incomplete line, if writing was interrupted
+                    continue
+
+    def completed_runs(self) -> set[tuple[str, int]]:
+        """set of keys (see :meth:`run_key`) for all completed runs"""
+        return {
+            run_key(run["params"], run["iteration"]) for run in self.read_completed()
+        }
+
+    def drop_incomplete_results(self) -> int:
+        """Remove results for runs that are not recorded as completed from
+        output files, so runs that are run again when resuming are not
+        duplicated (e.g., results saved just before the batch run exited,
+        without being recorded as completed). Returns the number of
+        rows removed."""
+        completed_ids = {run["RunId"] for run in self.read_completed()}
+        total_dropped = 0
+        for output in self.outputs:
+            path = Path(output)
+            if path.is_dir():
+                # parquet dataset directory
+                for part_path in sorted(path.glob("part-*.parquet")):
+                    total_dropped += drop_parquet_rows(part_path, completed_ids)
+                # unfinished part files only contain runs that were not
+                # recorded as completed
+                for part_path in path.glob("_part-*.inprogress"):
+                    part_path.unlink()
+            elif path.exists():
+                total_dropped += drop_csv_rows(path, completed_ids)
+        return total_dropped
+
+
+def drop_csv_rows(path: Path, run_ids: set[int]) -> int:
+    """rewrite a CSV result file with only rows for the specified run ids;
+    returns the number of rows removed"""
+    dropped = 0
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(path, newline="") as infile, open(tmp_path, "w", newline="") as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        header = next(reader, None)
+        if header is not None:
+            writer.writerow(header)
+            run_id_index = header.index("RunId")
+            for row in reader:
+                # skip any incomplete last row, if writing was interrupted
+                if len(row) == len(header) and int(row[run_id_index]) in run_ids:
+                    writer.writerow(row)
+                else:
+                    dropped += 1
+    if dropped:
+        tmp_path.replace(path)
+    else:
+        tmp_path.unlink()
+    return dropped
+
+
+def drop_parquet_rows(path: Path, run_ids: set[int]) -> int:
+    """rewrite a parquet part file with only rows for the specified run ids,
+    removing the file if no rows are left; returns the number of rows
+    removed. Requires pyarrow."""
+    table = pq.read_table(path)
+    keep = pa.array([run_id in run_ids for run_id in table.column("RunId").to_pylist()])
+    kept = table.filter(keep)
+    dropped = table.num_rows - kept.num_rows
+    if not kept.num_rows:
+        path.unlink()
+    elif dropped:
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        pq.write_table(kept, tmp_path, compression=ParquetResultWriter.compression)
+        tmp_path.replace(path)
+    return dropped
+
+
+class ParamGridPlan(NamedTuple):
+    """Parameter combinations to run, after removing duplicate and
+    invalid combinations from a full parameter grid."""
+
+    #: parameter combinations to run
+    combinations: list[dict]
+    #: number of parameter combinations in the full grid
+    total: int
+    #: number of combinations equivalent to another combination
+    duplicates: int
+    #: number of invalid combinations, by validation error message
+    invalid: Counter
+
+    def summary(self, iterations: int) -> str:
+        skipped = self.total - len(self.combinations)
+        if not skipped:
+            return "No duplicate or invalid parameter combinations"
+        percent = skipped / self.total
+        lines = [
+            f"Skipping {skipped} of {self.total} parameter combinations "
+            + f"({percent:.1%}, {skipped * iterations} runs): "
+            + f"{self.duplicates} duplicate, {self.invalid.total()} invalid"
+        ]
+        lines.extend(
+            f"  {count} invalid: {message}"
+            for message, count in self.invalid.most_common()
+        )
+        return "\n".join(lines)
+
+
+def plan_param_grid(
+    param_combinations: list[dict],
+    model_class: type[HawkDoveMultipleRiskModel],
+    data_collection_schedule: DataCollectionSchedule,
+) -> ParamGridPlan:
+    """Remove invalid parameter combinations, based on the model's parameter
+    validation, and combinations that result in equivalent simulations,
+    based on the model's canonical parameters. The first of any equivalent
+    combinations is kept, with parameters as specified."""
+    combinations = []
+    seen = set()
+    duplicates = 0
+    invalid = Counter()
+    for params in param_combinations:
+        try:
+            model_class.check_parameters(
+                **params, data_collection_schedule=data_collection_schedule
+            )
+        except ValueError as err:
+            invalid[str(err)] += 1
+            continue
+        key = json.dumps(model_class.canonical_parameters(params), sort_keys=True)
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        combinations.append(params)
+    return ParamGridPlan(combinations, len(param_combinations), duplicates, invalid)
+
+
+class TaskOverhead:
+    """Measure overhead of running simulations in worker processes:
+    time spent on anything other than simulation (sending tasks and
+    results between processes, writing results, idle workers), based on
+    elapsed time and total simulation time across all worker processes."""
+
+    def __init__(self, number_processes: int):
+        self.number_processes = number_processes
+        self.start = time.perf_counter()
+        self.runs = 0
+        self.simulation_time = 0.0
+
+    def add(self, result: RunResult):
+        self.runs += 1
+        self.simulation_time += result.elapsed
+
+    @property
+    def per_run(self) -> float:
+        """average overhead per run, in seconds"""
+        if not self.runs:
+            return 0.0
+        elapsed = time.perf_counter() - self.start
+        worker_time = elapsed * self.number_processes
+        return max(0.0, worker_time - self.simulation_time) / self.runs
+
+    def __str__(self):
+        simulation_per_run = self.simulation_time / self.runs if self.runs else 0.0
+        return (
+            f"average per run: {simulation_per_run:.4f}s simulation, "
+            + f"{self.per_run:.4f}s overhead"
+        )
+
+
+def run_outcome(result: RunResult) -> tuple[int, float]:
+    """outcome of a simulation run, for adaptive iterations: population
+    risk category and percent hawk at the last collected step"""
+    return (
+        result.model_vars["population_risk_category"][-1],
+        result.model_vars["percent_hawk"][-1],
+    )
+
+
+class AdaptiveIterations:
+    """Sequential stopping for iterations of each parameter combination.
+    Iterations are run in waves, and a parameter combination stops once
+    the 95% confidence intervals for its outcomes (frequency of each
+    population risk category, and mean percent hawk) are narrower than
+    the specified half-width."""
+
+    #: z-score for 95% confidence intervals
+    z = 1.96
+
+    def __init__(self, min_iterations: int, ci_width: float):
+        self.min_iterations = min_iterations
+        self.ci_width = ci_width
+        #: run outcomes (see :meth:`run_outcome`), by parameter combination
+        self.outcomes = defaultdict(list)
+
+    def add(self, combination: int, outcome: tuple[int, float]):
+        self.outcomes[combination].append(outcome)
+
+    def interval_width(self, combination: int) -> float:
+        """half-width of the widest confidence interval for outcomes of
+        a parameter combination"""
+        outcomes = self.outcomes[combination]
+        n = len(outcomes)
+        if n < 2:
+            return math.inf
+        # use Agresti-Coull intervals for category frequencies, so that
+        # unanimous outcomes from a few iterations are still uncertain
+        z2 = self.z**2
+        adjusted_n = n + z2
+        widths = []
+        for count in Counter(category for category, _ in outcomes).values():
+            p = (count + z2 / 2) / adjusted_n
+            widths.append(self.z * math.sqrt(p * (1 - p) / adjusted_n))
+        hawk_stdev = statistics.stdev(percent_hawk for _, percent_hawk in outcomes)
+        widths.append(self.z * hawk_stdev / math.sqrt(n))
+        return max(widths)
+
+    def done(self, combination: int) -> bool:
+        """check if a parameter combination has enough iterations"""
+        return (
+            len(self.outcomes[combination]) >= self.min_iterations
+            and self.interval_width(combination) <= self.ci_width
+        )
+
+    def next_wave(self, pending: dict[int, list[RunArgs]]) -> list[RunArgs]:
+        """Get the next wave of runs from pending runs for each parameter
+        combination; removes scheduled runs from pending runs. Stopped
+        combinations are skipped, and runs for combinations with the
+        widest confidence intervals are scheduled first."""
+        active = [
+            combination
+            for combination, runs in pending.items()
+            if runs and not self.done(combination)
+        ]
+        active.sort(key=self.interval_width, reverse=True)
+        wave = []
+        for combination in active:
+            wave.extend(pending[combination][: self.min_iterations])
+            del pending[combination][: self.min_iterations]
+        return wave
+
+    def max_remaining(self, pending: dict[int, list[RunArgs]]) -> int:
+        """maximum number of pending runs that may still be scheduled"""
+        return sum(
+            len(runs)
+            for combination, runs in pending.items()
+            if not self.done(combination)
+        )
+
+    def summary(self, total_combinations: int) -> str:
+        done = sum(self.done(combination) for combination in self.outcomes)
+        return (
+            f"{done} of {total_combinations} parameter combinations reached "
+            + f"confidence interval width {self.ci_width}"
+        )
+
+
+#: seconds allowed per step when waiting for a simulation run, unless
+#: a run timeout is specified; generous, since a step of the agent-based
+#: model on a 100x100 grid with the largest neighborhoods takes ~0.2s
+step_timeout = 1.0
+
+#: maximum seconds to wait for a chunk of runs, unless a single run is
+#: allowed longer; runs are only chunked together when they are expected
+#: to be short, so the per-step allowance for every run in the largest
+#: chunk would be far too long (about 14 hours at default settings)
+max_chunk_timeout = 3600.0
+
+
+def run_chunks(
+    pool, chunks: list[list[RunArgs]], handle_results, pbar, run_timeout: float
+) -> bool:
+    """Run chunks of simulations in a worker pool, and handle results as
+    they are completed. Returns False if stopped because a simulation
+    run did not complete within the timeout (in seconds per run, up to
+    :data:`max_chunk_timeout` for a chunk of runs)."""
+    # iterate over results in a loop so we can specify a timeout
+    # and handle keyboard interrupts cleanly.
+    results_iter = pool.imap_unordered(run_hawkdovemulti_chunk, chunks)
+    timeout = min(
+        run_timeout * max(len(chunk) for chunk in chunks),
+        max(run_timeout, max_chunk_timeout),
+    )
+    while True:
+        try:
+            results = results_iter.next(timeout=timeout)
+        except multiprocessing.TimeoutError:
+            print(
+                "\nTimeout error waiting for a simulation run to "
+                "complete; possible crash or OOM (use --memory-limit to stop "
+                "runs that use too much memory). Quitting."
+            )
+            return False
+        except StopIteration:
+            return True
+        handle_results(results)
+        pbar.update(len(results))
+
+
+def get_param_combinations(
+    run_params: dict,
     iterations: int,
-    number_processes: int,
-    max_steps: int,
-    progressbar: bool,
-    file_prefix: str,
-    max_runs: int,
-    param_choice: str,
     data_collection_schedule: DataCollectionSchedule,
-    collect_agent_data: bool,
-):
-    run_params = params.get(param_choice)
+    engine: str = "mesa",
+    dedupe: bool = False,
+) -> list[dict]:
+    """Get all combinations of a set of parameters, optionally skipping
+    invalid and equivalent combinations, and report the number of runs."""
     param_combinations = _make_model_kwargs(run_params)
-    total_param_combinations = len(param_combinations)
-    total_runs = total_param_combinations * iterations
+    if dedupe:
+        # skip invalid combinations and combinations equivalent to another
+        plan = plan_param_grid(
+            param_combinations, engines[engine], data_collection_schedule
+        )
+        print(plan.summary(iterations))
+        param_combinations = plan.combinations
+    total_runs = len(param_combinations) * iterations
     print(
-        f"{total_param_combinations} parameter combinations, "
+        f"{len(param_combinations)} parameter combinations, "
         + f"{iterations} iteration{'s' if iterations != 1 else ''}, "
         + f"{total_runs} total runs"
     )
+    return param_combinations
 
-    # create a list of all the parameters to run, with run id and iteration
+
+def make_runs(
+    param_combinations: list[dict],
+    iterations: int,
+    seed: int,
+    max_steps: int,
+    data_collection_schedule: DataCollectionSchedule,
+    collect_agent_data: bool,
+    engine: str = "mesa",
+    memory_limit: int | None = None,
+    profile: bool = False,
+    sparse_update: bool = False,
+) -> list[RunArgs]:
+    """Create a list of all the parameters to run, with run id, iteration,
+    and a seed derived from the run id. Run ids are numbered sequentially
+    by parameter combination and iteration."""
     runs_list = []
     run_id = 0
     for params in param_combinations:
         for iteration in range(iterations):
             runs_list.append(
-                (
+                RunArgs(
                     run_id,
                     iteration,
                     params,
                     max_steps,
                     data_collection_schedule,
                     collect_agent_data,
+                    engine,
+                    run_seed(seed, run_id),
+                    memory_limit,
+                    profile,
+                    sparse_update,
                 )
             )
             run_id += 1
+    return runs_list
 
-    # if maximum runs is specified, truncate the list of run arguments
-    if max_runs:
-        runs_list = runs_list[:max_runs]
+
+def batch_run(
+    params: dict,
+    iterations: int,
+    number_processes: int,
+    max_steps: int,
+    progressbar: bool,
+    file_prefix: str,
+    max_runs: int,
+    param_choice: str,
+    data_collection_schedule: DataCollectionSchedule,
+    collect_agent_data: bool,
+    engine: str = "mesa",
+    output_format: str = "csv",
+    resume: bool = False,
+    seed: int | None = None,
+    chunk_size: int | None = None,
+    show_overhead: bool = False,
+    dedupe: bool = False,
+    adaptive: AdaptiveIterations | None = None,
+    calibrate: list[Path] | None = None,
+    memory_limit: int | None = None,
+    profile: bool = False,
+    sparse_update: bool = False,
+    run_timeout: float | None = None,
+):
+    run_params = params.get(param_choice)
+    param_combinations = get_param_combinations(
+        run_params, iterations, data_collection_schedule, engine, dedupe
+    )
+    total_param_combinations = len(param_combinations)
 
     # collect data in a subdirectory based on parameter
     # (no model subdir since we're only focusing on hawk/dove multiple risk model)
     data_dir = Path("data") / param_choice
     data_dir.mkdir(parents=True, exist_ok=True)
     datestr = datetime.today().isoformat().replace(".", "_").replace(":", "")
-    model_output_filename = os.path.join(data_dir, f"{file_prefix}{datestr}_model.csv")
-    message = f"Saving data collection results to:\n  {model_output_filename}"
-
-    # optionally collect agent data
-    agent_output_filename = None
-    agent_output_file = None
-    if collect_agent_data:
-        agent_output_filename = os.path.join(
-            data_dir, f"{file_prefix}{datestr}_agent.csv"
+
+    manifest = None
+    if resume:
+        # find the last batch run to resume
+        manifest = RunManifest.find_latest(data_dir, file_prefix)
+        if manifest is None:
+            raise ValueError(f"No batch run to resume in {data_dir}")
+        # use the same seed as the batch run being resumed, if not specified
+        if seed is None:
+            seed = manifest.config.get("seed")
+    if seed is None:
+        # choose a seed for the batch run; it is recorded in the manifest,
+        # and each run's seed is included in the model data
+        seed = secrets.randbits(32)
+    print(f"Batch run seed: {seed}")
+
+    runs_list = make_runs(
+        param_combinations,
+        iterations,
+        seed,
+        max_steps,
+        data_collection_schedule,
+        collect_agent_data,
+        engine,
+        # memory limit is specified in MB
+        memory_limit * 1024**2 if memory_limit else None,
+        profile,
+        sparse_update,
+    )
+    # if maximum runs is specified, truncate the list of run arguments
+    if max_runs:
+        runs_list = runs_list[:max_runs]
+
+    config = {
+        "param_choice": param_choice,
+        "params": run_params,
+        "iterations": iterations,
+        "max_steps": max_steps,
+        "data_collection_schedule": data_collection_schedule.name,
+        "collect_agent_data": collect_agent_data,
+        "engine": engine,
+        "output_format": output_format,
+        "seed": seed,
+        "dedupe": dedupe,
+        "adaptive": {
+            "min_iterations": adaptive.min_iterations,
+            "ci_width": adaptive.ci_width,
+        }
+        if adaptive
+        else None,
+    }
+    if manifest is not None:
+        # skip any runs already completed
+        manifest.check_config(config)
+        completed = manifest.completed_runs()
+        dropped = manifest.drop_incomplete_results()
+        if dropped:
+            print(f"Removed {dropped} rows for runs not recorded as completed")
+        runs_list = [
+            run
+            for run in runs_list
+            if run_key(run.params, run.iteration) not in completed
+        ]
+        print(
+            f"Resuming batch run {manifest.path}: {len(completed)} runs completed, "
+            + f"{len(runs_list)} remaining"
+        )
+        if not runs_list:
+            return
+    else:
+        manifest = RunManifest(
+            data_dir / f"{file_prefix}{datestr}_manifest.json", config
         )
-        message += f"\n  {agent_output_filename}"
-    print(message)
-
-    # open output files so data can be written as it is generated
-    with open(model_output_filename, "w", newline="") as model_output_file:
-        if agent_output_filename:
-            agent_output_file = open(agent_output_filename, "w", newline="")
-
-        model_dict_writer = None
-        agent_dict_writer = None
-
-        # adapted from mesa batch run code
-        # use maxtasksperchild to recycle worker processes
-        # to release accumulated memory and reduce risk of out of memory problems
-        interrupted = False
-        with tqdm(total=total_runs, disable=not progressbar) as pbar:
-            with multiprocessing.Pool(number_processes, maxtasksperchild=10) as pool:
-                # iterate over results in a loop so we can specify a timeout
-                # and handle keyboard interrupts cleanly.
-                results_iter = pool.imap_unordered(run_hawkdovemulti_model, runs_list)
+
+    # resumed batch runs write results to new output files
+    result_writer = output_formats[output_format](
+        data_dir, f"{file_prefix}{datestr}", collect_agent_data, param_combinations
+    )
+    run_stats = RunStatsWriter(
+        data_dir,
+        f"{file_prefix}{datestr}",
+        param_combinations,
+        engines[engine].profile_sections if profile else None,
+    )
+    manifest.add_outputs(result_writer.paths)
+    print(
+        "Saving data collection results to:\n  "
+        + "\n  ".join(str(path) for path in result_writer.paths)
+    )
+    print(f"Saving run statistics to {run_stats.path}")
+    runs_by_id = {run.run_id: run for run in runs_list}
+
+    # estimate relative cost of each run, to schedule longest runs first
+    cost_model = RunCostModel(max_steps, engines[engine])
+    if calibrate:
+        total_calibration_runs = cost_model.calibrate(calibrate)
+        print(f"Calibrated run cost estimates from {total_calibration_runs} runs")
+    costs = {run.run_id: cost_model.cost(run.params) for run in runs_list}
+
+    if adaptive:
+        # run iterations in waves, for each parameter combination
+        # (run ids are numbered sequentially by combination and iteration)
+        pending = defaultdict(list)
+        for run in runs_list:
+            pending[run.run_id // iterations].append(run)
+        # include outcomes for runs completed before resuming
+        if resume:
+            # parameters in the run key identify the combination
+            combination_index = {
+                run_key(params, 0)[0]: i for i, params in enumerate(param_combinations)
+            }
+            for run in manifest.read_completed():
+                key = run_key(run["params"], run["iteration"])[0]
+                if "outcome" in run and key in combination_index:
+                    adaptive.add(combination_index[key], tuple(run["outcome"]))
+    outcomes = {}
+    overhead = TaskOverhead(min(number_processes, len(runs_list)))
+
+    def write_results(results: list[RunResult]):
+        # write results as they are generated, and record
+        # runs as completed once results are saved
+        for result in results:
+            if result.interrupted:
+                # partial results from interrupted runs are not saved or
+                # recorded as completed, so they are run again when resuming
+                continue
+            run = runs_by_id[result.run_id]
+            run_stats.write(result, run)
+            overhead.add(result)
+            if result.failed:
+                # failed runs are not recorded as completed, so they are
+                # run again when resuming (e.g., with a higher memory limit)
+                tqdm.write(
+                    f"Run {run.run_id} stopped after {result.total_steps} steps; "
+                    + f"over memory limit ({result.peak_memory / 1024**2:.0f} MB). "
+                    + f"Parameters: {run.params}"
+                )
+                continue
+            saved_run_ids = result_writer.write(
+                result.model_rows(run), result.agent_data(run)
+            )
+            if adaptive:
+                outcome = run_outcome(result)
+                adaptive.add(run.run_id // iterations, outcome)
+                outcomes[run.run_id] = outcome
+            manifest.log_completed(
+                [runs_by_id[run_id] for run_id in saved_run_ids], outcomes
+            )
+
+    # wait long enough for a run that reaches max steps, so a crashed
+    # worker doesn't stop the batch run from finishing
+    if run_timeout is None:
+        run_timeout = step_timeout * (max_steps + 1)
+
+    # send runs to worker processes in chunks, to reduce per-task overhead
+    total_tasks = 0
+    max_task_size = 0
+
+    # adapted from mesa batch run code
+    # use maxtasksperchild to recycle worker processes
+    # to release accumulated memory and reduce risk of out of memory problems
+    interrupted = False
+    with result_writer, run_stats:
+        try:
+            with (
+                tqdm(total=len(runs_list), disable=not progressbar) as pbar,
+                multiprocessing.Pool(number_processes, maxtasksperchild=10) as pool,
+            ):
                 try:
-                    while True:
-                        try:
-                            model_data, agent_data = results_iter.next(timeout=3600)
-                        except multiprocessing.TimeoutError:
-                            print(
-                                "\nTimeout error waiting for a simulation run to "
-                                "complete; possible crash or OOM. Quitting."
-                            )
+                    wave = adaptive.next_wave(pending) if adaptive else runs_list
+                    while wave:
+                        chunks = make_chunks(
+                            wave,
+                            costs,
+                            number_processes,
+                            # agent data results are large; send runs one at a time
+                            1 if collect_agent_data else chunk_size,
+                        )
+                        total_tasks += len(chunks)
+                        max_task_size = max(max_task_size, *map(len, chunks))
+                        if not run_chunks(
+                            pool, chunks, write_results, pbar, run_timeout
+                        ):
                             break
-                        except StopIteration:
+                        if not adaptive:
                             break
-
-                        # initialize dictwriter and start csv after the first batch
-                        if model_dict_writer is None:
-                            # get field names from first entry (assumes rows are consistent;
-                            # must be enforced in model data collection)
-                            model_dict_writer = csv.DictWriter(
-                                model_output_file, model_data[0].keys()
-                            )
-                            model_dict_writer.writeheader()
-
-                        model_dict_writer.writerows(model_data)
-                        # flush after every batch so partial results survive
-                        # an abrupt exit
-                        model_output_file.flush()
-
-                        if agent_output_file:
-                            if agent_dict_writer is None:
-                                # get field names from first entry
-                                agent_dict_writer = csv.DictWriter(
-                                    agent_output_file, agent_data[0].keys()
-                                )
-                                agent_dict_writer.writeheader()
-
-                            agent_dict_writer.writerows(agent_data)
-                            agent_output_file.flush()
-
-                        pbar.update()
+                        wave = adaptive.next_wave(pending)
+                        # update progress bar with maximum remaining runs
+                        pbar.total = (
+                            pbar.n + len(wave) + adaptive.max_remaining(pending)
+                        )
+                        pbar.refresh()
                 except KeyboardInterrupt:
                     # on ctrl-c, terminate workers so we don't wait for
                     # in-flight tasks; partial results already written to
-                    # disk (thanks to the flushes above) are preserved.
+                    # disk are preserved.
                     interrupted = True
                     print(
                         "\nKeyboard interrupt received; terminating worker pool "
@@ -287,12 +1753,28 @@ def batch_run(
                     )
                     pool.terminate()
                     pool.join()
+        finally:
+            # save any remaining results, and record them as completed
+            saved_run_ids = result_writer.close()
+            manifest.log_completed(
+                [runs_by_id[run_id] for run_id in saved_run_ids], outcomes
+            )
 
-        if agent_output_file:
-            agent_output_file.close()
-
-        if interrupted:
-            print("Batch run interrupted; partial results saved.")
+    if interrupted:
+        print("Batch run interrupted; partial results saved.")
+    print(run_stats.summary())
+    if run_stats.failed:
+        print(
+            f"{run_stats.failed} runs failed by going over the memory limit; "
+            + f"see {run_stats.path}"
+        )
+    if adaptive:
+        print(
+            f"Completed {overhead.runs} of {len(runs_list)} runs; "
+            + adaptive.summary(total_param_combinations)
+        )
+    if show_overhead:
+        print(f"{total_tasks} tasks of up to {max_task_size} runs; {overhead}")
 
 
 # map cli data collection options to data collection schedule enum
@@ -303,13 +1785,9 @@ data_collection_opts = {
 }
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog="hawk/dove batch_run",
-        description="Batch run for hawk/dove multiple risk attitude simulation.",
-        epilog="""Data files will be created in data/<params>/
-        relative to current path, where <params> matches the --params option.""",
-    )
+def add_run_arguments(parser: argparse.ArgumentParser):
+    """add command-line arguments for options that determine which
+    simulation runs to run, and how to collect data"""
     parser.add_argument(
         "-i",
         "--iterations",
@@ -326,6 +1804,86 @@ def main():
         default=1000,  # new convergence logic seems to converge around 400
         type=int,
     )
+    parser.add_argument(
+        "--max-runs",
+        help="Stop after the specified number of runs "
+        + "(for development/troubleshooting)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--params",
+        help="Run a specific set of parameters",
+        choices=params.keys(),
+        default="default",
+    )
+    parser.add_argument(
+        "--collect-data",
+        help="When and how often to collect model and agent data",
+        choices=data_collection_opts.keys(),
+        default="end",
+    )
+    parser.add_argument(
+        "--agent-data",
+        help="Store agent data",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--engine",
+        help="Model implementation to run: agent-based mesa model, "
+        + "array-backed numpy model, or numpy model with iterations of the "
+        + "same parameters run together in batches, which is faster for "
+        + "small grids (default: %(default)s)",
+        choices=engines.keys(),
+        default="mesa",
+    )
+    parser.add_argument(
+        "--format",
+        help="Output file format for model and agent data; parquet "
+        + "requires pyarrow (default: %(default)s)",
+        choices=output_formats.keys(),
+        default="csv",
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for the batch run; each run is seeded based on this "
+        + "seed and its run id (default: random, or the seed of the "
+        + "batch run being resumed)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--dedupe",
+        help="Skip invalid parameter combinations and combinations that "
+        + "are equivalent to another combination",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--calibrate",
+        help="Model data from previous batch runs (CSV files or parquet "
+        + "datasets), used to estimate how long runs will take, so the "
+        + "longest runs can be started first",
+        type=Path,
+        nargs="+",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        help="Maximum memory per simulation run, in MB, measured as worker "
+        + "process memory used since the run started; runs that go over the "
+        + "limit are stopped and recorded as failed (no limit by default)",
+        type=int,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="hawk/dove batch_run",
+        description="Batch run for hawk/dove multiple risk attitude simulation.",
+        epilog="""Data files will be created in data/<params>/
+        relative to current path, where <params> matches the --params option.""",
+    )
+    add_run_arguments(parser)
     parser.add_argument(
         "-p",
         "--processes",
@@ -345,31 +1903,92 @@ def main():
         default="",
     )
     parser.add_argument(
-        "--max-runs",
-        help="Stop after the specified number of runs "
-        + "(for development/troubleshooting)",
+        "--resume",
+        help="Resume the most recent batch run for this set of parameters "
+        + "and file prefix, skipping runs that have already completed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        help="Number of runs to send to a worker process at once "
+        + "(default: based on number of runs and processes)",
         type=int,
         default=None,
     )
     parser.add_argument(
-        "--params",
-        help="Run a specific set of parameters",
-        choices=params.keys(),
-        default="default",
+        "--show-overhead",
+        help="Report measured per-run overhead of running simulations "
+        + "in worker processes, to help choose a chunk size",
+        action="store_true",
     )
     parser.add_argument(
-        "--collect-data",
-        help="When and how often to collect model and agent data",
-        choices=data_collection_opts.keys(),
-        default="end",
+        "--adaptive",
+        help="Run iterations in waves, and stop running iterations for a "
+        + "parameter combination once outcomes are precise enough; "
+        + "--iterations is the maximum number of iterations",
+        action="store_true",
     )
     parser.add_argument(
-        "--agent-data",
-        help="Store agent data",
-        action=argparse.BooleanOptionalAction,
-        default=False,
+        "--min-iterations",
+        help="Number of iterations per wave, and minimum number of "
+        + "iterations for each combination, in adaptive mode "
+        + "(default: %(default)s)",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--ci-width",
+        help="Stop running iterations for a combination when the 95%% "
+        + "confidence intervals for outcomes (risk category frequencies "
+        + "and mean percent hawk) have a half-width below this value, "
+        + "in adaptive mode (default: %(default)s)",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--run-timeout",
+        help="Seconds to wait for each simulation run before stopping the "
+        + "batch run, in case a worker crashes (e.g., runs out of memory "
+        + f"during a step); default: {step_timeout:g}s per step, based on "
+        + "--max-steps. Chunks of runs are allowed this time per run, up to "
+        + f"{max_chunk_timeout:g}s or a single run's timeout if longer",
+        type=float,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Time each section of model steps (choose, play, risk "
+        + "adjustment, convergence check, data collection) and include "
+        + "times in the run statistics",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sparse-update",
+        help="Only update choices and payoffs for agents whose neighbors "
+        + "changed their play each round; same results, faster when few "
+        + "agents change (mesa engine only)",
+        action="store_true",
     )
     args = parser.parse_args()
+    if args.chunk_size is not None and args.chunk_size < 1:
+        parser.error("chunk size must be at least 1")
+    if args.memory_limit is not None and args.memory_limit < 1:
+        parser.error("memory limit must be at least 1 MB")
+    if args.run_timeout is not None and args.run_timeout <= 0:
+        parser.error("run timeout must be positive")
+    if args.profile and args.engine in replicate_engines:
+        parser.error(f"profiling is not supported with the {args.engine} engine")
+    if args.sparse_update and args.engine != "mesa":
+        parser.error("sparse updates are only supported with the mesa engine")
+    if args.adaptive and not 2 <= args.min_iterations <= args.iterations:
+        parser.error("min iterations must be between 2 and number of iterations")
+    if args.format == "parquet" and pa is None:
+        parser.error("parquet output requires pyarrow")
+    if pq is None and any(path.suffix != ".csv" for path in args.calibrate or []):
+        parser.error("calibrating from parquet data requires pyarrow")
+    if args.resume and not RunManifest.find_latest(
+        Path("data") / args.params, args.file_prefix
+    ):
+        parser.error(f"no batch run to resume for {args.params} parameters")
 
     # convert command-line string arg to data collection value
     collect_data = data_collection_opts[args.collect_data]
@@ -385,6 +2004,21 @@ def main():
         args.params,
         collect_data,
         args.agent_data,
+        args.engine,
+        args.format,
+        args.resume,
+        args.seed,
+        args.chunk_size,
+        args.show_overhead,
+        args.dedupe,
+        AdaptiveIterations(args.min_iterations, args.ci_width)
+        if args.adaptive
+        else None,
+        args.calibrate,
+        args.memory_limit,
+        args.profile,
+        args.sparse_update,
+        args.run_timeout,
     )
 
 
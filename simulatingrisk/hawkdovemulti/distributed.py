@@ -0,0 +1,621 @@
+#!/usr/bin/env python
+"""
+Distributed batch runs for the hawk/dove multiple risk attitude simulation,
+for parameter sweeps that are too large for a single machine.
+
+A coordinator submits all runs for a batch run to a queue directory; any
+number of worker processes, on any host that can access the queue
+directory (e.g., on a shared filesystem), claim runs from the queue and
+write results to their own output shards. When all runs are completed,
+a merge step combines the shards into model and agent data files, in the
+same format as :mod:`~simulatingrisk.hawkdovemulti.batch_run` output.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is optional; only required for parquet output
+    pq = None
+
+from simulatingrisk.hawkdovemulti.batch_run import (
+    RunArgs,
+    RunCostModel,
+    RunStatsWriter,
+    add_run_arguments,
+    data_collection_opts,
+    engines,
+    get_param_combinations,
+    make_runs,
+    output_formats,
+    params,
+    simulate,
+)
+from simulatingrisk.hawkdovemulti.model import DataCollectionSchedule
+
+
+class RunQueue:
+    """
+    Queue of simulation runs stored as files in a directory, which can be
+    on a shared filesystem. Each run is a JSON file that moves from
+    ``pending/`` to ``claimed/`` when a worker claims it, and then to
+    ``done/`` once its results have been saved, or to ``failed/`` if it
+    went over the memory limit. Workers claim runs by renaming files,
+    which is atomic, so each run is claimed by only one worker without
+    any locking. Pending runs are named in priority order, so workers
+    claim the most expensive runs first. Each worker writes results to
+    its own shard in ``shards/``; use :meth:`merge` to combine them.
+
+    Running workers update a heartbeat file in ``workers/``, so that
+    runs claimed by workers that exited without completing them can be
+    identified and returned to the queue (see :meth:`requeue`).
+    """
+
+    #: seconds between worker heartbeats
+    heartbeat_interval = 60
+    #: seconds without a heartbeat after which a worker is considered to
+    #: have exited, and its claimed runs can be returned to the queue
+    stale_after = 600
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.config_path = self.path / "config.json"
+        self.pending_dir = self.path / "pending"
+        self.claimed_dir = self.path / "claimed"
+        self.done_dir = self.path / "done"
+        self.failed_dir = self.path / "failed"
+        self.worker_dir = self.path / "workers"
+        self.shard_dir = self.path / "shards"
+
+    @classmethod
+    def create(cls, path: Path, runs: list[RunArgs], config: dict) -> "RunQueue":
+        """Create a new queue with the specified runs, ordered by priority.
+        Options shared by all runs (max steps, data collection, engine,
+        memory limit) are stored in the queue configuration."""
+        queue = cls(path)
+        if queue.config_path.exists():
+            raise ValueError(f"Run queue already exists in {path}")
+        for directory in [
+            queue.pending_dir,
+            queue.claimed_dir,
+            queue.done_dir,
+            queue.failed_dir,
+            queue.worker_dir,
+            queue.shard_dir,
+        ]:
+            directory.mkdir(parents=True, exist_ok=True)
+        for rank, run in enumerate(runs):
+            run_path = queue.pending_dir / f"{rank:08d}_{run.run_id}.json"
+            with open(run_path, "w") as run_file:
+                json.dump(
+                    {
+                        "run_id": run.run_id,
+                        "iteration": run.iteration,
+                        "params": run.params,
+                        "seed": run.seed,
+                    },
+                    run_file,
+                )
+        # write config last, so a queue is not used until all runs are added
+        with open(queue.config_path, "w") as config_file:
+            json.dump(config, config_file, indent=2)
+        return queue
+
+    @property
+    def config(self) -> dict:
+        with open(self.config_path) as config_file:
+            return json.load(config_file)
+
+    def load_run(self, path: Path) -> RunArgs:
+        config = self.config
+        with open(path) as run_file:
+            run = json.load(run_file)
+        # memory limit is specified in MB; not set for older queues
+        memory_limit = config.get("memory_limit")
+        return RunArgs(
+            run["run_id"],
+            run["iteration"],
+            run["params"],
+            config["max_steps"],
+            DataCollectionSchedule[config["data_collection_schedule"]],
+            config["collect_agent_data"],
+            config["engine"],
+            run["seed"],
+            memory_limit * 1024**2 if memory_limit else None,
+        )
+
+    @staticmethod
+    def run_name(path: Path) -> str:
+        # queue filename without worker id: rank and run id
+        return path.stem.split("__")[0]
+
+    @staticmethod
+    def worker_name(path: Path) -> str:
+        return path.stem.split("__")[1]
+
+    def claim(self, worker_id: str, limit: int = 1) -> list[Path]:
+        """claim up to the specified number of pending runs for a worker;
+        returns a list of paths for claimed runs"""
+        claimed = []
+        for path in sorted(self.pending_dir.glob("*.json")):
+            claimed_path = self.claimed_dir / f"{path.stem}__{worker_id}.json"
+            try:
+                path.rename(claimed_path)
+            except FileNotFoundError:
+                # claimed by another worker
+                continue
+            # renaming keeps the submission time; record the claim time
+            os.utime(claimed_path)
+            claimed.append(claimed_path)
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def complete(self, paths: list[Path]):
+        """mark claimed runs as done, once results have been saved"""
+        for path in paths:
+            try:
+                path.rename(self.done_dir / path.name)
+            except FileNotFoundError:
+                # returned to the queue while the run was in progress;
+                # results are saved, so take it back unless another
+                # worker has already claimed it
+                pending_path = self.pending_dir / f"{self.run_name(path)}.json"
+                try:
+                    pending_path.rename(self.done_dir / path.name)
+                except FileNotFoundError:
+                    continue
+
+    def fail(self, paths: list[Path]):
+        """mark claimed runs as failed (e.g., over the memory limit)"""
+        self.failed_dir.mkdir(exist_ok=True)
+        for path in paths:
+            try:
+                path.rename(self.failed_dir / path.name)
+            except FileNotFoundError:
+                # returned to the queue while the run was in progress
+                continue
+
+    def release(self, paths: list[Path]):
+        """return claimed runs to the queue"""
+        for path in paths:
+            try:
+                path.rename(self.pending_dir / f"{self.run_name(path)}.json")
+            except FileNotFoundError:
+                # already returned to the queue
+                continue
+
+    def heartbeat(self, worker_id: str):
+        """record that a worker is still running"""
+        self.worker_dir.mkdir(exist_ok=True)
+        (self.worker_dir / worker_id).touch()
+
+    def last_active(self, path: Path) -> float:
+        """time of the most recent heartbeat for the worker that claimed
+        a run, or the claim time if more recent"""
+        last_active = path.stat().st_mtime
+        heartbeat_path = self.worker_dir / self.worker_name(path)
+        if heartbeat_path.exists():
+            last_active = max(last_active, heartbeat_path.stat().st_mtime)
+        return last_active
+
+    def requeue(self, worker_id: str | None = None) -> int:
+        """Return claimed runs to the queue, for workers that exited without
+        completing them: either all runs claimed by the specified worker,
+        or runs claimed by any worker with no heartbeat for
+        :attr:`stale_after` seconds. Returns the number of runs returned
+        to the queue."""
+        if worker_id is not None:
+            claimed = [
+                path
+                for path in self.claimed_dir.glob("*.json")
+                if self.worker_name(path) == worker_id
+            ]
+        else:
+            stale_time = time.time() - self.stale_after
+            claimed = []
+            for path in self.claimed_dir.glob("*.json"):
+                try:
+                    if self.last_active(path) < stale_time:
+                        claimed.append(path)
+                except FileNotFoundError:
+                    # completed while checking
+                    continue
+        self.release(claimed)
+        return len(claimed)
+
+    def retry_failed(self) -> int:
+        """Return failed runs to the queue, to run them again (e.g., after
+        raising the memory limit in the queue configuration). Returns the
+        number of runs returned to the queue."""
+        failed = list(self.failed_dir.glob("*.json"))
+        self.release(failed)
+        return len(failed)
+
+    def status(self) -> dict[str, int]:
+        """number of pending, claimed, done, and failed runs"""
+        return {
+            "pending": len(list(self.pending_dir.glob("*.json"))),
+            "claimed": len(list(self.claimed_dir.glob("*.json"))),
+            "done": len(list(self.done_dir.glob("*.json"))),
+            "failed": len(list(self.failed_dir.glob("*.json"))),
+        }
+
+    def completed_by(self) -> dict[int, str]:
+        """worker id for each completed run, by run id"""
+        completed = {}
+        for path in self.done_dir.glob("*.json"):
+            run_id = int(self.run_name(path).split("_")[1])
+            completed[run_id] = self.worker_name(path)
+        return completed
+
+    def shards(self, data_type: str) -> dict[str, Path]:
+        """output shards for model or agent data, by worker id"""
+        # shards are named by worker id, like batch run output files
+        suffix = f"_{data_type}"
+        if self.config["output_format"] == "csv":
+            suffix += ".csv"
+        return {
+            path.name.removesuffix(suffix): path
+            for path in self.shard_dir.glob(f"*{suffix}")
+        }
+
+    def merge(self, data_dir: Path, base_name: str) -> list[Path]:
+        """Combine output shards into a single output for model data and
+        for agent data, in the configured output format. Only results for
+        completed runs are included, from the worker that completed each
+        run, so results for runs that were interrupted and then run again
+        by another worker are not duplicated. Returns a list of output
+        paths."""
+        config = self.config
+        completed_by = self.completed_by()
+        data_types = ["model"]
+        if config["collect_agent_data"]:
+            data_types.append("agent")
+
+        data_dir.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for data_type in data_types:
+            shards = self.shards(data_type)
+            if config["output_format"] == "csv":
+                path = data_dir / f"{base_name}_{data_type}.csv"
+                merge_csv_shards(path, shards, completed_by)
+            else:
+                path = data_dir / f"{base_name}_{data_type}"
+                merge_parquet_shards(path, shards, completed_by)
+            paths.append(path)
+        return paths
+
+
+def merge_csv_shards(path: Path, shards: dict[str, Path], completed_by: dict):
+    fieldnames = None
+    with open(path, "w", newline="") as output_file:
+        writer = csv.writer(output_file)
+        for worker_id, shard_path in sorted(shards.items()):
+            with open(shard_path, newline="") as shard_file:
+                reader = csv.reader(shard_file)
+                header = next(reader, None)
+                if header is None:
+                    continue
+                if fieldnames is None:
+                    fieldnames = header
+                    writer.writerow(fieldnames)
+                run_id_index = header.index("RunId")
+                for row in reader:
+                    # skip incomplete rows if writing was interrupted
+                    if len(row) != len(header):
+                        continue
+                    if completed_by.get(int(row[run_id_index])) == worker_id:
+                        writer.writerow(row)
+
+
+def merge_parquet_shards(path: Path, shards: dict[str, Path], completed_by: dict):
+    path.mkdir(parents=True, exist_ok=True)
+    part = 0
+    for worker_id, shard_path in sorted(shards.items()):
+        worker_run_ids = pa.array(
+            [run_id for run_id, worker in completed_by.items() if worker == worker_id],
+            type=pa.int64(),
+        )
+        for part_path in sorted(shard_path.glob("part-*.parquet")):
+            table = pq.read_table(part_path)
+            table = table.filter(pc.is_in(table["RunId"], worker_run_ids))
+            pq.write_table(table, path / f"part-{part:05d}.parquet", compression="zstd")
+            part += 1
+
+
+def worker_name() -> str:
+    """worker id based on host name and process id, with a random suffix
+    so a restarted worker never overwrites an earlier worker's shard"""
+    name = f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+    return re.sub(r"[^A-Za-z0-9-]", "-", name)
+
+
+class WorkerHeartbeat:
+    """Update a worker's heartbeat in a run queue from a background
+    thread, every :attr:`RunQueue.heartbeat_interval` seconds, while
+    the worker is running simulations."""
+
+    def __init__(self, queue: RunQueue, worker_id: str):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+
+    def __enter__(self):
+        self.queue.heartbeat(self.worker_id)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def beat(self):
+        while not self.stopped.wait(self.queue.heartbeat_interval):
+            self.queue.heartbeat(self.worker_id)
+
+
+def work(queue_path: Path, claim_size: int = 10, worker_id: str | None = None) -> int:
+    """Claim and run simulations from a queue until no runs are left,
+    writing results and run statistics to shards for this worker. Returns
+    the number of runs completed. Runs that fail by going over the memory
+    limit are reported and recorded as failed in the queue. If a run is
+    interrupted, it is returned to the queue without saving partial
+    results, and the interrupt is raised again once saved results are
+    completed."""
+    queue = RunQueue(queue_path)
+    worker_id = worker_id or worker_name()
+    with WorkerHeartbeat(queue, worker_id):
+        return run_claimed(queue, claim_size, worker_id)
+
+
+def run_claimed(queue: RunQueue, claim_size: int, worker_id: str) -> int:
+    """claim and run simulations until no runs are left; see :meth:`work`"""
+    config = queue.config
+    result_writer = output_formats[config["output_format"]](
+        queue.shard_dir,
+        worker_id,
+        config["collect_agent_data"],
+        config["param_combinations"],
+    )
+    run_stats = RunStatsWriter(queue.shard_dir, worker_id, config["param_combinations"])
+    # claimed runs that have been run, but results may not be saved yet
+    run_paths = {}
+    unstarted = []
+    completed = 0
+    with result_writer, run_stats:
+        try:
+            while unstarted := queue.claim(worker_id, claim_size):
+                while unstarted:
+                    path = unstarted.pop(0)
+                    run = queue.load_run(path)
+                    run_paths[run.run_id] = path
+                    result = simulate(run)
+                    if result.interrupted:
+                        queue.release([run_paths.pop(run.run_id)])
+                        raise KeyboardInterrupt
+                    run_stats.write(result, run)
+                    if result.failed:
+                        queue.fail([run_paths.pop(run.run_id)])
+                        print(
+                            f"Run {run.run_id} stopped after {result.total_steps} "
+                            + "steps; over memory limit "
+                            + f"({result.peak_memory / 1024**2:.0f} MB). "
+                            + f"Parameters: {run.params}"
+                        )
+                        continue
+                    saved_run_ids = result_writer.write(
+                        result.model_rows(run), result.agent_data(run)
+                    )
+                    queue.complete([run_paths.pop(run_id) for run_id in saved_run_ids])
+                    completed += len(saved_run_ids)
+        finally:
+            # return any claimed runs that were not started to the queue,
+            # and mark remaining runs done once results are saved
+            queue.release(unstarted)
+            saved_run_ids = result_writer.close()
+            queue.complete([run_paths.pop(run_id) for run_id in saved_run_ids])
+            completed += len(saved_run_ids)
+    return completed
+
+
+def submit(
+    queue_path: Path,
+    param_choice: str,
+    iterations: int,
+    max_steps: int,
+    data_collection_schedule: DataCollectionSchedule,
+    collect_agent_data: bool,
+    engine: str = "mesa",
+    output_format: str = "csv",
+    seed: int | None = None,
+    dedupe: bool = False,
+    max_runs: int | None = None,
+    calibrate: list[Path] | None = None,
+    memory_limit: int | None = None,
+) -> RunQueue:
+    """Create a queue with all runs for a set of parameters, ordered by
+    estimated cost so the most expensive runs are claimed first. Memory
+    limit for worker processes is in MB, as for batch runs."""
+    param_combinations = get_param_combinations(
+        params[param_choice], iterations, data_collection_schedule, engine, dedupe
+    )
+    if seed is None:
+        seed = secrets.randbits(32)
+    print(f"Batch run seed: {seed}")
+    runs = make_runs(
+        param_combinations,
+        iterations,
+        seed,
+        max_steps,
+        data_collection_schedule,
+        collect_agent_data,
+        engine,
+    )
+    if max_runs:
+        runs = runs[:max_runs]
+
+    cost_model = RunCostModel(max_steps, engines[engine])
+    if calibrate:
+        cost_model.calibrate(calibrate)
+    runs.sort(key=lambda run: cost_model.cost(run.params), reverse=True)
+
+    config = {
+        "param_choice": param_choice,
+        "params": params[param_choice],
+        "param_combinations": param_combinations,
+        "iterations": iterations,
+        "max_steps": max_steps,
+        "data_collection_schedule": data_collection_schedule.name,
+        "collect_agent_data": collect_agent_data,
+        "engine": engine,
+        "output_format": output_format,
+        "seed": seed,
+        "dedupe": dedupe,
+        "memory_limit": memory_limit,
+    }
+    return RunQueue.create(queue_path, runs, config)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="hawk/dove distributed batch run",
+        description="Distributed batch run for hawk/dove multiple risk "
+        + "attitude simulation, using a queue directory that can be on "
+        + "a shared filesystem.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser(
+        "submit", help="Create a queue with all runs for a set of parameters"
+    )
+    submit_parser.add_argument("queue", type=Path, help="Queue directory")
+    add_run_arguments(submit_parser)
+
+    work_parser = subparsers.add_parser(
+        "work", help="Run simulations from a queue until no runs are left"
+    )
+    work_parser.add_argument("queue", type=Path, help="Queue directory")
+    work_parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        help="Number of worker processes (default: all available CPUs, %(default)d)",
+        default=os.cpu_count(),
+    )
+    work_parser.add_argument(
+        "--claim-size",
+        type=int,
+        help="Number of runs to claim at once (default: %(default)d)",
+        default=10,
+    )
+
+    status_parser = subparsers.add_parser(
+        "status", help="Report number of pending, claimed, and completed runs"
+    )
+    status_parser.add_argument("queue", type=Path, help="Queue directory")
+
+    requeue_parser = subparsers.add_parser(
+        "requeue",
+        help="Return claimed runs to the queue, for workers that exited "
+        + "without completing them (no heartbeat for "
+        + f"{RunQueue.stale_after} seconds)",
+    )
+    requeue_parser.add_argument("queue", type=Path, help="Queue directory")
+    requeue_parser.add_argument(
+        "--worker",
+        help="Return all runs claimed by the specified worker, "
+        + "which must no longer be running",
+    )
+    requeue_parser.add_argument(
+        "--failed",
+        action="store_true",
+        help="Return failed runs to the queue instead of claimed runs",
+    )
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Combine worker output shards into model and agent data"
+    )
+    merge_parser.add_argument("queue", type=Path, help="Queue directory")
+    merge_parser.add_argument(
+        "--file-prefix",
+        help="Prefix for data filenames (no prefix by default)",
+        default="",
+    )
+
+    args = parser.parse_args()
+    if args.command != "submit" and not RunQueue(args.queue).config_path.exists():
+        parser.error(f"no run queue in {args.queue}")
+
+    if args.command == "submit":
+        if args.format == "parquet" and pq is None:
+            parser.error("parquet output requires pyarrow")
+        if args.memory_limit is not None and args.memory_limit < 1:
+            parser.error("memory limit must be at least 1 MB")
+        submit(
+            args.queue,
+            args.params,
+            args.iterations,
+            args.max_steps,
+            data_collection_opts[args.collect_data],
+            args.agent_data,
+            args.engine,
+            args.format,
+            args.seed,
+            args.dedupe,
+            args.max_runs,
+            args.calibrate,
+            args.memory_limit,
+        )
+        print(f"Submitted {RunQueue(args.queue).status()['pending']} runs")
+    elif args.command == "work":
+        with multiprocessing.Pool(args.processes) as pool:
+            completed = pool.starmap(
+                work, [(args.queue, args.claim_size)] * args.processes
+            )
+        print(f"Completed {sum(completed)} runs")
+    elif args.command == "status":
+        status = RunQueue(args.queue).status()
+        print(", ".join(f"{count} {state}" for state, count in status.items()))
+    elif args.command == "requeue":
+        queue = RunQueue(args.queue)
+        if args.failed:
+            total = queue.retry_failed()
+            print(f"Returned {total} failed runs to the queue")
+        else:
+            total = queue.requeue(args.worker)
+            print(f"Returned {total} claimed runs to the queue")
+    elif args.command == "merge":
+        queue = RunQueue(args.queue)
+        status = queue.status()
+        incomplete = status["pending"] + status["claimed"] + status["failed"]
+        if incomplete:
+            print(f"Warning: {incomplete} runs have not been completed")
+        datestr = (
+            datetime.now().astimezone().isoformat().replace(".", "_").replace(":", "")
+        )
+        data_dir = Path("data") / queue.config["param_choice"]
+        paths = queue.merge(data_dir, f"{args.file_prefix}{datestr}")
+        print(
+            f"Merged results for {status['done']} runs to:\n  "
+            + "\n  ".join(str(path) for path in paths)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
-import random
 import statistics
 from collections import Counter, defaultdict, deque
+from collections.abc import Callable
 from enum import Enum, IntEnum
 from functools import cached_property
+from typing import NamedTuple
 
-from simulatingrisk.hawkdove.model import HawkDoveAgent, HawkDoveModel
+import numpy as np
+
+from simulatingrisk.hawkdove.model import (
+    HawkDoveAgent,
+    HawkDoveModel,
+    check_neighborhood_size,
+)
 
 
 class HawkDoveMultipleRiskAgent(HawkDoveAgent):
@@ -24,6 +31,20 @@ class HawkDoveMultipleRiskAgent(HawkDoveAgent):
         # get risk attitude from model based on configured distribution
         self.risk_level = self.model.get_risk_attitude()
 
+    @property
+    def risk_level(self):
+        return self._risk_level
+
+    @risk_level.setter
+    def risk_level(self, value):
+        # keep model counts of agents at each risk level up to date
+        # when risk level changes; initial risk levels are counted by
+        # the model once all agents are created
+        prev_risk_level = getattr(self, "_risk_level", None)
+        self._risk_level = value
+        if prev_risk_level is not None and value != prev_risk_level:
+            self.model.update_risk_level_count(prev_risk_level, value)
+
     def play(self):
         # save total points before playing so we only need to calculate
         # current round payoff once
@@ -35,7 +56,9 @@ class HawkDoveMultipleRiskAgent(HawkDoveAgent):
         self.recent_points += self.points - prev_points
 
         if self.model.adjustment_round:
+            self.model.profile.start("adjust_risk")
             self.adjust_risk()
+            self.model.profile.stop()
             # reset to zero to track points until next adjustment round
             self.recent_points = 0
 
@@ -66,19 +89,18 @@ class HawkDoveMultipleRiskAgent(HawkDoveAgent):
         # organize neighbors by score; use dict of list,
         # since it's possible to have ties
         neighbors_by_score = defaultdict(list)
-        best_payoff = 0
         for neighbor in self.adjust_neighbors:
             points = getattr(neighbor, self.compare_payoff_field)
-            best_payoff = max(best_payoff, points)
             neighbors_by_score[points].append(neighbor)
 
         # get the list of all neighbors with the best payoff
-        most_successful = neighbors_by_score[best_payoff]
+        # (payoffs may be negative, depending on the payoff matrix)
+        most_successful = neighbors_by_score[max(neighbors_by_score)]
         # if there is only one, return it
         if len(most_successful) == 1:
             return most_successful[0]
         # if one or more tied, choose randomly
-        return random.choice(most_successful)
+        return self.random.choice(most_successful)
 
     def adjust_risk(self):
         # look at neighbors
@@ -105,6 +127,7 @@ class HawkDoveMultipleRiskAgent(HawkDoveAgent):
                 )
 
             # track that risk attitude has been updated
+            # (model counts are updated when risk level is set)
             self.risk_level_changed = True
         else:
             # track that risk attitude was not changed
@@ -158,6 +181,85 @@ class RiskState(IntEnum):
 DataCollectionSchedule = Enum("DataCollectionSchedule", ["ALL", "END", "ADJUST"])
 
 
+class RiskDistribution(NamedTuple):
+    """A named distribution for initial risk attitudes. The sample
+    function takes a numpy random generator, number of values, and
+    minimum and maximum risk level, and returns an array of values,
+    which are rounded to risk levels. Values outside the risk level
+    range are redrawn, unless `clamp` is set, in which case they are
+    clamped to the range."""
+
+    sample: Callable[[np.random.Generator, int, int, int], np.ndarray]
+    clamp: bool = False
+
+
+#: initial risk attitude distributions, by name;
+#: add new distributions with :func:`register_risk_distribution`
+risk_distributions: dict[str, RiskDistribution] = {}
+
+
+def register_risk_distribution(name: str, clamp: bool = False):
+    """decorator to register a function as a named risk attitude
+    distribution; see :class:`RiskDistribution`"""
+
+    def register(sample):
+        risk_distributions[name] = RiskDistribution(sample, clamp)
+        return sample
+
+    return register
+
+
+@register_risk_distribution("uniform")
+def uniform_risk(rng, size, min_level, max_level):
+    # uniform/random: generate random integers within risk level range
+    return rng.integers(min_level, max_level, size=size, endpoint=True)
+
+
+@register_risk_distribution("normal")
+def normal_risk(rng, size, min_level, max_level):
+    # values from a normal distribution centered around 4.5
+    return rng.normal(4.5, 1.5, size=size)
+
+
+def triangular(rng, size, low, high, mode):
+    """values from a triangular distribution; same method as
+    :meth:`random.Random.triangular`, which allows a mode outside
+    the low/high range"""
+    u = rng.random(size)
+    c = (mode - low) / (high - low)
+    upper = u > c
+    # above the mode, sample from the other side of the triangle
+    u = np.where(upper, 1 - u, u)
+    c = np.where(upper, 1 - c, c)
+    low, high = np.where(upper, high, low), np.where(upper, low, high)
+    return low + (high - low) * np.sqrt(u * c)
+
+
+@register_risk_distribution("skewed left")
+def skewed_left_risk(rng, size, min_level, max_level):
+    # values from a triangular distribution centered around 0
+    return triangular(rng, size, min_level, max_level, 0)
+
+
+@register_risk_distribution("skewed right")
+def skewed_right_risk(rng, size, min_level, max_level):
+    # values from a triangular distribution centered around 9
+    return triangular(rng, size, min_level, max_level, 9)
+
+
+@register_risk_distribution("bimodal", clamp=True)
+def bimodal_risk(rng, size, min_level, max_level):
+    # to generate a bimodal distribution, alternate values from two
+    # different normal distributions centered around the beginning
+    # and end of our risk attitude range
+    # NOTE: on smaller grids, using 0/9 makes it extremely
+    # unlikely to get mid-range risk values (4/5)
+    values = np.empty(size)
+    values[0::2] = rng.normal(min_level, 1.5, size=len(values[0::2]))
+    values[1::2] = rng.normal(max_level, 1.5, size=len(values[1::2]))
+    return values
+
+
 class HawkDoveMultipleRiskModel(HawkDoveModel):
     """
     Model for hawk/dove game with variable risk attitudes.  Supports
@@ -183,16 +285,15 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
     min_steps_converge = 50
     #: higher minimum when risk adjustment is enabled
     min_steps_adjusting = 300
+    #: sections of each step that are timed when profiling is enabled
+    profile_sections = (*HawkDoveModel.profile_sections, "adjust_risk")
 
     supported_risk_adjustments = (None, "adopt", "average")
     supported_adjust_payoffs = ("recent", "total")
-    risk_distribution_options = (
-        "uniform",
-        "normal",
-        "skewed left",
-        "skewed right",
-        "bimodal",
-    )
+    #: names of built-in risk distributions, for parameter choices;
+    #: the model also supports any distribution added later
+    #: with :func:`register_risk_distribution`
+    risk_distribution_options = tuple(risk_distributions)
 
     collect_agent_data = True
     data_collection_schedule = DataCollectionSchedule.ALL
@@ -217,33 +318,20 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
             risk_adjustment = None
 
         # check parameters
-        if risk_distribution not in self.risk_distribution_options:
-            raise ValueError(
-                f"Unsupported risk distribution '{risk_distribution}'; "
-                + f"must be one of {', '.join(self.risk_distribution_options)}"
-            )
-
-        # make sure risk adjustment is valid
-        if risk_adjustment not in self.supported_risk_adjustments:
-            risk_adjust_opts = ", ".join(
-                [opt or "none" for opt in self.supported_risk_adjustments]
-            )
-            raise ValueError(
-                f"Unsupported risk adjustment '{risk_adjustment}'; "
-                + f"must be one of {risk_adjust_opts}"
-            )
+        self.check_parameters(
+            grid_size,
+            risk_adjustment=risk_adjustment,
+            risk_distribution=risk_distribution,
+            adjust_neighborhood=adjust_neighborhood,
+            adjust_payoff=adjust_payoff,
+            data_collection_schedule=data_collection_schedule,
+            **kwargs,
+        )
 
         # update the minimum rounds for convergence when adjustment is enabled
         if risk_adjustment is not None:
             self.min_steps_converge = self.min_steps_adjusting
 
-        if adjust_payoff not in self.supported_adjust_payoffs:
-            adjust_payoffs_opts = ", ".join(self.supported_adjust_payoffs)
-            raise ValueError(
-                f"Unsupported adjust payoff option '{adjust_payoff}'; "
-                + f"must be one of {adjust_payoffs_opts}"
-            )
-
         # if endpoints are not included, shift min/max risk attitude from 0-9 to 1-8
         if not include_endpoints:
             self.min_risk_level = 1
@@ -252,6 +340,9 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         # initialize a risk attitude generator based on configured distrbution
         # must be set before calling super for agent init
         self.risk_distribution = risk_distribution
+        # numpy random generator for sampling risk attitudes, seeded from
+        # the model random so runs are reproducible when the model is seeded
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
         self.risk_attitude_generator = self.get_risk_attitude_generator()
 
         self.risk_adjustment = risk_adjustment
@@ -262,13 +353,6 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         # configure data collection schedule if specified
         # - configure before datacollector is initialized in super init method
         if data_collection_schedule is not None:
-            if (
-                data_collection_schedule is DataCollectionSchedule.ADJUST
-                and self.risk_adjustment is None
-            ):
-                raise ValueError(
-                    "Can't collect data on adjustment rounds when adjustment is disabled"
-                )
             self.data_collection_schedule = data_collection_schedule
 
         if collect_agent_data is not None:
@@ -285,60 +369,128 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         self.adjust_neighborhood = adjust_neighborhood or self.play_neighborhood
 
         self.recent_total_per_risk_level = deque([], maxlen=2)
+        # number of agents at each risk level, indexed by risk level;
+        # updated as agents adjust, so totals don't require checking all agents
+        self.risk_level_counts = self.count_risk_levels()
+
+    @classmethod
+    def check_parameters(
+        cls,
+        grid_size,
+        risk_adjustment="adopt",
+        risk_distribution="uniform",
+        adjust_neighborhood=None,
+        adjust_payoff="recent",
+        data_collection_schedule: DataCollectionSchedule | None = None,
+        **kwargs,
+    ):
+        if risk_adjustment == "none":
+            risk_adjustment = None
+
+        if risk_distribution not in risk_distributions:
+            raise ValueError(
+                f"Unsupported risk distribution '{risk_distribution}'; "
+                + f"must be one of {', '.join(risk_distributions)}"
+            )
+
+        # make sure risk adjustment is valid
+        if risk_adjustment not in cls.supported_risk_adjustments:
+            risk_adjust_opts = ", ".join(
+                [opt or "none" for opt in cls.supported_risk_adjustments]
+            )
+            raise ValueError(
+                f"Unsupported risk adjustment '{risk_adjustment}'; "
+                + f"must be one of {risk_adjust_opts}"
+            )
+
+        if adjust_payoff not in cls.supported_adjust_payoffs:
+            adjust_payoffs_opts = ", ".join(cls.supported_adjust_payoffs)
+            raise ValueError(
+                f"Unsupported adjust payoff option '{adjust_payoff}'; "
+                + f"must be one of {adjust_payoffs_opts}"
+            )
+
+        if adjust_neighborhood is not None:
+            check_neighborhood_size(adjust_neighborhood)
+            if grid_size < 5 and adjust_neighborhood > 8:
+                raise ValueError(
+                    f"Adjust neighborhood {adjust_neighborhood} is too large "
+                    + f"for grid size {grid_size}"
+                )
+
+        if (
+            data_collection_schedule is DataCollectionSchedule.ADJUST
+            and risk_adjustment is None
+        ):
+            raise ValueError(
+                "Can't collect data on adjustment rounds when adjustment is disabled"
+            )
+
+        super().check_parameters(grid_size, **kwargs)
+
+    @classmethod
+    def canonical_parameters(cls, params: dict) -> dict:
+        params = super().canonical_parameters(params)
+        if params.get("risk_adjustment", "adopt") in [None, "none"]:
+            # adjustment options have no effect when adjustment is disabled
+            params["risk_adjustment"] = None
+            for option in ["adjust_every", "adjust_neighborhood", "adjust_payoff"]:
+                params.pop(option, None)
+        elif params.get("adjust_neighborhood") is None:
+            # adjust neighborhood defaults to play neighborhood
+            params["adjust_neighborhood"] = params.get("play_neighborhood", 8)
+        return params
+
+    def count_risk_levels(self) -> list[int]:
+        """count the number of agents at each risk level, for all
+        allowed risk levels"""
+        counts = [0] * (self.max_allowed_risk_level + 1)
+        for agent in self.schedule.agents:
+            counts[agent.risk_level] += 1
+        return counts
+
+    def update_risk_level_count(self, old_risk_level: int, new_risk_level: int):
+        """update risk level counts when an agent changes risk level"""
+        self.risk_level_counts[old_risk_level] -= 1
+        self.risk_level_counts[new_risk_level] += 1
 
     def _risk_level_in_bounds(self, value) -> bool:
         # check if a generated risk level is within bounds
         return self.min_risk_level <= value <= self.max_risk_level
 
+    def sample_risk_attitudes(self, n: int) -> np.ndarray:
+        """return an array of `n` risk attitudes sampled from the
+        configured distribution."""
+        distribution = risk_distributions[self.risk_distribution]
+        levels = np.empty(0, dtype=np.int64)
+        while len(levels) < n:
+            values = distribution.sample(
+                self.rng, n - len(levels), self.min_risk_level, self.max_risk_level
+            )
+            values = np.round(values).astype(np.int64)
+            if distribution.clamp:
+                values = np.clip(values, self.min_risk_level, self.max_risk_level)
+            else:
+                # occasionally distributions will return values that are out of
+                # range; rather than capping to the min/max and messing up
+                # the distribution, drop them and sample again
+                values = values[
+                    (values >= self.min_risk_level) & (values <= self.max_risk_level)
+                ]
+            levels = np.concatenate([levels, values])
+        return levels
+
     def get_risk_attitude_generator(self):
         """return a generator that will return risk attitudes for individual
-        agents based on the configured distribution."""
-        if self.risk_distribution == "uniform":
-            # uniform/random: generate random integer within risk level range
-            while True:
-                yield self.random.randint(self.min_risk_level, self.max_risk_level)
-        if self.risk_distribution == "normal":
-            # return values from a normal distribution centered around 4.5
-            while True:
-                yield round(self.random.gauss(4.5, 1.5))
-        elif self.risk_distribution == "skewed left":
-            # return values from a triangler distribution centered around 0
-            while True:
-                yield round(
-                    self.random.triangular(self.min_risk_level, self.max_risk_level, 0)
-                )
-        elif self.risk_distribution == "skewed right":
-            # return values from a triangular distribution centered around 9
-            while True:
-                yield round(
-                    self.random.triangular(self.min_risk_level, self.max_risk_level, 9)
-                )
-        elif self.risk_distribution == "bimodal":
-            # to generate a bimodal distribution, alternately generate
-            # values from two different normal distributions centered
-            # around the beginning and end of our risk attitude range
-            while True:
-                yield round(self.random.gauss(self.min_risk_level, 1.5))
-                yield round(self.random.gauss(self.max_risk_level, 1.5))
-                # NOTE: on smaller grids, using 0/9 makes it extremely
-                # unlikely to get mid-range risk values (4/5)
+        agents based on the configured distribution; values are sampled
+        in batches, one for each agent."""
+        while True:
+            yield from self.sample_risk_attitudes(self.num_agents).tolist()
 
     def get_risk_attitude(self) -> int:
         """return the next value from risk attitude generator, based on
         configured distribution."""
-        val = next(self.risk_attitude_generator)
-
-        # for bimodal distribution, clamp values to range
-        if self.risk_distribution == "bimodal":
-            return max(self.min_risk_level, min(self.max_risk_level, val))
-
-        # for all other distributions:
-        # occasionally generators will return values that are out of range.
-        # rather than capping to the min/max and messing up the distribution,
-        # just get the next value
-        while not self._risk_level_in_bounds(val):
-            val = next(self.risk_attitude_generator)
-        return val
+        return next(self.risk_attitude_generator)
 
     @property
     def adjustment_round(self) -> bool:
@@ -380,6 +532,12 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         return opts
 
     def step(self):
+        self.start_step()
+        super().step()
+
+    def start_step(self):
+        """Update risk level totals used for convergence detection before
+        agents play; called at the beginning of each step."""
         # delete cached property before the next round begins,
         # to force recalculating values before collecting data
 
@@ -397,8 +555,6 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
             # property hasn't been set yet on the first round, ok to ignore
             pass
 
-        super().step()
-
     def collect_data(self):
         # collect data based on configured schedule.
         # For END and ADJUST, also collect on the last round (when the
@@ -422,6 +578,19 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
             if self.data_collection_schedule is not DataCollectionSchedule.ALL:
                 self._collected_steps.append(self.schedule.steps - 1)
 
+    def snapshot(self) -> dict:
+        row = super().snapshot()
+        # only one field requires checking all agents
+        row["num_agents_risk_changed"] = self.num_agents_risk_changed
+        row["population_risk_category"] = self.population_risk_category
+        row["sum_risk_level_changes"] = self.sum_risk_level_changes
+        for risk_level in range(
+            self.min_allowed_risk_level, self.max_allowed_risk_level + 1
+        ):
+            field = f"total_r{risk_level}"
+            row[field] = getattr(self, field)
+        return row
+
     @property
     def collected_steps(self):
         """0-based step indices for each row in the datacollector, in
@@ -463,13 +632,13 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
             # NOTE: could adjust the threshold here.
             # sum_risk_level_changes is None until two adjustment rounds
             # of totals have been recorded; treat that as "not converged"
-            or (self.sum_risk_level_changes <= len(self.schedule.agents) * 0.07)
+            or (self.sum_risk_level_changes <= self.num_agents * 0.07)
         )
 
     @cached_property
     def total_per_risk_level(self) -> Counter:
-        # tally the number of agents for each risk level
-        return Counter([a.risk_level for a in self.schedule.agents])
+        # snapshot of the number of agents for each risk level
+        return Counter(dict(enumerate(self.risk_level_counts)))
 
     @cached_property
     def sum_risk_level_changes(self) -> int:
@@ -492,21 +661,6 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         # return the sum of changes across all risk levels
         return sum(changes.values())
 
-    def __getattr__(self, attr):
-        # support dynamic properties for data collection on total by risk level
-        if attr.startswith("total_r"):
-            try:
-                r = int(attr.replace("total_r", ""))
-                # only handle risk levels that are in bounds
-                if r > self.max_risk_level or r < self.min_risk_level:
-                    raise AttributeError
-                return self.total_per_risk_level[r]
-            except ValueError:
-                # ignore and throw attribute error
-                pass
-
-        raise AttributeError
-
     @property
     def population_risk_category(self):
         # calculate a category of risk distribution for the population
@@ -514,7 +668,7 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
         # (categorization scheme defined by LB)
 
         # count the number of agents in three groups:
-        risk_counts = self.total_per_risk_level
+        risk_counts = self.risk_level_counts
         # TODO: define these on the class for reuse in analysis?
         total = {
             "risk_inclined": risk_counts[0] + risk_counts[1] + risk_counts[2],
@@ -525,7 +679,9 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
             "risk_avoidant": risk_counts[7] + risk_counts[8] + risk_counts[9],
         }
         # for each group, calculate percent of agents in that category
-        total_agents = len(self.schedule.agents)
+        # (every agent has exactly one risk level, so the sum of all
+        # risk level totals is the number of agents)
+        total_agents = sum(risk_counts)
         percent = {key: val / total_agents for key, val in total.items()}
 
         # majority risk inclined (> 50%)
@@ -574,3 +730,26 @@ class HawkDoveMultipleRiskModel(HawkDoveModel):
                 return RiskState.c9
 
         return RiskState.c13
+
+
+def _total_risk_level_property(risk_level: int) -> property:
+    # generate a property for the number of agents with a particular
+    # risk level, for data collection on total by risk level
+    def total(self):
+        # only report on risk levels in bounds for this simulation
+        if self.min_risk_level <= risk_level <= self.max_risk_level:
+            return self.risk_level_counts[risk_level]
+
+    return property(total, doc=f"number of agents with risk level {risk_level}")
+
+
+# add total_r0 through total_r9 properties for all allowed risk levels
+for _risk_level in range(
+    HawkDoveMultipleRiskModel.min_allowed_risk_level,
+    HawkDoveMultipleRiskModel.max_allowed_risk_level + 1,
+):
+    setattr(
+        HawkDoveMultipleRiskModel,
+        f"total_r{_risk_level}",
+        _total_risk_level_property(_risk_level),
+    )
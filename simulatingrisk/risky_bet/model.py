@@ -4,7 +4,7 @@ import statistics
 
 import mesa
 
-from simulatingrisk.utils import coinflip
+from simulatingrisk.utils import coinflip, fill_grid
 
 
 Bet = Enum("Bet", ["RISKY", "SAFE"])
@@ -134,12 +134,12 @@ class RiskyBetModel(mesa.Model):
         self.grid = mesa.space.SingleGrid(grid_size, grid_size, True)
         self.schedule = mesa.time.SimultaneousActivation(self)
 
-        # initialize agents and add to grid and scheduler
+        # initialize agents and add to scheduler
         for i in range(self.num_agents):
             a = Gambler(i, self, self.initial_wealth)
             self.schedule.add(a)
-            # place randomly in an empty spot
-            self.grid.move_to_empty(a)
+        # place agents randomly, filling the grid
+        fill_grid(self.grid, self.schedule.agents, self.random)
 
         self.datacollector = mesa.DataCollector(
             model_reporters={
@@ -177,7 +177,9 @@ class RiskyBetModel(mesa.Model):
     def call_risky_bet(self):
         # flip a weighted coin to determine if the risky bet pays off,
         # weighted by current round payoff probability
-        self.risky_bet = coinflip([True, False], weight=self.prob_risky_payoff)
+        self.risky_bet = coinflip(
+            [True, False], weight=self.prob_risky_payoff, rng=self.random
+        )
         return self.risky_bet
 
     @property
@@ -119,6 +119,7 @@ class RiskyFoodModel(mesa.Model):
         return coinflip(
             choices=[FoodStatus.NOTCONTAMINATED, FoodStatus.CONTAMINATED],
             weight=self.prob_notcontaminated,
+            rng=self.random,
         )
 
     def propagate(self):
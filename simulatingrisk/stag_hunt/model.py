@@ -3,6 +3,8 @@ from functools import partial
 
 import mesa
 
+from simulatingrisk.utils import fill_grid
+
 HuntChoice = Enum("Hunt", ["STAG", "HARE"])
 choices = [HuntChoice.STAG, HuntChoice.HARE]
 
@@ -97,8 +99,8 @@ class StagHuntModel(mesa.Model):
         for i in range(self.num_agents):
             a = StagHuntAgent(i, self)
             self.schedule.add(a)
-            # place randomly in an empty spot
-            self.grid.move_to_empty(a)
+        # place agents randomly, filling the grid
+        fill_grid(self.grid, self.schedule.agents, self.random)
 
         # self.datacollector = mesa.DataCollector(
         #     model_reporters={"stag hunters": count_stag_hunters},
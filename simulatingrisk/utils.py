@@ -1,26 +1,181 @@
 import random
+import time
+from collections import Counter, deque
+from fractions import Fraction
 
 
-def coinflip(choices: [any, any] = [0, 1], weight: float = 0.5) -> any:
+def coinflip(
+    choices: [any, any] = [0, 1], weight: float = 0.5, rng: random.Random | None = None
+) -> any:
     """Flip a coin with an optional weight between 0.0 and 1.0 for the
     first choice. If no  weight is specified, a choice is made with
-    equal probability.
+    equal probability. Models should pass in their own random generator,
+    so that seeded runs are reproducible.
 
     :param choices: list of coin flip options, defaults to [0, 1]
     :type choices: [any, any] (optional)
     :param weight: optional weight between 0.0-1.0 for the first
         choice, defaults to 0.5
     :type weight: float (optional)
+    :param rng: random number generator to use, defaults to the
+        global :mod:`random` module
+    :type rng: :class:`random.Random` (optional)
 
     :return: selected choice
     :rtype: any
     """
     # adapted from https://stackoverflow.com/a/477248/9706217
     # random.random is apparently faster than
-    selection = 0 if random.random() < weight else 1
+    rng = rng or random
+    selection = 0 if rng.random() < weight else 1
     return choices[selection]
 
 
+def fill_grid(grid, agents: list, rng: random.Random):
+    """Place agents on a mesa grid in random positions, using a single
+    shuffled list of all cells. Much faster than placing agents one at a
+    time in a random empty cell (:meth:`mesa.space.SingleGrid.move_to_empty`),
+    which gets slower as the grid fills up. Models should pass in their own
+    random generator, so that seeded runs are reproducible.
+
+    :param grid: grid to place agents on; must be empty
+    :type grid: :class:`mesa.space.SingleGrid`
+    :param agents: agents to place; must not be more than the number of cells
+    :type agents: list
+    :param rng: random number generator used to shuffle cells
+    :type rng: :class:`random.Random`
+    """
+    if len(agents) > grid.num_cells:
+        raise ValueError(
+            f"Can't place {len(agents)} agents on a grid with {grid.num_cells} cells"
+        )
+    cells = [(x, y) for x in range(grid.width) for y in range(grid.height)]
+    rng.shuffle(cells)
+    for agent, pos in zip(agents, cells):
+        grid.place_agent(agent, pos)
+
+
+class RollingWindow:
+    """Fixed-size window of the most recent values, for tracking
+    rolling statistics over a simulation. Mean, minimum, and maximum
+    are updated as values are added, so they don't require checking
+    every value in the window. The mean is calculated from an exact
+    running total, so it matches :func:`statistics.mean` for the
+    same values.
+
+    :param size: maximum number of values to keep
+    :type size: int
+    :param values: optional initial values
+    :type values: iterable (optional)
+    """
+
+    def __init__(self, size: int, values=()):
+        self.size = size
+        self.values = deque([], maxlen=size)
+        self.total = Fraction(0)
+        # values that may become the minimum or maximum as older values
+        # are dropped; ascending for minimum, descending for maximum
+        self._min_candidates = deque()
+        self._max_candidates = deque()
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __repr__(self):
+        return f"<RollingWindow size={self.size} values={list(self.values)}>"
+
+    def append(self, value):
+        "add a value, dropping the oldest value if the window is full"
+        if len(self.values) == self.size:
+            oldest = self.values[0]
+            self.total -= Fraction(oldest)
+            # oldest value can only be first in the candidate lists
+            if self._min_candidates[0] == oldest:
+                self._min_candidates.popleft()
+            if self._max_candidates[0] == oldest:
+                self._max_candidates.popleft()
+        self.values.append(value)
+        self.total += Fraction(value)
+        while self._min_candidates and self._min_candidates[-1] > value:
+            self._min_candidates.pop()
+        self._min_candidates.append(value)
+        while self._max_candidates and self._max_candidates[-1] < value:
+            self._max_candidates.pop()
+        self._max_candidates.append(value)
+
+    def mean(self) -> float:
+        "mean of values currently in the window"
+        return float(self.total / len(self.values))
+
+    def min(self):
+        "smallest value currently in the window"
+        return self._min_candidates[0]
+
+    def max(self):
+        "largest value currently in the window"
+        return self._max_candidates[0]
+
+    def is_stable(self, digits: int = 2) -> bool:
+        """check if all values in the window are the same when
+        rounded to the specified number of digits"""
+        # rounding preserves order, so it's enough to compare min and max
+        return round(self.min(), digits) == round(self.max(), digits)
+
+
+class StepProfile:
+    """Cumulative time spent in named sections of simulation steps,
+    for profiling where a model spends its time. Sections are timed with
+    a monotonic clock by calling :meth:`start` and :meth:`stop` around
+    them; sections can be nested, in which case time is only counted
+    for the innermost section.
+
+    :param enabled: when False, starting and stopping sections does
+        nothing, so models can leave profiling calls in place with
+        minimal overhead; defaults to True
+    :type enabled: bool (optional)
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        #: total time for each section, in nanoseconds
+        self.times = Counter()
+        #: number of times each section was timed
+        self.calls = Counter()
+        # sections currently running: name, start time, and time spent
+        # in sections nested inside it
+        self._running = []
+        if not enabled:
+            self.start = self.stop = self._disabled
+
+    def _disabled(self, *args):
+        pass
+
+    def start(self, name: str):
+        "start timing a section"
+        self._running.append([name, time.perf_counter_ns(), 0])
+
+    def stop(self):
+        "stop timing the most recently started section"
+        name, start, nested = self._running.pop()
+        elapsed = time.perf_counter_ns() - start
+        self.times[name] += elapsed - nested
+        self.calls[name] += 1
+        if self._running:
+            self._running[-1][2] += elapsed
+
+    def seconds(self) -> dict[str, float]:
+        "total time for each section, in seconds"
+        return {name: ns / 1e9 for name, ns in self.times.items()}
+
+
 def labelLabel(fields):
     # some kind of a bug in current (forked) version of Mesa or
     # a conflict with tornado version on field labels;
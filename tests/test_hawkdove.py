@@ -1,15 +1,21 @@
 import math
+import random
 from unittest.mock import Mock, patch
 from collections import Counter
 
+import mesa
 import pytest
 
 from simulatingrisk.hawkdove.model import (
     HawkDoveAgent,
+    HawkDoveModel,
     Play,
     HawkDoveSingleRiskModel,
     HawkDoveSingleRiskAgent,
+    default_payoff_matrix,
+    neighbor_table,
 )
+from simulatingrisk.utils import RollingWindow
 
 
 def test_agent_neighbors():
@@ -27,6 +33,30 @@ def test_agent_neighbors():
     assert all([len(agent.play_neighbors) == 24 for agent in model.schedule.agents])
 
 
+@pytest.mark.parametrize("grid_size", [1, 2, 3, 4, 6])
+def test_neighbor_table(grid_size):
+    # neighbor table should match mesa neighborhoods, including
+    # small grids where neighborhoods wrap around to the same cells
+    grid = mesa.space.SingleGrid(grid_size, grid_size, True)
+    for size, moore, radius in [(4, False, 1), (8, True, 1), (24, True, 2)]:
+        table = neighbor_table(grid_size, size)
+        assert table.shape[0] == grid_size * grid_size
+        for x in range(grid_size):
+            for y in range(grid_size):
+                expected = grid.get_neighborhood((x, y), moore, radius=radius)
+                cells = table[x * grid_size + y]
+                assert [divmod(c, grid_size) for c in cells] == list(expected)
+
+
+def test_agent_neighbors_match_grid():
+    # neighbors from the precomputed table should match grid neighbors
+    model = HawkDoveSingleRiskModel(6, agent_risk_level=4)
+    for agent in model.schedule.agents:
+        for size, moore, radius in [(4, False, 1), (8, True, 1), (24, True, 2)]:
+            expected = model.grid.get_neighbors(agent.pos, moore, radius=radius)
+            assert agent.get_neighbors(size) == expected
+
+
 def test_bad_gridsize():
     # anything less than 5 should not allow play neighborhood of 24
     for grid_size in [3, 4]:
@@ -62,19 +92,21 @@ def test_agent_initial_choice_hawkodds():
 def test_base_agent_risk_level():
     # base class should raise error because method to set risk level is not defined
     with pytest.raises(NotImplementedError):
-        HawkDoveAgent(1, Mock())
+        HawkDoveAgent(1, Mock(random=random.Random()))
 
 
 def test_agent_initial_risk_level():
     # single risk agent sets risk level based on model
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=2))
+    agent = HawkDoveSingleRiskAgent(1, Mock(random=random.Random(), agent_risk_level=2))
     assert agent.risk_level == 2
 
 
 def test_agent_repr():
     agent_id = 1
     risk_level = 3
-    agent = HawkDoveSingleRiskAgent(agent_id, Mock(agent_risk_level=risk_level))
+    agent = HawkDoveSingleRiskAgent(
+        agent_id, Mock(random=random.Random(), agent_risk_level=risk_level)
+    )
     assert (
         repr(agent)
         == f"<HawkDoveSingleRiskAgent id={agent_id} r={risk_level} points=0>"
@@ -105,11 +137,15 @@ def test_model_converged():
     # set min window smaller for testing purposes
     model.min_window = 3
     # convergence is based on rolling average percent hawk
-    model.recent_rolling_percent_hawk = [0.49, 0.48, 0.50, 0.47]
+    model.recent_rolling_percent_hawk = RollingWindow(
+        model.rolling_window, [0.49, 0.48, 0.50, 0.47]
+    )
     assert not model.converged
 
     # slight variation but all round to 0.48
-    model.recent_rolling_percent_hawk = [0.481, 0.482, 0.483, 0.480]
+    model.recent_rolling_percent_hawk = RollingWindow(
+        model.rolling_window, [0.481, 0.482, 0.483, 0.480]
+    )
     assert model.converged
 
     # low rolling average but not past min steps
@@ -121,9 +157,24 @@ def test_bad_neighborhood_size():
     with pytest.raises(ValueError):
         HawkDoveSingleRiskModel(3, play_neighborhood=3, agent_risk_level=6)
     with pytest.raises(ValueError):
-        agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=2))
+        agent = HawkDoveSingleRiskAgent(
+            1, Mock(random=random.Random(), agent_risk_level=2)
+        )
         agent.get_neighbors(5)
 
+    # neighborhood too large for grid size
+    with pytest.raises(ValueError, match="Play neighborhood 24 is too large"):
+        HawkDoveSingleRiskModel(4, play_neighborhood=24, agent_risk_level=6)
+
+
+def test_model_check_parameters():
+    # parameters can be checked without initializing a model
+    HawkDoveModel.check_parameters(10, play_neighborhood=24, hawk_odds=0.3)
+    with pytest.raises(ValueError, match="Observed neighborhood 24 is too large"):
+        HawkDoveModel.check_parameters(3, observed_neighborhood=24)
+    with pytest.raises(ValueError, match="not a supported neighborhood size"):
+        HawkDoveModel.check_parameters(10, play_neighborhood=6)
+
 
 def test_observed_neighborhood_size():
     # observed neighborhood size is also configurable
@@ -141,7 +192,7 @@ def test_observed_neighborhood_size():
 
 def test_num_dove_neighbors():
     # initialize an agent with a mock model
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=2))
+    agent = HawkDoveSingleRiskAgent(1, Mock(random=random.Random(), agent_risk_level=2))
     mock_neighbors = [
         Mock(last_choice=Play.HAWK),
         Mock(last_choice=Play.HAWK),
@@ -154,7 +205,7 @@ def test_num_dove_neighbors():
 
 
 def test_agent_choose():
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=3))
+    agent = HawkDoveSingleRiskAgent(1, Mock(random=random.Random(), agent_risk_level=3))
     # on the first round, nothing should happen (uses initial choice)
     agent.model.schedule.steps = 0
     # disable random play for now
@@ -191,7 +242,7 @@ def test_agent_choose():
 
 @patch("simulatingrisk.hawkdove.model.coinflip")
 def test_agent_choose_random(mock_coinflip):
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=3))
+    agent = HawkDoveSingleRiskAgent(1, Mock(random=random.Random(), agent_risk_level=3))
     agent.model.schedule.steps = 1
     # reset after init, which calls coinflip for initial play
     mock_coinflip.reset_mock()
@@ -209,10 +260,10 @@ def test_agent_choose_random(mock_coinflip):
         assert mock_coinflip.call_count == 2
         # called for random play with model odds
         mock_coinflip.assert_any_call(
-            [True, False], weight=agent.model.random_play_odds
+            [True, False], weight=agent.model.random_play_odds, rng=agent.random
         )
         # called a second time to determine which play to make
-        mock_coinflip.assert_any_call([Play.HAWK, Play.DOVE])
+        mock_coinflip.assert_any_call([Play.HAWK, Play.DOVE], rng=agent.random)
         assert agent.choice == Play.DOVE
 
 
@@ -262,7 +313,14 @@ def test_agent_choose_when_observe_play_differ():
 
 
 def test_agent_play():
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=3))
+    agent = HawkDoveSingleRiskAgent(
+        1,
+        Mock(
+            random=random.Random(),
+            agent_risk_level=3,
+            payoff_matrix=default_payoff_matrix,
+        ),
+    )
     # on the first round, last choice should be unset
     assert agent.last_choice is None
     assert agent.points == 0
@@ -281,7 +339,14 @@ def test_agent_play():
 
 
 def test_agent_hawk_count():
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=3))
+    agent = HawkDoveSingleRiskAgent(
+        1,
+        Mock(
+            random=random.Random(),
+            agent_risk_level=3,
+            payoff_matrix=default_payoff_matrix,
+        ),
+    )
     assert agent.hawk_count == 0
 
     agent.choice = Play.HAWK
@@ -311,8 +376,11 @@ def test_agent_payoff():
     # If I play DOVE and neighbor plays HAWK: 1
     # If I play HAWK and neighbor plays HAWK: 0
 
-    agent = HawkDoveSingleRiskAgent(1, Mock(agent_risk_level=2))
-    other_agent = HawkDoveSingleRiskAgent(2, Mock(agent_risk_level=3))
+    model = Mock(
+        random=random.Random(), agent_risk_level=2, payoff_matrix=default_payoff_matrix
+    )
+    agent = HawkDoveSingleRiskAgent(1, model)
+    other_agent = HawkDoveSingleRiskAgent(2, model)
     # If I play HAWK and neighbor plays DOVE: 3
     agent.choice = Play.HAWK
     other_agent.choice = Play.DOVE
@@ -330,3 +398,140 @@ def test_agent_payoff():
     other_agent.choice = Play.DOVE
     assert agent.payoff(other_agent) == 2
     assert other_agent.payoff(agent) == 2
+
+
+def test_model_payoff_matrix():
+    model = HawkDoveSingleRiskModel(3, agent_risk_level=2)
+    assert model.payoff_matrix == default_payoff_matrix
+
+    # custom payoffs
+    model = HawkDoveSingleRiskModel(
+        3, agent_risk_level=2, payoff_matrix=[[0, 4], [1, 2]]
+    )
+    assert model.payoff_matrix == ((0, 4), (1, 2))
+    agent, other_agent = model.schedule.agents[:2]
+    agent.choice = Play.HAWK
+    other_agent.choice = Play.DOVE
+    assert agent.payoff(other_agent) == 4
+
+    with pytest.raises(ValueError, match="must be 2x2"):
+        HawkDoveSingleRiskModel(3, agent_risk_level=2, payoff_matrix=[[0, 3, 1]])
+
+
+def test_model_running_totals():
+    model = HawkDoveSingleRiskModel(5, agent_risk_level=4, random_play_odds=0.5)
+    hawks = sum(a.choice == Play.HAWK for a in model.schedule.agents)
+    assert model.percent_hawk == hawks / model.num_agents
+    assert model.max_agent_points == 0
+
+    for _ in range(5):
+        model.step()
+        # running totals should match a full check of all agents
+        hawks = sum(a.choice == Play.HAWK for a in model.schedule.agents)
+        assert model.percent_hawk == hawks / model.num_agents
+        assert model.max_agent_points == max(a.points for a in model.schedule.agents)
+
+
+@pytest.mark.parametrize(
+    "opts",
+    [
+        {"random_play_odds": 0},
+        {"play_neighborhood": 4, "observed_neighborhood": 24, "hawk_odds": 0.8},
+    ],
+)
+def test_model_sparse_update(opts):
+    model = HawkDoveSingleRiskModel(6, agent_risk_level=4, seed=3, **opts)
+    sparse_model = HawkDoveSingleRiskModel(
+        6, agent_risk_level=4, seed=3, sparse_update=True, **opts
+    )
+    # all agents update on the first rounds
+    for _ in range(2):
+        model.step()
+        sparse_model.step()
+        assert sparse_model.choice_updates is None
+    while model.running and model.schedule.steps < 40:
+        model.step()
+        sparse_model.step()
+        # only agents with neighbors that changed play are updated
+        assert sparse_model.choice_updates is not None
+        assert sparse_model.payoff_updates is not None
+        # results are the same as updating every agent
+        assert [(a.choice, a.points) for a in model.schedule.agents] == [
+            (a.choice, a.points) for a in sparse_model.schedule.agents
+        ]
+    assert sparse_model.running == model.running
+    assert sparse_model.datacollector.model_vars == model.datacollector.model_vars
+
+
+def test_model_sparse_update_changes():
+    model = HawkDoveSingleRiskModel(
+        5, agent_risk_level=4, random_play_odds=0, sparse_update=True
+    )
+    for _ in range(2):
+        model.step()
+    model.start_sparse_update()
+    agent = model.schedule.agents[0]
+    model.choice_changed(agent)
+    # agent and play neighbors update payoff this round
+    assert model.payoff_updates == {agent, *agent.play_neighbors}
+    assert model.needs_payoff_update(agent)
+    # observers update choice next round
+    model.start_sparse_update()
+    assert model.choice_updates == set(agent.observed_neighbors)
+    assert not model.needs_choice_update(agent)
+    assert model.needs_choice_update(agent.observed_neighbors[0])
+
+
+def test_mesa_batch_run_agent_data():
+    # mesa batch run reads agent records from the data collector directly
+    results = mesa.batch_run(
+        HawkDoveSingleRiskModel,
+        parameters={"grid_size": 3, "agent_risk_level": 4},
+        iterations=1,
+        max_steps=3,
+        number_processes=1,
+        data_collection_period=1,
+        display_progress=False,
+    )
+    # no agent data on step 0, then one row per agent for each step
+    assert len(results) == 1 + 3 * 9
+    agent_rows = [row for row in results if row["Step"] == 3]
+    assert sorted(row["AgentID"] for row in agent_rows) == list(range(9))
+    model_data = results[0].keys()
+    for row in agent_rows:
+        assert row.keys() - model_data >= {"AgentID", "choice", "points", "risk_level"}
+        assert row["choice"] in ["hawk", "dove"]
+        assert isinstance(row["points"], int)
+
+
+def test_model_max_agent_points_negative_payoffs():
+    model = HawkDoveSingleRiskModel(
+        3, agent_risk_level=2, payoff_matrix=[[-2, 3], [1, 2]]
+    )
+    assert not model.points_increase
+    for _ in range(3):
+        model.step()
+        assert model.max_agent_points == max(a.points for a in model.schedule.agents)
+
+
+def test_model_snapshot():
+    model = HawkDoveSingleRiskModel(5, agent_risk_level=4)
+    model.step()
+    snapshot = model.snapshot()
+    # snapshot includes all model reporters, with the same values
+    assert snapshot.keys() == model.datacollector.model_reporters.keys()
+    for field, reporter in model.datacollector.model_reporters.items():
+        assert snapshot[field] == getattr(model, reporter)
+
+    # data collector gets all model values from a single snapshot
+    with patch.object(model, "snapshot", wraps=model.snapshot) as mock_snapshot:
+        model.datacollector.collect(model)
+        mock_snapshot.assert_called_once()
+    assert model.datacollector.model_vars["percent_hawk"][-1] == model.percent_hawk
+    assert model.datacollector.model_vars["total_agents"] == [25, 25]
+
+    # reporters not in the snapshot are still collected
+    model.datacollector._new_model_reporter("steps", lambda m: m.schedule.steps)
+    model.datacollector.collect(model)
+    assert model.datacollector.model_vars["steps"] == [1]
+    assert len(model.datacollector.model_vars["percent_hawk"]) == 3
@@ -1,16 +1,23 @@
+import random
 import statistics
 from collections import Counter, deque
 from unittest.mock import Mock, patch
 
+import mesa
+import numpy as np
 import pytest
 
-from simulatingrisk.hawkdove.model import Play
+from simulatingrisk.hawkdove.model import Play, default_payoff_matrix
 from simulatingrisk.hawkdovemulti.model import (
     DataCollectionSchedule,
     HawkDoveMultipleRiskAgent,
     HawkDoveMultipleRiskModel,
+    RiskDistribution,
     RiskState,
+    register_risk_distribution,
+    risk_distributions,
 )
+from simulatingrisk.utils import RollingWindow
 
 
 def test_init():
@@ -195,6 +202,8 @@ def test_total_per_risk_level():
         Mock(risk_level=5),
     ]
     model.schedule.agents = mock_agents
+    # counts are tracked as agents adjust; recount for the mock agents
+    model.risk_level_counts = model.count_risk_levels()
 
     totals = model.total_per_risk_level
     assert totals[0] == 1
@@ -205,15 +214,154 @@ def test_total_per_risk_level():
     assert totals[8] == 0
 
     # check caching works as desired
-    mock_agents.append(Mock(risk_level=8))
-    model.schedule.agents = mock_agents
-    # cached total should not change even though agents have changed
+    model.update_risk_level_count(5, 8)
+    # cached total should not change even though counts have changed
     assert model.total_per_risk_level[8] == 0
     # step should reset catched property
     with patch("builtins.super"):
         model.step()
     # now the count should be updated
     assert model.total_per_risk_level[8] == 1
+    assert model.total_per_risk_level[5] == 0
+
+
+def test_risk_level_counts():
+    model = HawkDoveMultipleRiskModel(5, risk_adjustment="average", adjust_every=2)
+    assert len(model.risk_level_counts) == model.max_allowed_risk_level + 1
+    assert sum(model.risk_level_counts) == model.num_agents
+    for _ in range(6):
+        model.step()
+        # counts updated by agent adjustments should match a full count
+        assert model.risk_level_counts == model.count_risk_levels()
+
+    # counts are also updated when an agent's risk level is set directly
+    agent = model.schedule.agents[0]
+    agent.risk_level = 9 if agent.risk_level != 9 else 0
+    assert model.risk_level_counts == model.count_risk_levels()
+    # setting the same risk level doesn't change counts
+    agent.risk_level = agent.risk_level
+    assert model.risk_level_counts == model.count_risk_levels()
+
+
+def test_model_snapshot():
+    model = HawkDoveMultipleRiskModel(5, include_endpoints=False, adjust_every=2)
+    for _ in range(3):
+        model.step()
+    snapshot = model.snapshot()
+    assert snapshot.keys() == model.datacollector.model_reporters.keys()
+    for field, reporter in model.datacollector.model_reporters.items():
+        assert snapshot[field] == getattr(model, reporter)
+    assert snapshot["total_r0"] is None
+
+
+def test_model_seed():
+    # models with the same seed should run identically
+    opts = {"risk_adjustment": "adopt", "adjust_every": 2, "random_play_odds": 0.1}
+    model = HawkDoveMultipleRiskModel(5, seed=8, **opts)
+    seeded_model = HawkDoveMultipleRiskModel(5, seed=8, **opts)
+    for _ in range(10):
+        model.step()
+        seeded_model.step()
+    assert [(a.risk_level, a.choice, a.points) for a in model.schedule.agents] == [
+        (a.risk_level, a.choice, a.points) for a in seeded_model.schedule.agents
+    ]
+
+
+@pytest.mark.parametrize("risk_adjustment", ["adopt", "average"])
+def test_model_sparse_update(risk_adjustment):
+    # agents adjusting risk attitude still get the same results
+    opts = {
+        "risk_adjustment": risk_adjustment,
+        "adjust_every": 3,
+        "adjust_payoff": "total",
+        "seed": 4,
+    }
+    model = HawkDoveMultipleRiskModel(8, **opts)
+    sparse_model = HawkDoveMultipleRiskModel(8, sparse_update=True, **opts)
+    for _ in range(30):
+        model.step()
+        sparse_model.step()
+    assert [(a.risk_level, a.choice, a.points) for a in model.schedule.agents] == [
+        (a.risk_level, a.choice, a.points) for a in sparse_model.schedule.agents
+    ]
+    assert sparse_model.datacollector.model_vars == model.datacollector.model_vars
+
+
+def test_mesa_batch_run_agent_data():
+    # mesa batch run reads agent records from the data collector directly
+    results = mesa.batch_run(
+        HawkDoveMultipleRiskModel,
+        parameters={"grid_size": 3},
+        iterations=1,
+        max_steps=3,
+        number_processes=1,
+        data_collection_period=1,
+        display_progress=False,
+    )
+    agent_rows = [row for row in results if row["Step"] == 3]
+    assert sorted(row["AgentID"] for row in agent_rows) == list(range(9))
+    for row in agent_rows:
+        assert row["risk_level"] in range(10)
+        assert row["risk_level_changed"] in [True, False]
+
+
+def test_model_profile():
+    model = HawkDoveMultipleRiskModel(5, risk_adjustment="adopt", adjust_every=2)
+    model.step()
+    # not profiled by default
+    assert model.profile.times == {}
+
+    model = HawkDoveMultipleRiskModel(
+        5, risk_adjustment="adopt", adjust_every=2, profile=True
+    )
+    for _ in range(4):
+        model.step()
+    assert set(model.profile.times) == set(model.profile_sections)
+    assert model.profile.calls["choose"] == 4
+    assert model.profile.calls["collect_data"] == 4
+    # risk adjustment is timed for each agent on adjustment rounds
+    # (only step 2 in the first four steps)
+    assert model.profile.calls["adjust_risk"] == 25
+
+
+def test_check_parameters():
+    HawkDoveMultipleRiskModel.check_parameters(10, risk_adjustment="none")
+    with pytest.raises(ValueError, match="Unsupported risk distribution"):
+        HawkDoveMultipleRiskModel.check_parameters(10, risk_distribution="flat")
+    with pytest.raises(ValueError, match="Adjust neighborhood 24 is too large"):
+        HawkDoveMultipleRiskModel.check_parameters(4, adjust_neighborhood=24)
+    # base model parameters are also checked
+    with pytest.raises(ValueError, match="Play neighborhood 24 is too large"):
+        HawkDoveMultipleRiskModel.check_parameters(4, play_neighborhood=24)
+    with pytest.raises(ValueError, match="Can't collect data on adjustment rounds"):
+        HawkDoveMultipleRiskModel.check_parameters(
+            10,
+            risk_adjustment=None,
+            data_collection_schedule=DataCollectionSchedule.ADJUST,
+        )
+
+
+def test_canonical_parameters():
+    canonical = HawkDoveMultipleRiskModel.canonical_parameters
+    # adjustment options don't matter when adjustment is disabled
+    assert canonical(
+        {"grid_size": 10, "risk_adjustment": None, "adjust_payoff": "total"}
+    ) == canonical(
+        {"grid_size": 10, "risk_adjustment": "none", "adjust_payoff": "recent"}
+    )
+    assert canonical(
+        {"grid_size": 10, "risk_adjustment": "adopt", "adjust_payoff": "total"}
+    ) != canonical(
+        {"grid_size": 10, "risk_adjustment": "adopt", "adjust_payoff": "recent"}
+    )
+    # adjust neighborhood defaults to play neighborhood
+    assert canonical(
+        {"play_neighborhood": 4, "adjust_neighborhood": None}
+    ) == canonical({"play_neighborhood": 4, "adjust_neighborhood": 4})
+    # parameters are not modified
+    params = {"risk_adjustment": None, "adjust_every": 5}
+    canonical(params)
+    assert params == {"risk_adjustment": None, "adjust_every": 5}
 
 
 def test_total_rN_attr():
@@ -229,6 +377,7 @@ def test_total_rN_attr():
         Mock(risk_level=2),
         Mock(risk_level=2),
     ]
+    model.risk_level_counts = model.count_risk_levels()
     assert model.total_r0 == 1
     assert model.total_r1 == 2
     assert model.total_r2 == 3
@@ -245,6 +394,12 @@ def test_total_rN_attr():
     with pytest.raises(AttributeError):
         model.some_other_total
 
+    # risk levels outside the simulation range are not reported
+    model = HawkDoveMultipleRiskModel(3, include_endpoints=False)
+    assert model.total_r0 is None
+    assert model.total_r9 is None
+    assert model.total_r1 == model.risk_level_counts[1]
+
 
 def test_population_risk_category():
     model = HawkDoveMultipleRiskModel(3)
@@ -252,20 +407,21 @@ def test_population_risk_category():
 
     # majority risk inclined
     model.schedule.agents = [Mock(risk_level=0), Mock(risk_level=1), Mock(risk_level=2)]
+    model.risk_level_counts = model.count_risk_levels()
     assert model.population_risk_category == RiskState.c1
     # three risk-inclined agents and one risk moderate
-    del model.total_per_risk_level  #  reset cached property
     model.schedule.agents.append(Mock(risk_level=4))
+    model.risk_level_counts = model.count_risk_levels()
     assert model.population_risk_category == RiskState.c2
 
     # majority risk moderate
     model.schedule.agents = [Mock(risk_level=4), Mock(risk_level=5), Mock(risk_level=6)]
-    del model.total_per_risk_level  #  reset cached property
+    model.risk_level_counts = model.count_risk_levels()
     assert model.population_risk_category == RiskState.c7
 
     # majority risk avoidant
     model.schedule.agents = [Mock(risk_level=7), Mock(risk_level=8), Mock(risk_level=9)]
-    del model.total_per_risk_level  #  reset cached property
+    model.risk_level_counts = model.count_risk_levels()
     assert model.population_risk_category == RiskState.c12
 
 
@@ -282,7 +438,9 @@ def test_model_converged():
     # set min window smaller for testing purposes
     model.min_window = 3
     # convergence is based on rolling average percent hawk
-    model.recent_rolling_percent_hawk = [0.49, 0.48, 0.50, 0.47]
+    model.recent_rolling_percent_hawk = RollingWindow(
+        model.rolling_window, [0.49, 0.48, 0.50, 0.47]
+    )
     assert not model.converged
 
     # adjustment converge logic is different
@@ -447,6 +605,27 @@ def test_most_successful_neighbor():
         # neighbors 2 and 4 both have best recent points - should see both
         assert recent_best == {2, 4}
 
+    # payoffs may all be negative, depending on the payoff matrix
+    mock_neighbors = [
+        Mock(points=-12, recent_points=-3),
+        Mock(points=-4, recent_points=-5),
+    ]
+    with patch.object(HawkDoveMultipleRiskAgent, "adjust_neighbors", mock_neighbors):
+        assert agent_total.most_successful_neighbor.points == -4
+        assert agent_recent.most_successful_neighbor.recent_points == -3
+
+
+def test_adjust_risk_negative_payoffs():
+    # every payoff is negative; agents still adjust to their most
+    # successful neighbor
+    model = HawkDoveMultipleRiskModel(
+        10, payoff_matrix=((-3, -1), (-2, -1)), adjust_every=2, seed=1
+    )
+    for _ in range(6):
+        model.step()
+    assert model.max_agent_points < 0
+    assert model.risk_level_counts == model.count_risk_levels()
+
 
 def test_compare_payoff():
     # test payoff fields depending on model config (recent/total)
@@ -498,7 +677,11 @@ def test_agent_play_points():
 
 def test_agent_play_adjust():
     mock_model = Mock(
-        risk_adjustment="adopt", observed_neighborhood=4, max_risk_level=8
+        random=random.Random(),
+        risk_adjustment="adopt",
+        observed_neighborhood=4,
+        max_risk_level=8,
+        payoff_matrix=default_payoff_matrix,
     )
     agent = HawkDoveMultipleRiskAgent(1, mock_model)
     # simulate points from previous rounds
@@ -526,6 +709,7 @@ def test_agent_play_adjust():
 def test_adjust_risk_adopt_total():
     # initialize an agent with a mock model
     model = Mock(
+        random=random.Random(),
         risk_adjustment="adopt",
         observed_neighborhood=4,
         max_risk_level=8,
@@ -540,10 +724,14 @@ def test_adjust_risk_adopt_total():
     neighbor = HawkDoveMultipleRiskAgent(2, model)
     neighbor.risk_level = 3
     neighbor.points = 15000
+    # ignore count updates from setting up initial risk levels
+    model.update_risk_level_count.reset_mock()
     with patch.object(HawkDoveMultipleRiskAgent, "most_successful_neighbor", neighbor):
         agent.adjust_risk()
         # default behavior is to adopt successful risk level
         assert agent.risk_level == neighbor.risk_level
+        # model risk level counts should be updated
+        model.update_risk_level_count.assert_called_once_with(2, 3)
         agent.recent_points = 0
 
         # now simulate a wealthiest neighbor with fewer points than current agent
@@ -560,6 +748,7 @@ def test_adjust_risk_adopt_total():
 def test_adjust_risk_adopt_recent():
     # initialize an agent with a mock model
     model = Mock(
+        random=random.Random(),
         risk_adjustment="adopt",
         observed_neighborhood=4,
         max_risk_level=8,
@@ -599,7 +788,13 @@ def test_adjust_risk_adopt_recent():
 def test_adjust_risk_average():
     # same as previous test, but with average risk adjustment strategy
     agent = HawkDoveMultipleRiskAgent(
-        1, Mock(risk_adjustment="average", observed_neighborhood=4, max_risk_level=8)
+        1,
+        Mock(
+            random=random.Random(),
+            risk_adjustment="average",
+            observed_neighborhood=4,
+            max_risk_level=8,
+        ),
     )
     # set a known risk level
     agent.risk_level = 2
@@ -625,60 +820,70 @@ def test_risk_level_in_bounds():
     assert not model._risk_level_in_bounds(10)
 
 
-def test_get_risk_attitude_generator():
-    model = HawkDoveMultipleRiskModel(3)
-    model.random = Mock()
-
-    # check that the correct methods are called depending on risk distribution
-    model.risk_distribution = "uniform"
-    next(model.get_risk_attitude_generator())
-    model.random.randint.assert_called_with(model.min_risk_level, model.max_risk_level)
-
-    model.risk_distribution = "normal"
-    model.random.gauss.return_value = 3.3  # value to convert to int
-    next(model.get_risk_attitude_generator())
-    model.random.gauss.assert_called_with(4.5, 1.5)
-
-    model.risk_distribution = "skewed left"
-    model.random.triangular.return_value = 2.1  # value to round
-    next(model.get_risk_attitude_generator())
-    model.random.triangular.assert_called_with(
-        model.min_risk_level, model.max_risk_level, 0
-    )
+def test_sample_risk_attitudes():
+    model = HawkDoveMultipleRiskModel(3, seed=1)
+    sample = Mock(side_effect=lambda rng, size, low, high: [3, -1, 10.4, 4.4][:size])
 
-    model.risk_distribution = "skewed right"
-    model.random.triangular.return_value = 7.6  # value to round
-    next(model.get_risk_attitude_generator())
-    model.random.triangular.assert_called_with(
-        model.min_risk_level, model.max_risk_level, 9
-    )
+    # values out of range are dropped and sampled again
+    with patch.dict(risk_distributions, uniform=RiskDistribution(sample)):
+        assert model.sample_risk_attitudes(4).tolist() == [3, 4, 3, 3]
+    sample.assert_any_call(model.rng, 4, model.min_risk_level, model.max_risk_level)
+    # only sample as many values as are still needed
+    sample.assert_called_with(model.rng, 1, 0, 9)
+
+    # when clamp is set, out of range values are clamped to the range
+    with patch.dict(risk_distributions, uniform=RiskDistribution(sample, clamp=True)):
+        assert model.sample_risk_attitudes(4).tolist() == [3, 0, 9, 4]
 
-    # bimodal returns values from from two different distributions; call twice
-    model.risk_distribution = "bimodal"
-    model.random.gauss.return_value = 3.2
-    risk_gen = model.get_risk_attitude_generator()
-    next(risk_gen)
-    next(risk_gen)
-    model.random.gauss.assert_any_call(0, 1.5)
-    model.random.gauss.assert_any_call(9, 1.5)
 
-    # confirm that bimodal risk attitude generator honors min/max risk attitudes
+@pytest.mark.parametrize("risk_distribution", risk_distributions.keys())
+@pytest.mark.parametrize("include_endpoints", [True, False])
+def test_sample_risk_attitudes_distributions(risk_distribution, include_endpoints):
     model = HawkDoveMultipleRiskModel(
-        3, include_endpoints=False, risk_distribution="bimodal"
+        3,
+        risk_distribution=risk_distribution,
+        include_endpoints=include_endpoints,
+        seed=2,
     )
-    model.random = Mock()
-    model.random.gauss.return_value = 3.2
-    risk_gen = model.get_risk_attitude_generator()
-    next(risk_gen)
-    next(risk_gen)
-    model.random.gauss.assert_any_call(1, 1.5)
-    model.random.gauss.assert_any_call(8, 1.5)
+    levels = model.sample_risk_attitudes(1000)
+    assert len(levels) == 1000
+    assert levels.min() >= model.min_risk_level
+    assert levels.max() <= model.max_risk_level
+
+    mean = levels.mean()
+    if risk_distribution == "skewed left":
+        assert mean < 4
+    elif risk_distribution == "skewed right":
+        assert mean > 5
+    else:
+        assert 4 < mean < 5
+    if risk_distribution == "bimodal":
+        # alternates between values near min and max
+        assert levels[0::2].mean() < 2
+        assert levels[1::2].mean() > 7
+
+
+def test_register_risk_distribution():
+    with patch.dict(risk_distributions):
+
+        @register_risk_distribution("constant")
+        def constant_risk(rng, size, min_level, max_level):
+            return np.full(size, 3)
+
+        assert risk_distributions["constant"] == RiskDistribution(constant_risk)
+        model = HawkDoveMultipleRiskModel(3, risk_distribution="constant")
+        assert all(agent.risk_level == 3 for agent in model.schedule.agents)
+    assert "constant" not in risk_distributions
 
 
 def test_get_risk_attitude():
     model = HawkDoveMultipleRiskModel(3)
-    model.risk_attitude_generator = (x for x in [3, -1, -5, 4])
-    # should return value in range as-is
-    assert model.get_risk_attitude() == 3
-    # values out of range should be skipped and next valid value returned
-    assert model.get_risk_attitude() == 4
+    with patch.object(model, "sample_risk_attitudes") as mock_sample:
+        mock_sample.return_value = np.array([3, 4])
+        model.risk_attitude_generator = model.get_risk_attitude_generator()
+        # values are sampled in batches, one value for each agent
+        assert model.get_risk_attitude() == 3
+        mock_sample.assert_called_with(model.num_agents)
+        assert model.get_risk_attitude() == 4
+        assert model.get_risk_attitude() == 3
+        assert mock_sample.call_count == 2
@@ -0,0 +1,347 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from simulatingrisk.hawkdove.model import Play, neighborhood_offsets
+from simulatingrisk.hawkdovemulti.array_model import (
+    HawkDoveMultipleRiskArrayModel,
+    ReplicateBatch,
+)
+from simulatingrisk.hawkdovemulti.model import (
+    DataCollectionSchedule,
+    HawkDoveMultipleRiskModel,
+    RiskState,
+)
+
+
+def test_neighborhood_offsets():
+    assert len(neighborhood_offsets(4)) == 4
+    assert (1, 1) not in neighborhood_offsets(4)
+    assert len(neighborhood_offsets(8)) == 8
+    assert len(neighborhood_offsets(24)) == 24
+    for size in [4, 8, 24]:
+        assert (0, 0) not in neighborhood_offsets(size)
+    with pytest.raises(ValueError):
+        neighborhood_offsets(5)
+
+
+def test_init():
+    model = HawkDoveMultipleRiskArrayModel(5, hawk_odds=0.3, adjust_every=5)
+    assert model.num_agents == 25
+    assert model.adjust_round_n == 5
+    for values in [model.choice, model.risk_level, model.points, model.recent_points]:
+        assert values.shape == (5, 5)
+    assert model.points.sum() == 0
+    assert model.risk_level.min() >= model.min_risk_level
+    assert model.risk_level.max() <= model.max_risk_level
+    # no agent objects
+    assert model.schedule.agents == []
+
+
+def test_sparse_update_unsupported():
+    with pytest.raises(ValueError, match="not supported"):
+        HawkDoveMultipleRiskArrayModel(5, sparse_update=True)
+
+
+def test_initial_choice_hawkodds():
+    model = HawkDoveMultipleRiskArrayModel(100, hawk_odds=0.3)
+    assert np.isclose(model.percent_hawk, 0.3, rtol=0.1)
+
+
+def test_step_matches_agent_model():
+    # copy state from the agent-based model into the array model and
+    # confirm that both choose and play the same way
+    opts = {
+        "risk_adjustment": None,
+        "random_play_odds": 0,
+        "play_neighborhood": 4,
+        "observed_neighborhood": 24,
+    }
+    model = HawkDoveMultipleRiskModel(6, **opts)
+    array_model = HawkDoveMultipleRiskArrayModel(6, **opts)
+    for agent in model.schedule.agents:
+        array_model.risk_level[agent.pos] = agent.risk_level
+        array_model.choice[agent.pos] = agent.choice
+
+    for _ in range(3):
+        model.step()
+        array_model.step()
+        for agent in model.schedule.agents:
+            assert array_model.choice[agent.pos] == agent.choice
+            assert array_model.points[agent.pos] == agent.points
+            assert array_model.hawk_count[agent.pos] == agent.hawk_count
+        assert array_model.percent_hawk == model.percent_hawk
+        assert array_model.max_agent_points == model.max_agent_points
+
+
+def test_profile():
+    model = HawkDoveMultipleRiskArrayModel(
+        5, risk_adjustment="adopt", adjust_every=2, profile=True
+    )
+    for _ in range(4):
+        model.step()
+    assert set(model.profile.times) == set(model.profile_sections)
+    assert model.profile.calls["play"] == 4
+    assert model.profile.calls["adjust_risk"] == 1
+
+
+@pytest.mark.parametrize(
+    "opts",
+    [
+        # converges at different steps, without adjustment
+        {"risk_adjustment": None, "random_play_odds": 0},
+        {
+            "risk_adjustment": "average",
+            "adjust_every": 2,
+            "adjust_payoff": "total",
+            "play_neighborhood": 4,
+            "adjust_neighborhood": 24,
+        },
+    ],
+)
+def test_replicate_batch(opts):
+    def new_model(seed):
+        return HawkDoveMultipleRiskArrayModel(
+            5,
+            seed=seed,
+            data_collection_schedule=DataCollectionSchedule.ALL,
+            collect_agent_data=True,
+            **opts,
+        )
+
+    seeds = range(6)
+    batch = ReplicateBatch([new_model(seed) for seed in seeds])
+    models = batch.models
+    while batch.running and batch.steps < 80:
+        batch.step()
+        assert batch.choice.shape == (len(batch.models), 5, 5)
+
+    # each replicate has the same results as running the model alone
+    for seed, model in zip(seeds, models):
+        solo_model = new_model(seed)
+        while solo_model.running and solo_model.schedule.steps < 80:
+            solo_model.step()
+        assert model.schedule.steps == solo_model.schedule.steps
+        assert model.status == solo_model.status
+        assert model.datacollector.model_vars == solo_model.datacollector.model_vars
+        agent_columns = model.datacollector.get_agent_columns()
+        for name, values in solo_model.datacollector.get_agent_columns().items():
+            assert (agent_columns[name] == values).all()
+
+    if opts["risk_adjustment"] is None:
+        # replicates are dropped from the batch when they converge
+        assert not batch.running
+        assert len({model.schedule.steps for model in models}) > 1
+
+    with pytest.raises(ValueError, match="at least one model"):
+        ReplicateBatch([])
+
+
+def test_play_payoff_matrix():
+    model = HawkDoveMultipleRiskArrayModel(
+        3, play_neighborhood=4, payoff_matrix=((0, 3.5), (1, 2))
+    )
+    model.choice[:] = Play.DOVE
+    model.choice[1, 1] = Play.HAWK
+    model.play()
+    # hawk surrounded by four doves
+    assert model.points[1, 1] == 3.5 * 4
+    # dove next to the hawk: 1 against hawk, 2 against each of three doves
+    assert model.points[0, 1] == 1 + 2 * 3
+    # dove with no hawk neighbors
+    assert model.points[0, 0] == 2 * 4
+    assert model.max_agent_points == 14.0
+
+
+def test_adjust_risk():
+    model = HawkDoveMultipleRiskArrayModel(
+        3, risk_adjustment="adopt", play_neighborhood=4, adjust_neighborhood=4
+    )
+    model.risk_level[:] = 2
+    model.risk_level[1, 1] = 7
+    model.risk_level_counts = model.count_risk_levels()
+    model.recent_points[:] = 1
+    model.recent_points[0, 1] = 5
+    # center agent adjusts first, before any neighbors have adjusted
+    model.activation_order = np.array([[1, 2, 3], [4, 0, 5], [6, 7, 8]])
+    model.adjust_risk()
+    # center agent adopts risk level of its most successful neighbor
+    assert model.risk_level[1, 1] == 2
+    assert model.risk_level_changed[1, 1]
+    # other neighbors already have the same risk level; unchanged
+    assert model.risk_level[0, 1] == 2
+    assert not model.risk_level_changed[0, 0]
+    assert model.num_agents_risk_changed == 1
+    assert model.risk_level_counts == model.count_risk_levels()
+
+    model.risk_adjustment = "average"
+    model.risk_level[1, 1] = 7
+    model.risk_level_counts = model.count_risk_levels()
+    model.adjust_risk()
+    # round average half to even: (7 + 2) / 2 = 4.5 -> 4
+    assert model.risk_level[1, 1] == 4
+    assert model.risk_level_counts == model.count_risk_levels()
+
+    # when the most successful neighbor adjusts first, it has already
+    # reset its recent points, like agents in the agent-based model
+    model.risk_level[1, 1] = 7
+    model.risk_level_counts = model.count_risk_levels()
+    model.activation_order = np.array([[1, 0, 3], [4, 2, 5], [6, 7, 8]])
+    model.adjust_risk()
+    assert model.risk_level[1, 1] == 7
+    assert not model.risk_level_changed[1, 1]
+
+
+class FirstTiedNeighbor:
+    """random generator stand-in for the array model that always chooses
+    the first of several tied neighbors"""
+
+    def random(self, shape):
+        return np.zeros(shape)
+
+
+@pytest.mark.parametrize(
+    "adjust_opts",
+    [
+        {"risk_adjustment": "adopt", "adjust_payoff": "recent"},
+        {"risk_adjustment": "adopt", "adjust_payoff": "total"},
+        {
+            "risk_adjustment": "average",
+            "adjust_payoff": "recent",
+            "adjust_neighborhood": 24,
+        },
+    ],
+)
+def test_adjust_risk_matches_agent_model(adjust_opts, monkeypatch):
+    # copy state and activation order from the agent-based model into the
+    # array model and confirm that both adjust risk attitudes the same way
+    # seeded, so some agents adjust their risk attitude
+    opts = {"random_play_odds": 0, "adjust_every": 2, **adjust_opts}
+    model = HawkDoveMultipleRiskModel(8, seed=0, **opts)
+    array_model = HawkDoveMultipleRiskArrayModel(8, **opts)
+    for agent in model.schedule.agents:
+        array_model.risk_level[agent.pos] = agent.risk_level
+        array_model.choice[agent.pos] = agent.choice
+        array_model.activation_order[agent.pos] = agent.unique_id
+    array_model.risk_level_counts = array_model.count_risk_levels()
+    # both models choose the first of tied neighbors, in neighbor order
+    monkeypatch.setattr(model.random, "choice", lambda neighbors: neighbors[0])
+    array_model.rng = FirstTiedNeighbor()
+
+    total_changed = 0
+    for _ in range(12):
+        model.step()
+        array_model.step()
+        for agent in model.schedule.agents:
+            assert array_model.risk_level[agent.pos] == agent.risk_level
+            assert array_model.risk_level_changed[agent.pos] == agent.risk_level_changed
+            assert array_model.points[agent.pos] == agent.points
+            assert array_model.recent_points[agent.pos] == agent.recent_points
+        assert array_model.risk_level_counts == model.risk_level_counts
+        total_changed += model.num_agents_risk_changed
+    assert total_changed > 0
+
+
+@pytest.mark.parametrize("adjust_payoff", ["recent", "total"])
+def test_replicate_batch_matches_agent_model(adjust_payoff, monkeypatch):
+    # copy state from several agent-based models into a replicate batch
+    # and confirm that each replicate adjusts like its agent-based model
+    opts = {
+        "random_play_odds": 0,
+        "risk_adjustment": "adopt",
+        "adjust_every": 2,
+        "adjust_payoff": adjust_payoff,
+    }
+    models = [HawkDoveMultipleRiskModel(8, seed=seed, **opts) for seed in range(3)]
+    array_models = []
+    for model in models:
+        array_model = HawkDoveMultipleRiskArrayModel(8, **opts)
+        for agent in model.schedule.agents:
+            array_model.risk_level[agent.pos] = agent.risk_level
+            array_model.choice[agent.pos] = agent.choice
+            array_model.activation_order[agent.pos] = agent.unique_id
+        array_model.risk_level_counts = array_model.count_risk_levels()
+        array_model.rng = FirstTiedNeighbor()
+        monkeypatch.setattr(model.random, "choice", lambda neighbors: neighbors[0])
+        array_models.append(array_model)
+    batch = ReplicateBatch(array_models)
+
+    total_changed = 0
+    for _ in range(12):
+        batch.step()
+        for model, array_model in zip(models, array_models):
+            model.step()
+            for agent in model.schedule.agents:
+                assert array_model.risk_level[agent.pos] == agent.risk_level
+                assert array_model.points[agent.pos] == agent.points
+                assert array_model.recent_points[agent.pos] == agent.recent_points
+            assert array_model.risk_level_counts == model.risk_level_counts
+            assert array_model.num_agents_risk_changed == model.num_agents_risk_changed
+            total_changed += model.num_agents_risk_changed
+    assert total_changed > 0
+
+
+def test_outcomes_match_agent_model():
+    # seeded runs differ, but outcomes are distributed the same way
+    outcomes = {}
+    for model_class in [HawkDoveMultipleRiskModel, HawkDoveMultipleRiskArrayModel]:
+        categories = Counter()
+        risk_inclined = []
+        for seed in range(10):
+            model = model_class(10, adjust_payoff="recent", seed=seed)
+            for _ in range(50):
+                model.step()
+            categories[model.population_risk_category] += 1
+            risk_inclined.append(sum(model.risk_level_counts[:3]) / model.num_agents)
+        outcomes[model_class] = (categories, np.mean(risk_inclined))
+
+    agent_categories, agent_risk_inclined = outcomes[HawkDoveMultipleRiskModel]
+    array_categories, array_risk_inclined = outcomes[HawkDoveMultipleRiskArrayModel]
+    # most runs end with no clear majority (category 13) with either model
+    assert agent_categories[RiskState.c13] > 5
+    assert array_categories[RiskState.c13] > 5
+    assert abs(array_risk_inclined - agent_risk_inclined) < 0.1
+
+
+def test_total_per_risk_level():
+    model = HawkDoveMultipleRiskArrayModel(3)
+    model.risk_level = np.array([[0, 1, 1], [2, 2, 2], [5, 5, 9]])
+    model.risk_level_counts = model.count_risk_levels()
+    totals = model.total_per_risk_level
+    assert isinstance(totals, Counter)
+    assert totals[2] == 3
+    assert totals[4] == 0
+    assert model.total_r5 == 2
+    assert model.total_r8 == 0
+
+
+def test_data_collection():
+    model = HawkDoveMultipleRiskArrayModel(
+        4, data_collection_schedule=DataCollectionSchedule.ALL
+    )
+    agent_model = HawkDoveMultipleRiskModel(4)
+    model.step()
+    # same model and agent reporters as the agent-based model
+    assert model.datacollector.model_vars.keys() == (
+        agent_model.datacollector.model_vars.keys()
+    )
+    assert (
+        model.datacollector.agent_reporters.keys()
+        == agent_model.datacollector.agent_reporters.keys()
+    )
+    assert model.datacollector.model_vars["total_agents"] == [16]
+    assert model.datacollector.collect_time > 0
+    columns = model.datacollector.agent_columns[1]
+    assert len(columns["AgentID"]) == 16
+    assert columns["AgentID"][5] == 5
+    assert columns["risk_level"][5] == model.risk_level.ravel()[5]
+    assert columns["choice"][5] in {"hawk", "dove"}
+    assert columns["points"][5] == model.points.ravel()[5]
+    # recorded values are not changed by later steps
+    recorded_points = columns["points"].copy()
+    model.step()
+    assert (model.datacollector.agent_columns[1]["points"] == recorded_points).all()
+
+    agent_df = model.datacollector.get_agent_vars_dataframe()
+    assert len(agent_df) == 32
@@ -1,5 +1,36 @@
-from simulatingrisk.hawkdovemulti.batch_run import run_hawkdovemulti_model
-from simulatingrisk.hawkdovemulti.model import DataCollectionSchedule
+import csv
+import itertools
+import time
+
+import pytest
+
+from simulatingrisk.hawkdovemulti.array_model import HawkDoveMultipleRiskArrayModel
+from simulatingrisk.hawkdovemulti.batch_run import (
+    AdaptiveIterations,
+    ParquetResultWriter,
+    RunArgs,
+    RunCostModel,
+    RunManifest,
+    RunResult,
+    RunStatsWriter,
+    batch_run,
+    get_param_combinations,
+    make_chunks,
+    max_chunk_size,
+    max_chunk_timeout,
+    plan_param_grid,
+    run_chunks,
+    run_hawkdovemulti_chunk,
+    run_hawkdovemulti_model,
+    run_key,
+    run_seed,
+    simulate,
+    simulate_replicates,
+)
+from simulatingrisk.hawkdovemulti.model import (
+    DataCollectionSchedule,
+    HawkDoveMultipleRiskModel,
+)
 
 
 def test_run_hawkdovemulti_model_output_columns_end():
@@ -131,17 +162,30 @@ def test_run_hawkdovemulti_model_agent_data_columns():
     )
     _, agent_data = run_hawkdovemulti_model(args)
     assert agent_data is not None
-    assert len(agent_data) > 0
-    row = agent_data[0]
-    assert row["RunId"] == 4
-    assert row["iteration"] == 1
+    # agent data is returned as columns
+    assert list(agent_data.keys()) == [
+        "RunId",
+        "iteration",
+        "Step",
+        "AgentID",
+        "risk_level",
+        "choice",
+        "points",
+        "hawk_count",
+        "risk_level_changed",
+    ]
+    assert len(agent_data["AgentID"]) > 0
+    assert agent_data["RunId"][0] == 4
+    assert agent_data["iteration"][0] == 1
     # params not included in agent data
     for key in params.keys():
-        assert key not in row
+        assert key not in agent_data
 
     # Step should be 0-based
-    step_values = {r["Step"] for r in agent_data}
+    step_values = set(agent_data["Step"].tolist())
     assert min(step_values) == 0
+    # one row per agent for every step
+    assert len(agent_data["AgentID"]) == 9 * len(step_values)
 
 
 def test_run_hawkdovemulti_model_no_duplicate_final_row():
@@ -183,3 +227,746 @@ def test_run_hawkdovemulti_model_end_mode_has_final_row():
     model_data, _ = run_hawkdovemulti_model(args)
     # exactly one row for END mode
     assert len(model_data) == 1
+
+
+def test_run_hawkdovemulti_model_numpy_engine():
+    # array-backed engine should produce the same output columns
+    max_steps = 5
+    params = {"grid_size": 5, "risk_adjustment": "adopt", "adjust_every": 2}
+    args = (0, 0, params, max_steps, DataCollectionSchedule.ALL, True)
+    model_data, agent_data = run_hawkdovemulti_model(args)
+    array_model_data, array_agent_data = run_hawkdovemulti_model(
+        RunArgs(*args, engine="numpy")
+    )
+    assert len(array_model_data) == len(model_data)
+    assert array_model_data[0].keys() == model_data[0].keys()
+    assert array_agent_data.keys() == agent_data.keys()
+    assert len(array_agent_data["AgentID"]) == len(agent_data["AgentID"])
+
+
+def test_run_seed():
+    assert run_seed(123, 0) == run_seed(123, 0)
+    seeds = {run_seed(123, run_id) for run_id in range(100)}
+    assert len(seeds) == 100
+    assert run_seed(123, 0) != run_seed(124, 0)
+
+
+@pytest.mark.parametrize("engine", ["mesa", "numpy"])
+def test_run_hawkdovemulti_model_seed(engine):
+    # runs with the same seed should produce identical results
+    params = {
+        "grid_size": 5,
+        "risk_adjustment": "adopt",
+        "adjust_every": 2,
+        "random_play_odds": 0.1,
+    }
+    args = RunArgs(
+        0, 0, params, 10, DataCollectionSchedule.ALL, True, engine, seed=run_seed(1, 0)
+    )
+    model_data, agent_data = run_hawkdovemulti_model(args)
+    assert model_data[0]["seed"] == args.seed
+    repeat_model_data, repeat_agent_data = run_hawkdovemulti_model(args)
+    assert repeat_model_data == model_data
+    for name, values in agent_data.items():
+        assert (repeat_agent_data[name] == values).all()
+
+
+def test_run_hawkdovemulti_chunk():
+    params = {"grid_size": 5, "risk_adjustment": "adopt", "adjust_every": 2}
+    runs = [
+        RunArgs(i, i, params, 5, DataCollectionSchedule.ADJUST, True, seed=i)
+        for i in range(3)
+    ]
+    results = run_hawkdovemulti_chunk(runs)
+    assert [result.run_id for result in results] == [0, 1, 2]
+    for run, result in zip(runs, results):
+        # compact results don't include run parameters
+        assert "grid_size" not in result.model_vars
+        assert result.elapsed > 0
+        assert result.total_steps == 6
+        assert result.peak_memory > 0
+        assert not result.failed
+        assert not result.converged
+        assert result.pid > 0
+        # time is divided between model setup, steps, and data collection
+        assert result.step_time > 0
+        assert result.collect_time > 0
+        assert result.elapsed == pytest.approx(
+            result.setup_time + result.step_time + result.collect_time
+        )
+        # same output as running individually when combined with run args
+        model_data, agent_data = run_hawkdovemulti_model(run)
+        assert result.model_rows(run) == model_data
+        for name, values in result.agent_data(run).items():
+            assert (agent_data[name] == values).all()
+
+
+def test_simulate_profile():
+    params = {"grid_size": 5, "risk_adjustment": "adopt"}
+    run = RunArgs(0, 0, params, 5, DataCollectionSchedule.END, False, seed=1)
+    assert simulate(run).step_profile is None
+    result = simulate(run._replace(profile=True))
+    # all sections are included, even if they didn't run (no adjustment rounds)
+    assert tuple(result.step_profile) == HawkDoveMultipleRiskModel.profile_sections
+    assert result.step_profile["adjust_risk"] == 0
+    assert sum(result.step_profile.values()) <= result.step_time + result.collect_time
+
+
+def test_simulate_sparse_update():
+    params = {"grid_size": 6, "risk_adjustment": "adopt", "adjust_every": 2}
+    run = RunArgs(0, 0, params, 12, DataCollectionSchedule.ALL, True, seed=1)
+    result = simulate(run)
+    sparse_result = simulate(run._replace(sparse_update=True))
+    assert sparse_result.model_rows(run) == result.model_rows(run)
+    for name, values in sparse_result.agent_data(run).items():
+        assert (result.agent_data(run)[name] == values).all()
+
+
+@pytest.fixture
+def growing_memory(monkeypatch):
+    """simulate worker memory that grows by more than one MB each time
+    it is checked"""
+    memory = itertools.count(100 * 1024**2, 1024**2 + 1)
+    monkeypatch.setattr(
+        "simulatingrisk.hawkdovemulti.batch_run.current_memory", lambda: next(memory)
+    )
+
+
+def test_simulate_memory_limit(monkeypatch):
+    params = {"grid_size": 5, "risk_adjustment": "adopt"}
+    run = RunArgs(0, 0, params, 5, DataCollectionSchedule.ALL, True, seed=1)
+    assert not simulate(run).failed
+    # memory held by the worker before the run starts is not counted
+    monkeypatch.setattr(
+        "simulatingrisk.hawkdovemulti.batch_run.current_memory", lambda: 500 * 1024**2
+    )
+    assert not simulate(run._replace(memory_limit=1024**2)).failed
+
+
+def test_simulate_memory_limit_exceeded(growing_memory):
+    params = {"grid_size": 5, "risk_adjustment": "adopt"}
+    run = RunArgs(0, 0, params, 5, DataCollectionSchedule.ALL, True, seed=1)
+    result = simulate(run._replace(memory_limit=1024**2))
+    assert result.failed
+    assert result.total_steps == 0
+    assert result.peak_memory > 101 * 1024**2
+    # failed runs have no model or agent data
+    assert result.model_rows(run) == []
+    assert result.agent_data(run) is None
+
+
+def interrupt_after(step, steps):
+    """step method that raises a keyboard interrupt after a number of steps"""
+
+    def interrupted_step(self):
+        if self.schedule.steps >= steps:
+            raise KeyboardInterrupt
+        step(self)
+
+    return interrupted_step
+
+
+def test_simulate_interrupted(monkeypatch):
+    params = {"grid_size": 5, "risk_adjustment": "adopt"}
+    run = RunArgs(0, 0, params, 10, DataCollectionSchedule.ALL, False, seed=1)
+    assert not simulate(run).interrupted
+    monkeypatch.setattr(
+        HawkDoveMultipleRiskModel,
+        "step",
+        interrupt_after(HawkDoveMultipleRiskModel.step, 3),
+    )
+    result = simulate(run)
+    # partial results are returned, but flagged as interrupted
+    assert result.interrupted
+    assert not result.failed
+    assert result.total_steps == 3
+    assert result.steps == [0, 1, 2]
+
+
+def test_simulate_replicates(monkeypatch):
+    params = {"grid_size": 5, "risk_adjustment": "adopt", "adjust_every": 2}
+    runs = [
+        RunArgs(
+            i, i, params, 8, DataCollectionSchedule.ADJUST, True, "numpy-batched", i
+        )
+        for i in range(4)
+    ]
+    results = simulate_replicates(runs)
+    assert [result.run_id for result in results] == [0, 1, 2, 3]
+    for run, result in zip(runs, results):
+        assert result.total_steps == 9
+        assert not result.failed
+        assert result.elapsed == pytest.approx(
+            result.setup_time + result.step_time + result.collect_time
+        )
+        # same output as running individually with the numpy engine
+        model_data, agent_data = run_hawkdovemulti_model(run._replace(engine="numpy"))
+        assert result.model_rows(run) == model_data
+        for name, values in result.agent_data(run).items():
+            assert (agent_data[name] == values).all()
+
+    # runs still running when interrupted are flagged as interrupted
+    monkeypatch.setattr(
+        HawkDoveMultipleRiskArrayModel,
+        "start_step",
+        interrupt_after(HawkDoveMultipleRiskArrayModel.start_step, 4),
+    )
+    results = simulate_replicates(runs)
+    assert all(result.interrupted and result.total_steps == 4 for result in results)
+    monkeypatch.undo()
+
+    # all runs in the batch fail when over the memory limit
+    monkeypatch.setattr(
+        "simulatingrisk.hawkdovemulti.batch_run.current_memory",
+        itertools.count(0, 1024**2 + 1).__next__,
+    )
+    runs = [run._replace(memory_limit=1024**2) for run in runs]
+    results = simulate_replicates(runs)
+    assert all(result.failed and result.total_steps == 0 for result in results)
+
+
+def test_run_hawkdovemulti_chunk_replicates():
+    # runs with the batched engine are grouped by parameters
+    runs = [
+        RunArgs(
+            i,
+            i,
+            {"grid_size": 5, "hawk_odds": 0.25 * (i % 2 + 1)},
+            3,
+            DataCollectionSchedule.END,
+            False,
+            "numpy-batched",
+            i,
+        )
+        for i in range(5)
+    ]
+    results = run_hawkdovemulti_chunk(runs)
+    assert [result.run_id for result in results] == [0, 2, 4, 1, 3]
+    for result in results:
+        run = runs[result.run_id]
+        model_data, _ = run_hawkdovemulti_model(run._replace(engine="numpy"))
+        assert result.model_rows(run) == model_data
+
+
+def test_make_chunks():
+    params = {"grid_size": 5}
+    runs = [RunArgs(i, 0, params, 10, None, False) for i in range(200)]
+    # equal costs: about four chunks per process, up to max chunk size
+    costs = {run.run_id: 1 for run in runs}
+    chunks = make_chunks(runs, costs, 5, None)
+    assert len(chunks) == 20
+    assert all(len(chunk) == 10 for chunk in chunks)
+    assert len(make_chunks(runs, costs, 1, None)) == 200 / max_chunk_size
+    # fixed chunk size
+    assert [len(chunk) for chunk in make_chunks(runs[:5], costs, 5, 2)] == [2, 2, 1]
+
+    # most expensive runs first; expensive runs are sent individually
+    costs = {run.run_id: 100 if run.run_id < 4 else 1 for run in runs}
+    chunks = make_chunks(runs, costs, 2, None)
+    assert [run.run_id for run in chunks[0]] == [0]
+    assert {chunk[0].run_id for chunk in chunks[:4]} == {0, 1, 2, 3}
+    assert len(chunks[4]) > 1
+
+
+def test_run_cost_model(tmp_path):
+    cost_model = RunCostModel(max_steps=1000)
+    small = {"grid_size": 10, "risk_adjustment": None}
+    large = {"grid_size": 50, "risk_adjustment": "adopt", "adjust_every": 2}
+    assert cost_model.expected_steps(small) == 50
+    assert cost_model.expected_steps(large) == 304
+    assert cost_model.cost(large) > cost_model.cost(small) * 25
+    # bigger neighborhoods are more expensive
+    assert cost_model.cost(small | {"play_neighborhood": 24}) > cost_model.cost(small)
+    # expected steps are limited by max steps
+    assert RunCostModel(max_steps=100).expected_steps(large) == 101
+
+    # calibrate from previous output
+    model_file = tmp_path / "test_model.csv"
+    with open(model_file, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["RunId", "iteration", "Step", "grid_size", "risk_adjustment"])
+        writer.writerow([0, 0, 60, 10, ""])
+        writer.writerow([1, 1, 100, 10, ""])
+        writer.writerow([2, 0, 20, 50, "adopt"])
+    assert cost_model.calibrate([model_file]) == 3
+    assert cost_model.expected_steps(small) == 80
+    # no previous runs with these parameters
+    assert cost_model.expected_steps(large) == 304
+
+
+def test_run_cost_model_calibrate_parquet_unavailable(tmp_path, monkeypatch):
+    # pyarrow is optional; reading parquet output requires it
+    monkeypatch.setattr("simulatingrisk.hawkdovemulti.batch_run.pq", None)
+    with pytest.raises(ValueError, match="requires pyarrow"):
+        RunCostModel(max_steps=10).calibrate([tmp_path / "test_model"])
+
+
+def test_plan_param_grid():
+    param_combinations = [
+        {"grid_size": 3, "risk_adjustment": "adopt", "play_neighborhood": 24},
+        {"grid_size": 10, "risk_adjustment": None, "adjust_payoff": "recent"},
+        {"grid_size": 10, "risk_adjustment": None, "adjust_payoff": "total"},
+        {"grid_size": 10, "risk_adjustment": "adopt", "adjust_payoff": "recent"},
+        {"grid_size": 10, "risk_adjustment": "adopt", "adjust_payoff": "total"},
+    ]
+    plan = plan_param_grid(
+        param_combinations, HawkDoveMultipleRiskModel, DataCollectionSchedule.END
+    )
+    assert plan.total == 5
+    assert plan.duplicates == 1
+    assert plan.invalid == {"Play neighborhood 24 is too large for grid size 3": 1}
+    # first of equivalent combinations is kept as specified
+    assert plan.combinations == param_combinations[1:2] + param_combinations[3:]
+    assert plan.summary(iterations=10).startswith(
+        "Skipping 2 of 5 parameter combinations (40.0%, 20 runs): "
+        + "1 duplicate, 1 invalid"
+    )
+
+    # adjustment rounds can't be collected when adjustment is disabled
+    plan = plan_param_grid(
+        param_combinations, HawkDoveMultipleRiskModel, DataCollectionSchedule.ADJUST
+    )
+    assert len(plan.combinations) == 2
+    assert plan.invalid.total() == 3
+
+
+def test_get_param_combinations():
+    run_params = {
+        "grid_size": 10,
+        "risk_adjustment": [None, "adopt"],
+        "adjust_payoff": ["recent", "total"],
+    }
+    # all combinations are run unless dedupe is requested
+    combinations = get_param_combinations(run_params, 2, DataCollectionSchedule.END)
+    assert len(combinations) == 4
+    combinations = get_param_combinations(
+        run_params, 2, DataCollectionSchedule.END, dedupe=True
+    )
+    assert len(combinations) == 3
+
+
+def test_parquet_result_writer(tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(ParquetResultWriter, "model_rows_per_group", 2)
+    monkeypatch.setattr(ParquetResultWriter, "model_rows_per_part", 5)
+    param_combinations = [{"grid_size": 3}]
+    writer = ParquetResultWriter(tmp_path, "test", False, param_combinations)
+    model_dir = tmp_path / "test_model"
+
+    def model_data(run_id):
+        return [{"RunId": run_id, "Step": step, "grid_size": 3} for step in range(2)]
+
+    # rows are written to the current part file as row groups, but the
+    # part is not saved until it is finished
+    assert writer.write(model_data(0), None) == []
+    assert writer.model_writer.buffered_rows == 0
+    assert writer.write(model_data(1), None) == []
+    assert list(model_dir.glob("part-*.parquet")) == []
+    # unfinished parts are ignored when reading the dataset
+    assert pq.read_table(model_dir).num_rows == 0
+    assert writer.write(model_data(2), None) == [0, 1, 2]
+    (part_path,) = model_dir.glob("part-*.parquet")
+    part = pq.ParquetFile(part_path)
+    assert part.metadata.num_rows == 6
+    assert part.metadata.num_row_groups == 3
+
+    assert writer.write(model_data(3), None) == []
+    assert writer.close() == [3]
+    run_ids = pq.read_table(model_dir).column("RunId").to_pylist()
+    assert run_ids == [0, 0, 1, 1, 2, 2, 3, 3]
+    assert list(model_dir.glob("_part-*")) == []
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_batch_run_output(output_format, tmp_path, monkeypatch):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+        # write model data in multiple parts
+        monkeypatch.setattr(ParquetResultWriter, "model_rows_per_part", 3)
+    # batch run writes to data/<param set>/ relative to current directory
+    monkeypatch.chdir(tmp_path)
+    test_params = {
+        "test": {
+            "grid_size": 5,
+            "risk_adjustment": ["adopt", None],
+            "hawk_odds": [0.5, 0.25],
+        }
+    }
+    batch_run(
+        test_params,
+        iterations=2,
+        number_processes=1,
+        max_steps=3,
+        progressbar=False,
+        file_prefix="test_",
+        max_runs=None,
+        param_choice="test",
+        data_collection_schedule=DataCollectionSchedule.END,
+        collect_agent_data=True,
+        output_format=output_format,
+        chunk_size=3,
+    )
+    data_dir = tmp_path / "data" / "test"
+    if output_format == "csv":
+        (model_file,) = data_dir.glob("test_*_model.csv")
+        (agent_file,) = data_dir.glob("test_*_agent.csv")
+        with open(model_file) as model_csv:
+            model_rows = list(csv.DictReader(model_csv))
+        assert len(model_rows) == 8
+        assert model_rows[0]["grid_size"] == "5"
+        with open(agent_file) as agent_csv:
+            assert len(list(csv.DictReader(agent_csv))) == 8 * 25
+        # output can be used to calibrate run cost estimates
+        assert RunCostModel(max_steps=3).calibrate([model_file]) == 8
+    else:
+        import pyarrow.parquet as pq
+
+        (model_dir,) = data_dir.glob("test_*_model")
+        (agent_dir,) = data_dir.glob("test_*_agent")
+        assert len(list(model_dir.glob("part-*.parquet"))) == 3
+        model_table = pq.read_table(model_dir)
+        assert model_table.num_rows == 8
+        # parameters are stored as typed columns
+        assert str(model_table.schema.field("grid_size").type) == "int64"
+        assert str(model_table.schema.field("hawk_odds").type) == "double"
+        assert str(model_table.schema.field("risk_adjustment").type) == "string"
+        assert model_table.column("risk_adjustment").null_count == 4
+        assert str(model_table.schema.field("status").type) == "string"
+        agent_table = pq.read_table(agent_dir)
+        assert agent_table.num_rows == 8 * 25
+        assert str(agent_table.schema.field("risk_level_changed").type) == "bool"
+        assert RunCostModel(max_steps=3).calibrate([model_dir]) == 8
+    # runtime, memory, and steps for each run are saved alongside results
+    (stats_file,) = data_dir.glob("test_*_runs.csv")
+    with open(stats_file) as stats_csv:
+        run_stats = list(csv.DictReader(stats_csv))
+    assert sorted(int(row["RunId"]) for row in run_stats) == list(range(8))
+    assert run_stats[0]["failed"] == "False"
+    assert run_stats[0]["converged"] == "False"
+    assert run_stats[0]["total_steps"] == "4"
+    assert float(run_stats[0]["step_time"]) > 0
+    assert float(run_stats[0]["peak_memory_mb"]) > 0
+    assert run_stats[0]["grid_size"] == "5"
+
+
+def test_run_stats_summary(tmp_path):
+    param_combinations = [
+        {"grid_size": 10, "hawk_odds": 0.5},
+        {"grid_size": 20, "hawk_odds": 0.5},
+    ]
+    with RunStatsWriter(tmp_path, "test", param_combinations) as run_stats:
+        assert run_stats.varied_params == {"grid_size": ["10", "20"]}
+        for run_id, params in enumerate(param_combinations):
+            run_stats.write(
+                RunResult(
+                    run_id,
+                    [],
+                    {},
+                    None,
+                    elapsed=1.0 + run_id * 2,
+                    total_steps=100,
+                    converged=run_id == 0,
+                    setup_time=0.5,
+                    step_time=0.5 + run_id * 2,
+                ),
+                RunArgs(run_id, 0, params, 100, DataCollectionSchedule.END, False),
+            )
+    # a row is saved for each run
+    with open(run_stats.path) as stats_csv:
+        assert len(list(csv.DictReader(stats_csv))) == 2
+    summary = run_stats.summary()
+    assert "2 runs: 1 converged, 1 reached max steps, 0 failed" in summary
+    assert "Simulation time 4.0s (25% setup, 75% steps, 0% data collection)" in summary
+    assert "grid_size: 10=1.000s, 20=3.000s" in summary
+    # parameters with a single value are not summarized
+    assert "hawk_odds" not in summary
+
+
+def test_batch_run_memory_limit(tmp_path, monkeypatch, capsys, growing_memory):
+    monkeypatch.chdir(tmp_path)
+    batch_run(
+        {"test": {"grid_size": 3, "hawk_odds": [0.5, 0.25]}},
+        iterations=2,
+        number_processes=1,
+        max_steps=3,
+        progressbar=False,
+        file_prefix="",
+        max_runs=None,
+        param_choice="test",
+        data_collection_schedule=DataCollectionSchedule.END,
+        collect_agent_data=False,
+        memory_limit=1,
+    )
+    # all runs are over the limit; batch run continues and records failures
+    assert "4 runs failed by going over the memory limit" in capsys.readouterr().out
+    data_dir = tmp_path / "data" / "test"
+    (stats_file,) = data_dir.glob("*_runs.csv")
+    with open(stats_file) as stats_csv:
+        run_stats = list(csv.DictReader(stats_csv))
+    assert len(run_stats) == 4
+    assert all(row["failed"] == "True" for row in run_stats)
+    assert {row["hawk_odds"] for row in run_stats} == {"0.5", "0.25"}
+    # failed runs are not recorded as completed, so resuming runs them again
+    manifest = RunManifest.find_latest(data_dir, "")
+    assert manifest.completed_runs() == set()
+
+
+def test_batch_run_interrupted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    step = HawkDoveMultipleRiskModel.step
+
+    def interrupted_step(self):
+        # interrupt runs for one parameter set partway through
+        if self.hawk_odds == 0.25 and self.schedule.steps >= 2:
+            raise KeyboardInterrupt
+        step(self)
+
+    monkeypatch.setattr(HawkDoveMultipleRiskModel, "step", interrupted_step)
+    batch_run(
+        {"test": {"grid_size": 3, "hawk_odds": [0.5, 0.25]}},
+        iterations=2,
+        number_processes=1,
+        max_steps=3,
+        progressbar=False,
+        file_prefix="",
+        max_runs=None,
+        param_choice="test",
+        data_collection_schedule=DataCollectionSchedule.END,
+        collect_agent_data=False,
+    )
+    data_dir = tmp_path / "data" / "test"
+    # interrupted runs are not saved or recorded as completed
+    manifest = RunManifest.find_latest(data_dir, "")
+    assert manifest.completed_runs() == {
+        run_key({"grid_size": 3, "hawk_odds": 0.5}, iteration) for iteration in range(2)
+    }
+    (model_file,) = data_dir.glob("*_model.csv")
+    with open(model_file) as model_csv:
+        assert {row["hawk_odds"] for row in csv.DictReader(model_csv)} == {"0.5"}
+
+
+def test_batch_run_timeout(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    step = HawkDoveMultipleRiskModel.step
+
+    def slow_step(self):
+        time.sleep(0.5)
+        step(self)
+
+    monkeypatch.setattr(HawkDoveMultipleRiskModel, "step", slow_step)
+    batch_run(
+        {"test": {"grid_size": 3}},
+        iterations=1,
+        number_processes=1,
+        max_steps=3,
+        progressbar=False,
+        file_prefix="",
+        max_runs=None,
+        param_choice="test",
+        data_collection_schedule=DataCollectionSchedule.END,
+        collect_agent_data=False,
+        run_timeout=0.1,
+    )
+    # batch run stops waiting for runs that take longer than the timeout
+    assert "Timeout error" in capsys.readouterr().out
+    manifest = RunManifest.find_latest(tmp_path / "data" / "test", "")
+    assert manifest.completed_runs() == set()
+
+
+def test_run_chunks_timeout():
+    class Results:
+        def __init__(self):
+            self.timeouts = []
+
+        def next(self, timeout):
+            self.timeouts.append(timeout)
+            raise StopIteration
+
+    class Pool:
+        def __init__(self):
+            self.results = Results()
+
+        def imap_unordered(self, func, chunks):
+            return self.results
+
+    def wait_timeout(chunk_lengths, run_timeout):
+        pool = Pool()
+        chunks = [[None] * length for length in chunk_lengths]
+        assert run_chunks(pool, chunks, None, None, run_timeout)
+        return pool.results.timeouts[0]
+
+    # each run in the longest chunk is allowed the run timeout
+    assert wait_timeout([1, 3], 10) == 30
+    # up to a limit, so chunks of many runs don't wait for hours
+    assert wait_timeout([50, 3], 1001) == max_chunk_timeout
+    # unless a single run is allowed longer
+    assert wait_timeout([1, 2], 2 * max_chunk_timeout) == 2 * max_chunk_timeout
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_batch_run_resume(output_format, tmp_path, monkeypatch):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    monkeypatch.chdir(tmp_path)
+    test_params = {"test": {"grid_size": 3, "hawk_odds": [0.5, 0.25]}}
+    batch_opts = {
+        "iterations": 3,
+        "number_processes": 1,
+        "max_steps": 3,
+        "progressbar": False,
+        "file_prefix": "",
+        "param_choice": "test",
+        "data_collection_schedule": DataCollectionSchedule.END,
+        "collect_agent_data": False,
+        "output_format": output_format,
+    }
+    # simulate an incomplete batch run
+    batch_run(test_params, max_runs=4, **batch_opts)
+    data_dir = tmp_path / "data" / "test"
+    manifest = RunManifest.find_latest(data_dir, "")
+    assert manifest.config["params"] == test_params["test"]
+    assert len(manifest.outputs) == 1
+    assert len(manifest.completed_runs()) == 4
+    seed = manifest.config["seed"]
+    # simulate exiting after saving results for the last run, but before
+    # recording it as completed; its results are removed when resuming
+    completed_lines = manifest.completed_path.read_text().splitlines(keepends=True)
+    manifest.completed_path.write_text("".join(completed_lines[:-1]))
+
+    # options must match to resume
+    with pytest.raises(ValueError, match="collect_agent_data"):
+        batch_run(
+            test_params,
+            max_runs=None,
+            resume=True,
+            **batch_opts | {"collect_agent_data": True},
+        )
+    with pytest.raises(ValueError, match="seed"):
+        batch_run(test_params, max_runs=None, resume=True, seed=seed + 1, **batch_opts)
+    with pytest.raises(ValueError, match="max_steps, engine"):
+        batch_run(
+            test_params,
+            max_runs=None,
+            resume=True,
+            engine="numpy",
+            **batch_opts | {"max_steps": 5},
+        )
+
+    # resume should only run the remaining runs
+    batch_run(test_params, max_runs=None, resume=True, **batch_opts)
+    manifest = RunManifest.find_latest(data_dir, "")
+    assert len(manifest.outputs) == 2
+    # resumed batch run uses the same seed
+    assert manifest.config["seed"] == seed
+    completed = manifest.completed_runs()
+    assert len(completed) == 6
+    assert run_key({"grid_size": 3, "hawk_odds": 0.25}, 2) in completed
+
+    run_ids = []
+    run_seeds = []
+    for output in manifest.outputs:
+        if output_format == "csv":
+            with open(output) as model_csv:
+                for row in csv.DictReader(model_csv):
+                    run_ids.append(int(row["RunId"]))
+                    run_seeds.append(int(row["seed"]))
+        else:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(output)
+            run_ids.extend(table.column("RunId").to_pylist())
+            run_seeds.extend(table.column("seed").to_pylist())
+    assert sorted(run_ids) == list(range(6))
+    # each run is seeded based on batch run seed and run id
+    assert sorted(run_seeds) == sorted(run_seed(seed, run_id) for run_id in range(6))
+
+    # nothing left to run
+    batch_run(test_params, max_runs=None, resume=True, **batch_opts)
+    assert len(RunManifest.find_latest(data_dir, "").outputs) == 2
+
+
+def test_run_manifest_completed_runs(tmp_path):
+    manifest = RunManifest(tmp_path / "test_manifest.json", {})
+    assert manifest.completed_runs() == set()
+    params = {"grid_size": 3, "risk_adjustment": None}
+    run = RunArgs(0, 1, params, 10, DataCollectionSchedule.END, False)
+    manifest.log_completed([run])
+    # partially written line is ignored
+    with open(manifest.completed_path, "a") as completed_file:
+        completed_file.write('{"RunId": 1, "iter')
+    assert manifest.completed_runs() == {run_key(params, 1)}
+
+
+def test_adaptive_iterations():
+    adaptive = AdaptiveIterations(min_iterations=5, ci_width=0.1)
+    for _ in range(4):
+        adaptive.add(0, (2, 0.5))
+    # not enough iterations
+    assert not adaptive.done(0)
+    # unanimous outcomes still have some uncertainty with few iterations
+    adaptive.add(0, (2, 0.5))
+    assert 0.1 < adaptive.interval_width(0) < 0.5
+    assert not adaptive.done(0)
+    for _ in range(25):
+        adaptive.add(0, (2, 0.5))
+    assert adaptive.done(0)
+
+    # mixed outcomes
+    for i in range(30):
+        adaptive.add(1, (i % 3, i / 30))
+    assert adaptive.interval_width(1) > adaptive.interval_width(0)
+    assert not adaptive.done(1)
+
+    params = {"grid_size": 5}
+    pending = {
+        combination: [
+            RunArgs(combination * 100 + i, i, params, 10, None, False)
+            for i in range(30, 40)
+        ]
+        for combination in [0, 1, 2]
+    }
+    wave = adaptive.next_wave(pending)
+    # stopped combination is skipped; combination with no results
+    # (widest interval) is scheduled first
+    assert [run.run_id for run in wave] == list(range(230, 235)) + list(range(130, 135))
+    assert len(pending[1]) == 5
+    assert adaptive.max_remaining(pending) == 10
+
+
+def test_batch_run_adaptive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    test_params = {"test": {"grid_size": 3, "hawk_odds": [0.0, 0.5]}}
+    batch_opts = {
+        "iterations": 12,
+        "number_processes": 1,
+        "max_steps": 3,
+        "progressbar": False,
+        "file_prefix": "",
+        "param_choice": "test",
+        "data_collection_schedule": DataCollectionSchedule.END,
+        "collect_agent_data": False,
+        "seed": 1,
+    }
+    # large interval width: stop after the first wave
+    batch_run(
+        test_params,
+        max_runs=None,
+        adaptive=AdaptiveIterations(min_iterations=4, ci_width=1.0),
+        **batch_opts,
+    )
+    manifest = RunManifest.find_latest(tmp_path / "data" / "test", "")
+    completed = list(manifest.read_completed())
+    assert len(completed) == 8
+    assert all("outcome" in run for run in completed)
+    assert sorted(run["RunId"] % 12 for run in completed) == [0, 0, 1, 1, 2, 2, 3, 3]
+
+    # adaptive options must match to resume
+    with pytest.raises(ValueError, match="adaptive"):
+        batch_run(test_params, max_runs=None, resume=True, **batch_opts)
+
+    # resuming includes outcomes from completed runs, so combinations
+    # that already have precise enough outcomes are not run again
+    adaptive = AdaptiveIterations(min_iterations=4, ci_width=1.0)
+    batch_run(test_params, max_runs=None, resume=True, adaptive=adaptive, **batch_opts)
+    assert len(adaptive.outcomes[0]) == 4
+    assert len(manifest.completed_runs()) == 8
@@ -0,0 +1,222 @@
+import csv
+import itertools
+import os
+import time
+
+import pytest
+
+from simulatingrisk.hawkdovemulti.batch_run import (
+    make_runs,
+    params,
+    run_hawkdovemulti_model,
+)
+from simulatingrisk.hawkdovemulti.distributed import RunQueue, submit, work
+from simulatingrisk.hawkdovemulti.model import (
+    DataCollectionSchedule,
+    HawkDoveMultipleRiskModel,
+)
+
+test_params = {
+    "grid_size": 5,
+    "risk_adjustment": ["adopt", None],
+    "hawk_odds": [0.5, 0.25],
+}
+
+
+@pytest.fixture
+def queue_config():
+    return {
+        "param_choice": "test",
+        "params": test_params,
+        "param_combinations": [{"grid_size": 5, "hawk_odds": 0.5}],
+        "iterations": 3,
+        "max_steps": 3,
+        "data_collection_schedule": "END",
+        "collect_agent_data": False,
+        "engine": "mesa",
+        "output_format": "csv",
+        "seed": 5,
+        "dedupe": True,
+    }
+
+
+def make_queue(path, config):
+    runs = make_runs(
+        config["param_combinations"],
+        config["iterations"],
+        config["seed"],
+        config["max_steps"],
+        DataCollectionSchedule.END,
+        False,
+    )
+    return RunQueue.create(path, runs, config)
+
+
+def test_run_queue_claim(tmp_path, queue_config):
+    queue = make_queue(tmp_path / "queue", queue_config)
+    assert queue.status() == {"pending": 3, "claimed": 0, "done": 0, "failed": 0}
+    # can't create a second queue in the same directory
+    with pytest.raises(ValueError, match="already exists"):
+        make_queue(tmp_path / "queue", queue_config)
+
+    claimed = queue.claim("worker-a", 2)
+    assert len(claimed) == 2
+    # runs are claimed in queue order
+    assert [queue.load_run(path).run_id for path in claimed] == [0, 1]
+    run = queue.load_run(claimed[0])
+    assert run.params == {"grid_size": 5, "hawk_odds": 0.5}
+    assert run.max_steps == 3
+    assert run.data_collection_schedule == DataCollectionSchedule.END
+    assert run.seed is not None
+    # remaining run goes to another worker
+    assert len(queue.claim("worker-b", 2)) == 1
+    assert queue.claim("worker-c") == []
+    assert queue.status() == {"pending": 0, "claimed": 3, "done": 0, "failed": 0}
+
+    queue.complete(claimed[:1])
+    queue.release(claimed[1:])
+    assert queue.status() == {"pending": 1, "claimed": 1, "done": 1, "failed": 0}
+    assert queue.completed_by() == {0: "worker-a"}
+    # requeue runs claimed by a worker that exited
+    assert queue.requeue("worker-a") == 0
+    assert queue.requeue("worker-b") == 1
+    assert queue.status() == {"pending": 2, "claimed": 0, "done": 1, "failed": 0}
+
+
+def test_run_queue_requeue_stale(tmp_path, queue_config):
+    queue = make_queue(tmp_path / "queue", queue_config)
+    (stale,) = queue.claim("worker-a")
+    (active,) = queue.claim("worker-b")
+    (no_heartbeat,) = queue.claim("worker-c")
+    # worker a has not claimed runs or sent a heartbeat recently
+    old_time = time.time() - queue.stale_after - 1
+    queue.heartbeat("worker-a")
+    for path in [stale, queue.worker_dir / "worker-a"]:
+        os.utime(path, (old_time, old_time))
+    # worker b claimed its run long ago, but is still sending heartbeats
+    os.utime(active, (old_time, old_time))
+    queue.heartbeat("worker-b")
+    # worker c claimed its run recently, before its first heartbeat
+
+    # only runs for workers that are not active are returned
+    assert queue.requeue() == 1
+    assert queue.status() == {"pending": 1, "claimed": 2, "done": 0, "failed": 0}
+
+    # a worker that completes a run after it was returned to the queue
+    # takes it back, unless it was claimed by another worker
+    queue.complete([stale])
+    assert queue.status() == {"pending": 0, "claimed": 2, "done": 1, "failed": 0}
+    queue.requeue("worker-b")
+    (reclaimed,) = queue.claim("worker-d")
+    queue.complete([active])
+    queue.complete([reclaimed])
+    assert queue.completed_by() == {0: "worker-a", 1: "worker-d"}
+    assert no_heartbeat.exists()
+
+
+def test_work_and_merge(tmp_path, queue_config):
+    queue = make_queue(tmp_path / "queue", queue_config)
+    # simulate a worker that saved one run but exited before completing it
+    (interrupted,) = queue.claim("worker-a")
+    run = queue.load_run(interrupted)
+    rows, _ = run_hawkdovemulti_model(run)
+    with open(queue.shard_dir / "worker-a_model.csv", "w", newline="") as shard:
+        writer = csv.DictWriter(shard, rows[0].keys())
+        writer.writeheader()
+        writer.writerows(rows)
+    assert queue.requeue("worker-a") == 1
+
+    assert work(queue.path, claim_size=2, worker_id="worker-b") == 3
+    assert queue.status() == {"pending": 0, "claimed": 0, "done": 3, "failed": 0}
+
+    (path,) = queue.merge(tmp_path / "data", "test")
+    assert path == tmp_path / "data" / "test_model.csv"
+    with open(path) as model_csv:
+        model_rows = list(csv.DictReader(model_csv))
+    # each run is included once, from the worker that completed it
+    assert sorted(int(row["RunId"]) for row in model_rows) == [0, 1, 2]
+    # seeds are taken from the queued run specs
+    assert model_rows[0]["seed"] == str(run.seed)
+
+
+def test_work_memory_limit(tmp_path, queue_config, capsys, monkeypatch):
+    # simulate worker memory that grows by more than one MB per check
+    monkeypatch.setattr(
+        "simulatingrisk.hawkdovemulti.batch_run.current_memory",
+        itertools.count(0, 1024**2 + 1).__next__,
+    )
+    queue = make_queue(tmp_path / "queue", queue_config | {"memory_limit": 1})
+    (path,) = queue.claim("worker-a")
+    assert queue.load_run(path).memory_limit == 1024**2
+    queue.release([path])
+
+    assert work(queue.path, worker_id="worker-a") == 0
+    assert "over memory limit" in capsys.readouterr().out
+    # failed runs are recorded as failed, and can be returned to the queue
+    assert queue.status() == {"pending": 0, "claimed": 0, "done": 0, "failed": 3}
+    with open(queue.shard_dir / "worker-a_runs.csv") as stats_csv:
+        run_stats = list(csv.DictReader(stats_csv))
+    assert len(run_stats) == 3
+    assert all(row["failed"] == "True" for row in run_stats)
+    assert queue.retry_failed() == 3
+    assert queue.status() == {"pending": 3, "claimed": 0, "done": 0, "failed": 0}
+
+
+def test_work_interrupted(tmp_path, queue_config, monkeypatch):
+    queue = make_queue(tmp_path / "queue", queue_config)
+    step = HawkDoveMultipleRiskModel.step
+    steps_run = 0
+
+    def interrupted_step(self):
+        # interrupt the second run partway through
+        nonlocal steps_run
+        steps_run += 1
+        if steps_run == 6:
+            raise KeyboardInterrupt
+        step(self)
+
+    monkeypatch.setattr(HawkDoveMultipleRiskModel, "step", interrupted_step)
+    with pytest.raises(KeyboardInterrupt):
+        work(queue.path, claim_size=3, worker_id="worker-a")
+    # interrupted and unstarted runs are returned to the queue;
+    # only the run that finished is completed
+    assert queue.status() == {"pending": 2, "claimed": 0, "done": 1, "failed": 0}
+    assert queue.completed_by() == {0: "worker-a"}
+    with open(queue.shard_dir / "worker-a_model.csv") as shard:
+        assert [row["RunId"] for row in csv.DictReader(shard)] == ["0"]
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_submit(output_format, tmp_path, monkeypatch):
+    if output_format == "parquet":
+        pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setitem(params, "test", test_params)
+    queue = submit(
+        tmp_path / "queue",
+        "test",
+        iterations=2,
+        max_steps=3,
+        data_collection_schedule=DataCollectionSchedule.END,
+        collect_agent_data=True,
+        output_format=output_format,
+        seed=5,
+    )
+    assert queue.status()["pending"] == 8
+    assert queue.config["seed"] == 5
+    assert queue.config["memory_limit"] is None
+    # two workers sharing the queue
+    assert work(queue.path, claim_size=3, worker_id="worker-a") == 8
+    assert work(queue.path, worker_id="worker-b") == 0
+    # each worker records run statistics
+    with open(queue.shard_dir / "worker-a_runs.csv") as stats_csv:
+        assert len(list(csv.DictReader(stats_csv))) == 8
+
+    model_path, agent_path = queue.merge(tmp_path / "data", "test")
+    if output_format == "csv":
+        with open(model_path) as model_csv:
+            assert len(list(csv.DictReader(model_csv))) == 8
+        with open(agent_path) as agent_csv:
+            assert len(list(csv.DictReader(agent_csv))) == 8 * 25
+    else:
+        assert pq.read_table(model_path).num_rows == 8
+        assert pq.read_table(agent_path).num_rows == 8 * 25
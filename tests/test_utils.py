@@ -1,8 +1,13 @@
-from collections import Counter
+from collections import Counter, deque
 import math
+import random
+import statistics
+import time
+
+import mesa
 import pytest
 
-from simulatingrisk.utils import coinflip
+from simulatingrisk.utils import RollingWindow, StepProfile, coinflip, fill_grid
 
 
 test_probabilities = [
@@ -54,3 +59,109 @@ def test_coinflip_choices():
     # we expect an equal distribution of those choices
     for choice in choices:
         assert math.isclose(result_count[choice], 5, abs_tol=total_runs * 0.5)
+
+
+def test_coinflip_rng():
+    # coin flips use the specified random generator, so results
+    # are reproducible with a seeded generator
+    results = [coinflip(rng=random.Random(42)) for _ in range(10)]
+    assert len(set(results)) == 1
+    rng = random.Random(42)
+    expected = [coinflip(rng=rng) for _ in range(10)]
+    rng = random.Random(42)
+    assert [coinflip(rng=rng) for _ in range(10)] == expected
+
+
+def test_rolling_window():
+    window = RollingWindow(3, [0.5, 0.2])
+    assert len(window) == 2
+    assert window.mean() == statistics.mean([0.5, 0.2])
+    assert window.min() == 0.2
+    assert window.max() == 0.5
+    window.append(0.4)
+    window.append(0.3)
+    # oldest value is dropped when the window is full
+    assert list(window) == [0.2, 0.4, 0.3]
+    assert window[-1] == 0.3
+    assert window.min() == 0.2
+    assert window.max() == 0.4
+    window.append(0.35)
+    assert window.min() == 0.3
+    assert not window.is_stable(digits=1)
+
+    assert RollingWindow(5, [0.481, 0.482, 0.483, 0.480]).is_stable(digits=2)
+    assert not RollingWindow(5, [0.49, 0.48, 0.50, 0.47]).is_stable(digits=2)
+
+
+def test_rolling_window_matches_full_calculation():
+    # running statistics should be identical to calculating
+    # over all values in the window
+    values = deque([], maxlen=10)
+    window = RollingWindow(10)
+    for i in range(200):
+        # use a small set of values so there are repeats
+        value = random.randint(0, 20) / 37
+        values.append(value)
+        window.append(value)
+        assert window.mean() == statistics.mean(values)
+        assert window.min() == min(values)
+        assert window.max() == max(values)
+        rounded_set = {round(x, 2) for x in values}
+        assert window.is_stable(digits=2) == (len(rounded_set) == 1)
+
+
+def test_step_profile():
+    profile = StepProfile()
+    for _ in range(3):
+        profile.start("outer")
+        profile.start("inner")
+        profile.stop()
+        profile.stop()
+    assert profile.calls == {"outer": 3, "inner": 3}
+    assert profile.times["outer"] > 0
+    assert profile.times["inner"] > 0
+    # nested time is only counted for the innermost section
+    profile = StepProfile()
+    profile.start("outer")
+    time.sleep(0.01)
+    profile.start("inner")
+    time.sleep(0.1)
+    profile.stop()
+    profile.stop()
+    seconds = profile.seconds()
+    assert seconds["inner"] >= 0.1
+    assert 0.01 <= seconds["outer"] < 0.1
+
+    # disabled profile records nothing
+    profile = StepProfile(enabled=False)
+    profile.start("outer")
+    profile.stop()
+    assert profile.times == {}
+
+
+def test_fill_grid():
+    model = mesa.Model()
+    agents = [mesa.Agent(i, model) for i in range(12)]
+    grid = mesa.space.SingleGrid(4, 3, True)
+    fill_grid(grid, agents, random.Random(1))
+    # every cell has exactly one agent
+    assert sorted(agent.pos for agent in agents) == [
+        (x, y) for x in range(4) for y in range(3)
+    ]
+    assert all(grid[agent.pos] is agent for agent in agents)
+    assert grid.exists_empty_cells() is False
+
+    # placement is random, but reproducible with the same random generator
+    positions = [agent.pos for agent in agents]
+    for seed, same in [(1, True), (2, False)]:
+        grid = mesa.space.SingleGrid(4, 3, True)
+        fill_grid(grid, agents, random.Random(seed))
+        assert ([agent.pos for agent in agents] == positions) is same
+
+    # fewer agents than cells leaves some cells empty
+    grid = mesa.space.SingleGrid(4, 3, True)
+    fill_grid(grid, agents[:5], random.Random(1))
+    assert len(grid.empties) == 7
+
+    with pytest.raises(ValueError, match="Can't place 12 agents"):
+        fill_grid(mesa.space.SingleGrid(2, 2, True), agents, random.Random(1))